@@ -64,8 +64,17 @@ function ChatInterface() {
     setInputValue('');
     setIsLoading(true);
 
+    // 更新最后一条（正在生成的）AI 消息
+    const updateLastMessage = (update) => {
+      setMessages(prev => {
+        const next = [...prev];
+        next[next.length - 1] = { ...next[next.length - 1], ...update(next[next.length - 1]) };
+        return next;
+      });
+    };
+
     try {
-      const response = await fetch(`${process.env.REACT_APP_API_URL}/query`, {
+      const response = await fetch(`${process.env.REACT_APP_API_URL}/query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -73,16 +82,51 @@ function ChatInterface() {
         body: JSON.stringify({ query: inputValue }),
       });
 
-      const data = await response.json();
-      
-      const aiResponse = {
-        text: data.answer,
-        sender: 'ai',
-        timestamp: new Date().toISOString(),
-        sourceType: data.source_type, // 添加来源类型
-      };
-      
-      setMessages(prev => [...prev, aiResponse]);
+      if (!response.ok || !response.body) {
+        throw new Error(`请求失败: ${response.status}`);
+      }
+
+      // 读取 Server-Sent Events：route -> sources -> token... -> done
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const rawEvent of events) {
+          let eventName = 'message';
+          let data = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event: ')) eventName = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          }
+          const payload = data ? JSON.parse(data) : {};
+
+          if (eventName === 'error') {
+            throw new Error(payload.detail || '查询失败');
+          }
+          if (eventName === 'route' && !started) {
+            started = true;
+            setIsLoading(false);
+            setMessages(prev => [...prev, {
+              text: '',
+              sender: 'ai',
+              timestamp: new Date().toISOString(),
+              sourceType: payload.source_type, // 添加来源类型
+            }]);
+          } else if (eventName === 'token') {
+            updateLastMessage(message => ({ text: message.text + payload.content }));
+          } else if (eventName === 'done') {
+            updateLastMessage(() => ({ text: payload.answer }));
+          }
+        }
+      }
     } catch (error) {
       console.error('查询失败:', error);
       const errorMessage = {
@@ -2,10 +2,47 @@ import React, { useCallback, useState } from 'react';
 import { useDropzone } from 'react-dropzone';
 import { CloudArrowUpIcon } from '@heroicons/react/24/outline';
 
+const STAGE_LABELS = {
+  parse: '解析文档',
+  split: '分割文本',
+  embed: '计算向量',
+  index: '写入索引',
+  register: '登记文档',
+  keywords: '提取关键词',
+  components: '提取组件',
+  remove: '删除文档',
+};
+
 function FileUpload() {
   const [uploadStatus, setUploadStatus] = useState('');
   const [error, setError] = useState('');
 
+  // 轮询后台导入任务的状态
+  const pollJob = useCallback((jobId) => {
+    fetch(`${process.env.REACT_APP_API_URL}/jobs/${jobId}`)
+      .then(response => response.json())
+      .then(job => {
+        if (job.status === 'completed') {
+          setUploadStatus('上传成功！');
+        } else if (job.status === 'failed') {
+          setError(job.error || '处理失败，请重试');
+          setUploadStatus('');
+        } else {
+          const stage = STAGE_LABELS[job.stage] || '排队中';
+          const progress = job.stage === 'keywords' && job.keyword_chunks_total
+            ? ` (${job.keyword_chunks_done}/${job.keyword_chunks_total})`
+            : '';
+          setUploadStatus(`正在处理：${stage}${progress}...`);
+          setTimeout(() => pollJob(jobId), 1000);
+        }
+      })
+      .catch(error => {
+        console.error('Failed to fetch job status:', error);
+        setError('获取处理进度失败');
+        setUploadStatus('');
+      });
+  }, []);
+
   const onDrop = useCallback((acceptedFiles) => {
     // 重置状态
     setUploadStatus('');
@@ -33,15 +70,16 @@ function FileUpload() {
       return response.json();
     })
     .then(data => {
-      console.log('Upload successful:', data);
-      setUploadStatus('上传成功！');
+      console.log('Upload accepted:', data);
+      setUploadStatus('已上传，正在处理...');
+      pollJob(data.job_id);
     })
     .catch(error => {
       console.error('Upload failed:', error);
       setError(error.message || '上传失败，请重试');
       setUploadStatus('');
     });
-  }, []);
+  }, [pollJob]);
 
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
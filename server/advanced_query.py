@@ -1,39 +1,256 @@
-from typing import List, Optional
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from pydantic import BaseModel
 from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
-from langchain_chroma import Chroma
 from langchain_core.messages import HumanMessage
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from logger_config import setup_logger
+from logger_config import SAMPLED, setup_logger
+from keyword_store import CorpusFingerprint, KeywordStore
+from rate_limiter import RateLimiter, call_with_retry, estimate_tokens
+from executors import run_in_thread
+from semantic_cache import SemanticCache
+from keyword_index import KeywordIndex
+from lexical_index import LexicalIndex, LexicalStore
+from embedding_cache import content_hash
+from embedding_backends import load_encoder_model
+from singleflight import Debouncer, SingleFlight
+from metrics import ANSWER_TOKENS, QUERIES_TOTAL, QUERY_STAGE_SECONDS, record_llm_usage, timed
+from context_builder import ContextBuilder
+from component_index import Component, ComponentIndex, ComponentStore, component_text, merge_components, parse_components
+from usage_store import usage_context
+from vector_partitions import QueryFilter, SearchScope, VectorPartitions, combine_where
+
+if TYPE_CHECKING:
+    # 只用于类型注解，运行时不导入 OpenAI 和 Chroma 客户端
+    from langchain_openai import ChatOpenAI
+    from langchain_chroma import Chroma
+    from document_registry import DocumentRegistry
 
 # 设置日志记录器
 logger = setup_logger('query_engine')
 
+# 每个块提取关键词时预留的输出 token 数
+KEYWORD_COMPLETION_TOKENS = 200
+
+# 每段组件提取文本的最大字符数，以及预留的输出 token 数
+COMPONENT_SEGMENT_CHARS = 4000
+COMPONENT_COMPLETION_TOKENS = 400
+
+# 词法快速路径要求第一名的 BM25 分数至少是第二名的倍数，避免常见词命中大量块时误判
+LEXICAL_FAST_PATH_MARGIN = 1.5
+
+# 按来源类型或页码过滤词法命中时，先多取的候选倍数
+FILTERED_LEXICAL_FACTOR = 5
+
 class QueryResult(BaseModel):
     answer: str
     source_documents: List[str]
     confidence: float
-    source_type: str  # "document", "llm", or "hybrid"
+    source_type: str  # "document", "llm", "hybrid", or "component"
+    matched_components: List[Component] = []  # 组件感知查询匹配到的组件
+    prompt_tokens: int = 0  # 本次请求调用 LLM 的 token 数，直接返回文档或命中缓存时为 0
+    completion_tokens: int = 0
+    context_tokens: int = 0  # 提示词中文档上下文的 token 数
+
+    def token_usage(self) -> dict:
+        """接口返回的 token 用量"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "context_tokens": self.context_tokens,
+        }
+
+    def served_from_cache(self) -> "QueryResult":
+        """从回答缓存返回的结果，本次请求没有消耗 token"""
+        return self.model_copy(update={"prompt_tokens": 0, "completion_tokens": 0, "context_tokens": 0})
+
+class DocumentChange:
+    """document_change() 期间收集的变化：被删除的块，以及是否有新增内容"""
+
+    def __init__(self, doc_id: str):
+        self.doc_id = doc_id
+        self.removed_chunks: Set[str] = set()
+        self.added = False
+        self.closed = False
+
+# 当前正在处理的文档变化，由 document_change() 设置
+_document_change: contextvars.ContextVar[Optional[DocumentChange]] = contextvars.ContextVar(
+    "document_change", default=None
+)
+
+class QueryRoute(BaseModel):
+    """查询的路由结果：document 直接返回 answer，hybrid/llm 需要用 prompt 调用 LLM"""
+    source_type: str
+    confidence: float
+    source_documents: List[str]
+    answer: Optional[str] = None
+    prompt: Optional[str] = None
+    context_tokens: int = 0
+
+# 混合模式的提示词
+HYBRID_PROMPT = """基于以下文档内容回答用户问题。如果内容与问题不够相关，请说明无法从文档中找到相关信息。
+
+                        文档内容：
+                        {context}
+
+                        用户问题：{query}"""
+
+# 组件感知查询的提示词
+COMPONENT_PROMPT = """基于以下组件说明和文档内容回答用户问题。如果内容与问题不够相关，请说明无法从文档中找到相关信息。
+
+                        相关组件：
+                        {components}
+
+                        文档内容：
+                        {context}
+
+                        用户问题：{query}"""
+
+# 从文本中提取组件的提示词
+COMPONENT_EXTRACTION_PROMPT = """
+                    请找出以下文本中有明确名称的组件，例如模块、类、函数、服务、接口、配置项或硬件部件。
+                    每行返回一个组件，格式为“名称: 一句话描述”，不要有任何其他说明；没有组件时返回空。
+
+                    文本内容：
+                    {text}
+                    """
 
 class AdvancedQueryEngine:
     def __init__(
         self,
-        vectordb: Chroma,
-        llm: ChatOpenAI,
+        vectordb: "Chroma",
+        llm: "ChatOpenAI",
         similarity_threshold: float = 0.8,
+        keyword_store: Optional[KeywordStore] = None,
+        encoder_model: str = 'all-MiniLM-L6-v2',
+        keyword_concurrency: int = 4,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 5,
+        answer_cache: Optional[SemanticCache] = None,
+        keyword_index: Optional[KeywordIndex] = None,
+        keyword_debounce_seconds: float = 2.0,
+        lexical_store: Optional[LexicalStore] = None,
+        lexical_fast_path_threshold: Optional[float] = 0.9,
+        fusion_candidates: int = 10,
+        rrf_k: int = 60,
+        reuse_query_embeddings: bool = False,
+        context_builder: Optional[ContextBuilder] = None,
+        context_candidates: int = 5,
+        component_store: Optional[ComponentStore] = None,
+        component_extraction: bool = True,
+        component_threshold: float = 0.4,
+        component_matches: int = 5,
+        partitions: Optional[VectorPartitions] = None,
+        document_registry: Optional["DocumentRegistry"] = None,
     ):
         self.vectordb = vectordb
+        # 检索和读取块都经过分区，不分区时只有原来的集合
+        self.partitions = partitions or VectorPartitions(vectordb)
+        self.document_registry = document_registry  # 按文档限定检索范围时用于查找文档的块
         self.llm = llm
         self.similarity_threshold = similarity_threshold
-        self.keywords = []  # 存储关键词列表
-        self.keyword_embeddings = []  # 存储关键词的向量表示
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')  # 用于计算文本相似度
+        self.keyword_store = keyword_store
+        self.encoder_model = encoder_model
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self._keyword_semaphore = asyncio.Semaphore(max(1, keyword_concurrency))
+        self._keyword_lock = asyncio.Lock()
+        self.answer_cache = answer_cache
+        self.index_version = 0  # 文档或关键词变化时递增，用于使回答缓存失效
+        self.inflight_queries = SingleFlight()  # 合并相同的并发查询
+        self._rebuild_lock = asyncio.Lock()  # 串行化关键词库的重建和按文档替换
+        self._save_debouncer = Debouncer(self._save_keywords_async, keyword_debounce_seconds, "keyword save")
+        self._rebuild_debouncer = Debouncer(self.update_keywords_from_docs, keyword_debounce_seconds, "keyword rebuild")
+        self.keyword_index = keyword_index or KeywordIndex()  # 关键词及其归一化向量
+        self.keyword_sources: Dict[str, Set[str]] = {}  # 关键词 -> 来源文档ID集合
+        self.keyword_version = 0  # 当前关键词库对应的磁盘版本号
+        self.lexical_index = LexicalIndex()  # 块内容的 BM25 倒排索引
+        self._corpus: Optional[CorpusFingerprint] = None  # 语料指纹，第一次使用时读取所有块ID计算，之后随块的增删更新
+        self.lexical_store = lexical_store
+        self.lexical_version = 0
+        self.lexical_fast_path_threshold = lexical_fast_path_threshold  # None 表示关闭词法快速路径
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        # 向量库与查询路由使用同一个本地模型时，检索直接复用路由时计算的查询向量
+        self.reuse_query_embeddings = reuse_query_embeddings
+        # 混合模式在 token 预算内从前 context_candidates 个检索结果拼接上下文
+        self.context_builder = context_builder or ContextBuilder()
+        self.context_candidates = max(3, context_candidates)
+        self._lexical_save_debouncer = Debouncer(
+            lambda: run_in_thread(self.save_lexical_index), keyword_debounce_seconds, "lexical index save"
+        )
+        # 组件索引：导入时提取组件，查询时匹配组件后只在它们引用的块中检索
+        self.component_store = component_store
+        self.component_extraction = component_extraction
+        self.component_threshold = component_threshold
+        self.component_matches = component_matches
+        self.component_index = ComponentIndex()
+        self.component_version = 0
+        self._component_lock = asyncio.Lock()
+        self._component_save_debouncer = Debouncer(
+            lambda: run_in_thread(self.save_components), keyword_debounce_seconds, "component index save"
+        )
+        self._encoder = None  # 用于计算文本相似度，首次使用时加载
+
+    @property
+    def encoder(self):
+        """句向量模型，首次访问时才导入 sentence-transformers 并加载模型"""
+        if self._encoder is None:
+            self._encoder = load_encoder_model(self.encoder_model)
+        return self._encoder
+
+    @property
+    def llm_model(self) -> str:
+        """用量记录中的模型名称"""
+        return getattr(self.llm, "model_name", None) or type(self.llm).__name__
+
+    def load_encoder(self):
+        """预先加载句向量模型，在启动预热时调用"""
+        return self.encoder
         
-    async def extract_keywords(self, text: str) -> List[str]:
-        """从文本中提取关键词"""
+    async def _extract_chunk_keywords(self, chunk: str) -> List[str]:
+        """对单个文本块调用 LLM 提取关键词，受并发数和 RPM/TPM 配额限制"""
+        prompt = f"""
+                    请从以下文本中提取10-15个最重要的关键词或短语。
+                    这些关键词应该能够概括文本的主要内容。
+                    只需要返回关键词列表，每行一个关键词，不要有任何其他说明或标点符号。
+                    
+                    文本内容：
+                    {chunk}
+                    """
+        response = await self._invoke_with_limits(prompt, "keywords", KEYWORD_COMPLETION_TOKENS)
+        return response.strip().split('\n')
+
+    async def _invoke_with_limits(self, prompt: str, purpose: str, completion_tokens: int) -> str:
+        """导入时的 LLM 调用：受并发数和 RPM/TPM 配额限制，失败时重试，返回生成的文本"""
+        messages = [HumanMessage(content=prompt)]
+        async with self._keyword_semaphore:
+            start = time.perf_counter()
+            response = await call_with_retry(
+                lambda: self.llm.ainvoke(messages),
+                rate_limiter=self.rate_limiter,
+                tokens=estimate_tokens(prompt) + completion_tokens,
+                max_retries=self.max_retries,
+            )
+        record_llm_usage(
+            purpose, prompt, response.content, response.usage_metadata,
+            model=self.llm_model, latency=time.perf_counter() - start
+        )
+        return response.content
+
+    async def extract_keywords(
+        self,
+        text: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> List[str]:
+        """从文本中提取关键词，各文本块并发处理"""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
         # 使用文本分割器将文本分成更小的块
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=4000,  # 每块约4000字符
@@ -43,87 +260,563 @@ class AdvancedQueryEngine:
         chunks = text_splitter.split_text(text)
         logger.info(f"Split text into {len(chunks)} chunks for keyword extraction")
         
-        all_keywords = set()  # 使用集合来去重
-        
-        for i, chunk in enumerate(chunks, 1):
+        results: List[List[str]] = [[] for _ in chunks]
+        completed = 0
+
+        async def process(i: int, chunk: str):
+            nonlocal completed
             try:
-                # 对每个块提取关键词
-                messages = [
-                    HumanMessage(content=f"""
-                    请从以下文本中提取10-15个最重要的关键词或短语。
-                    这些关键词应该能够概括文本的主要内容。
-                    只需要返回关键词列表，每行一个关键词，不要有任何其他说明或标点符号。
-                    
-                    文本内容：
-                    {chunk}
-                    """)
-                ]
-                
-                response = await self.llm.ainvoke(messages)
-                keywords = response.content.strip().split('\n')
-                all_keywords.update(keywords)  # 添加到集合中
-                logger.info(f"Processed chunk {i}/{len(chunks)}, extracted {len(keywords)} keywords")
-                
+                results[i] = await self._extract_chunk_keywords(chunk)
+                logger.info(
+                    "Processed chunk %d/%d, extracted %d keywords", i + 1, len(chunks), len(results[i]), extra=SAMPLED
+                )
             except Exception as e:
-                logger.error(f"Error processing chunk {i}/{len(chunks)}: {str(e)}")
-                continue
+                # 失败的块直接跳过，不影响其他块
+                logger.error(f"Error processing chunk {i + 1}/{len(chunks)}: {str(e)}")
+            finally:
+                completed += 1
+                if progress_callback:
+                    progress_callback(completed, len(chunks))
+
+        await asyncio.gather(*(process(i, chunk) for i, chunk in enumerate(chunks)))
         
-        # 将集合转换回列表并返回
-        final_keywords = list(all_keywords)
+        # 按块顺序去重
+        final_keywords = list(dict.fromkeys(k for keywords in results for k in keywords))
         logger.info(f"Total unique keywords extracted: {len(final_keywords)}")
         return final_keywords
 
+    @staticmethod
+    def get_doc_id(metadata: Optional[dict]) -> str:
+        """从块的元数据中取得所属文档ID"""
+        metadata = metadata or {}
+        if metadata.get("doc_id"):
+            return metadata["doc_id"]
+        if metadata.get("source"):
+            return os.path.basename(metadata["source"])
+        return "unknown"
+
+    @property
+    def keywords(self) -> List[str]:
+        """当前的关键词列表"""
+        return self.keyword_index.keywords
+
+    def notify_index_changed(self, removed_chunks: Optional[Iterable[str]] = None):
+        """文档集合或关键词库发生变化
+
+        removed_chunks 为 None 表示有新增或未知的变化，之前缓存的回答全部失效；
+        只删除了块（或只删除了关键词）时传入被删除的块，只淘汰引用了这些块的回答。
+        在 document_change() 中发生的变化合并到结束时一起处理。
+        """
+        change = _document_change.get()
+        # 在 document_change() 中创建、结束后才执行的后台任务（如防抖保存）按普通变化处理
+        if change is not None and not change.closed:
+            if removed_chunks is None:
+                change.added = True
+            else:
+                change.removed_chunks.update(removed_chunks)
+            return
+        if removed_chunks is None:
+            self.index_version += 1
+            return
+        self._apply_change(set(removed_chunks), include_unsourced=False)
+
+    def _apply_change(self, removed_chunks: Set[str], include_unsourced: bool):
+        previous = self.index_version
+        self.index_version += 1
+        if self.answer_cache:
+            self.answer_cache.invalidate_chunks(removed_chunks, previous, self.index_version, include_unsourced)
+
+    @contextmanager
+    def document_change(self, doc_id: str):
+        """导入、替换或删除一个文档的过程中，回答缓存只淘汰受这个文档影响的回答
+
+        被删除的块引用的回答一律淘汰；有新增内容时，没有引用文档的回答（可能可以由新内容回答）也淘汰；
+        其他文档的回答保留。这是近似：新内容也可能改变其他查询的检索排名。
+        """
+        change = DocumentChange(doc_id)
+        token = _document_change.set(change)
+        try:
+            yield change
+        finally:
+            change.closed = True
+            _document_change.reset(token)
+            if change.added or change.removed_chunks:
+                self._apply_change(change.removed_chunks, include_unsourced=change.added)
+
+    def _reset_keywords(self):
+        """清空关键词库"""
+        self.keyword_index.clear()
+        self.keyword_sources = {}
+        self.notify_index_changed()
+
+    async def _merge_keywords(self, doc_id: str, keywords: List[str]):
+        """将某个文档的关键词合并到关键词库中，只为新关键词计算向量"""
+        # 计算向量时会让出事件循环，加锁避免并发合并产生重复关键词
+        async with self._keyword_lock:
+            new_keywords = []
+            for keyword in keywords:
+                keyword = keyword.strip()
+                if not keyword:
+                    continue
+                if keyword in self.keyword_sources:
+                    self.keyword_sources[keyword].add(doc_id)
+                elif keyword not in new_keywords:
+                    new_keywords.append(keyword)
+
+            if not new_keywords:
+                return
+
+            new_embeddings = await run_in_thread(self.encoder.encode, new_keywords)
+            self.keyword_index.add(new_keywords, new_embeddings)
+            for keyword in new_keywords:
+                self.keyword_sources[keyword] = {doc_id}
+            self.notify_index_changed()
+            logger.info(f"Merged {len(new_keywords)} new keywords from document {doc_id}")
+
+    async def add_document_keywords(
+        self,
+        doc_id: str,
+        texts: List[str],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ):
+        """只对新增文档的块提取关键词，并增量合并到关键词库，与全量重建互斥
+
+        重建会先清空关键词库，并发合并的关键词可能被清掉，因此等待正在进行的重建完成后再合并。
+        """
+        async with self._rebuild_lock:
+            await self._add_document_keywords(doc_id, texts, progress_callback)
+
+    async def _add_document_keywords(
+        self,
+        doc_id: str,
+        texts: List[str],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ):
+        """调用方需持有 _rebuild_lock"""
+        if not texts:
+            return
+        keywords = await self.extract_keywords(" ".join(texts), progress_callback)
+        await self._merge_keywords(doc_id, keywords)
+        logger.info(f"Keyword index now holds {len(self.keywords)} keywords")
+
+    async def remove_document_keywords(self, doc_id: str):
+        """移除某个文档贡献的关键词，其他文档仍在使用的关键词会被保留
+
+        新索引（超过阈值时包括 HNSW 索引）在线程池中构建后整体替换，不阻塞事件循环；
+        与合并关键词互斥，构建期间合并的关键词不会丢失。
+        """
+        async with self._keyword_lock:
+            keep = []
+            for keyword in self.keywords:
+                sources = self.keyword_sources.get(keyword, set())
+                sources.discard(doc_id)
+                if sources:
+                    keep.append(True)
+                else:
+                    self.keyword_sources.pop(keyword, None)
+                    keep.append(False)
+
+            removed = keep.count(False)
+            if not removed:
+                return
+
+            self.keyword_index = await run_in_thread(self.keyword_index.without, np.array(keep, dtype=bool))
+        # 关键词减少只会降低查询与关键词的相似度，已缓存的回答仍然有效
+        self.notify_index_changed(removed_chunks=())
+        logger.info(f"Removed {removed} keywords of document {doc_id}")
+
+    async def replace_document_keywords(
+        self,
+        doc_id: str,
+        texts: List[str],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ):
+        """替换某个文档的关键词：先移除旧的，再从新内容中提取，与全量重建互斥"""
+        async with self._rebuild_lock:
+            await self.remove_document_keywords(doc_id)
+            await self._add_document_keywords(doc_id, texts, progress_callback)
+
+    async def copy_document_keywords(self, source: str, doc_id: str) -> int:
+        """内容与 source 相同的文档直接沿用它的关键词，不调用 LLM，返回沿用的关键词数"""
+        async with self._rebuild_lock:
+            await self.remove_document_keywords(doc_id)
+            async with self._keyword_lock:
+                copied = 0
+                for sources in self.keyword_sources.values():
+                    if source in sources:
+                        sources.add(doc_id)
+                        copied += 1
+        if copied:
+            logger.info(f"Document {doc_id} reuses {copied} keywords of identical document {source}")
+        return copied
+
+    async def remove_document(self, doc_id: str):
+        """移除文档的关键词和组件，与全量重建互斥；块由调用方从向量数据库删除后通过 remove_chunks() 移除"""
+        async with self._rebuild_lock:
+            await self.remove_document_keywords(doc_id)
+        self.schedule_keywords_save()
+        await self.remove_document_components(doc_id)
+
+    def load_keywords(self, verify_corpus: bool = True) -> bool:
+        """从磁盘加载关键词库，语料或模型未变化时返回 True
+
+        verify_corpus 为 False 时不校验语料指纹，直接使用负责导入的进程保存的最新版本。
+        """
+        if not self.keyword_store:
+            return False
+
+        fingerprint = self.corpus_fingerprint() if verify_corpus else None
+        loaded = self.keyword_store.load(self.encoder_model, fingerprint)
+        if loaded is None:
+            return False
+
+        keywords, sources, embeddings, version = loaded
+        # 在新的索引对象中构建后整体替换，后台刷新时正在执行的查询不会看到构建到一半的索引
+        index = KeywordIndex(
+            dtype=self.keyword_index.dtype,
+            ann_threshold=self.keyword_index.ann_threshold,
+            ann_ef=self.keyword_index.ann_ef
+        )
+        index.set(keywords, embeddings)
+        self.keyword_index, self.keyword_sources, self.keyword_version = index, sources, version
+        self.notify_index_changed()
+        logger.info(f"Loaded {len(self.keywords)} keywords from disk (version {self.keyword_version})")
+        return True
+
+    def refresh_keywords(self) -> bool:
+        """磁盘上有其他进程保存的新版本时重新加载，返回是否加载了新版本"""
+        if not self.keyword_store or self.keyword_store.current_version() <= self.keyword_version:
+            return False
+        # 新版本由其他进程在语料变化后保存，本进程记录的语料指纹已经过期
+        self._corpus = None
+        return self.load_keywords(verify_corpus=False)
+
+    def save_keywords(self):
+        """将当前关键词库与语料指纹一起保存到磁盘"""
+        if not self.keyword_store:
+            return
+
+        try:
+            self.keyword_version = self.keyword_store.save(
+                self.keywords,
+                self.keyword_sources,
+                self.keyword_index.embeddings,
+                self.encoder_model,
+                self.corpus_fingerprint().value,
+            )
+        except Exception as e:
+            logger.error(f"Error saving keywords: {str(e)}")
+
+    async def _save_keywords_async(self):
+        await run_in_thread(self.save_keywords)
+
+    def schedule_keywords_save(self) -> asyncio.Future:
+        """防抖保存关键词库：短时间内连续的多次更新只写一次磁盘"""
+        return self._save_debouncer.trigger()
+
+    def request_keyword_rebuild(self) -> asyncio.Future:
+        """请求全量重建关键词库：短时间内的多次请求合并为一次重建"""
+        return self._rebuild_debouncer.trigger()
+
+    async def flush(self):
+        """立即执行尚未执行的关键词重建和保存，关闭前调用"""
+        await self._rebuild_debouncer.flush()
+        await self._save_debouncer.flush()
+        await self._lexical_save_debouncer.flush()
+        await self._component_save_debouncer.flush()
+
+    def corpus_fingerprint(self) -> CorpusFingerprint:
+        """当前语料的指纹；第一次调用时读取向量数据库中的所有块ID，之后由 index_chunks / remove_chunks 增量更新
+
+        第一次调用应在开始导入之前（启动校验或接管导入时），否则计算期间写入的块可能被重复计入。
+        """
+        if self._corpus is None:
+            self._corpus = CorpusFingerprint.of(self.partitions)
+        return self._corpus
+
+    async def index_chunks(self, ids: List[str], texts: List[str]):
+        """将新写入向量数据库的块加入词法索引，索引文件延迟保存"""
+        # 词法索引与语料包含同样的块，第一次加入词法索引的块就是语料中新增的块
+        added = await run_in_thread(self.lexical_index.add, ids, texts)
+        if added:
+            if self._corpus is not None:
+                self._corpus.add(added)
+            self.notify_index_changed()
+            self._lexical_save_debouncer.trigger()
+
+    async def remove_chunks(self, ids: List[str]):
+        """将已从向量数据库删除的块移出词法索引，引用这些块的缓存回答失效"""
+        removed = await run_in_thread(self.lexical_index.remove, ids)
+        if removed:
+            if self._corpus is not None:
+                self._corpus.remove(removed)
+            self._lexical_save_debouncer.trigger()
+        self.notify_index_changed(removed_chunks=ids)
+
+    def load_lexical_index(self, verify_corpus: bool = True) -> bool:
+        """从磁盘加载词法索引，语料未变化时返回 True；verify_corpus 为 False 时不校验语料指纹"""
+        if not self.lexical_store:
+            return False
+        fingerprint = self.corpus_fingerprint() if verify_corpus else None
+        loaded = self.lexical_store.load(fingerprint)
+        if loaded is None:
+            return False
+        self.lexical_index, self.lexical_version = loaded
+        self.notify_index_changed()
+        logger.info(f"Loaded lexical index with {len(self.lexical_index)} chunks (version {self.lexical_version})")
+        return True
+
+    def refresh_lexical_index(self) -> bool:
+        """磁盘上有其他进程保存的新版本时应用新的增量，重新写入了完整索引时重新加载"""
+        if not self.lexical_store or self.lexical_store.current_version() <= self.lexical_version:
+            return False
+        version = self.lexical_store.update(self.lexical_index, self.lexical_version)
+        self._corpus = None  # 其他进程修改了语料
+        if version is None:
+            return self.load_lexical_index(verify_corpus=False)
+        self.lexical_version = version
+        self.notify_index_changed()
+        logger.info(f"Updated lexical index to version {version} ({len(self.lexical_index)} chunks)")
+        return True
+
+    def rebuild_lexical_index(self):
+        """从向量数据库中的所有块重建词法索引，不调用 LLM 和向量 API"""
+        results = self.partitions.get(include=["documents"])
+        index = LexicalIndex(k1=self.lexical_index.k1, b=self.lexical_index.b)
+        index.add(results["ids"], results["documents"])
+        self.lexical_index = index
+        self._corpus = CorpusFingerprint(results["ids"])
+        self.notify_index_changed()
+        logger.info(f"Rebuilt lexical index with {len(index)} chunks")
+        self.save_lexical_index()
+
+    def save_lexical_index(self):
+        """将词法索引与语料指纹一起保存到磁盘"""
+        if not self.lexical_store:
+            return
+        try:
+            self.lexical_version = self.lexical_store.save(self.lexical_index, self.corpus_fingerprint().value)
+        except Exception as e:
+            logger.error(f"Error saving lexical index: {str(e)}")
+
+    async def extract_components(self, doc_id: str, chunks: List[Tuple[str, str]]) -> List[Component]:
+        """从文档的块 [(块ID, 内容)] 中提取组件，按长度分段后各段并发调用 LLM"""
+        segments: List[List[Tuple[str, str]]] = [[]]
+        length = 0
+        for chunk_id, text in chunks:
+            if segments[-1] and length + len(text) > COMPONENT_SEGMENT_CHARS:
+                segments.append([])
+                length = 0
+            segments[-1].append((chunk_id, text))
+            length += len(text)
+
+        async def process(i: int, segment: List[Tuple[str, str]]) -> List[Component]:
+            prompt = COMPONENT_EXTRACTION_PROMPT.format(text="\n".join(text for _, text in segment))
+            try:
+                response = await self._invoke_with_limits(prompt, "components", COMPONENT_COMPLETION_TOKENS)
+                return parse_components(response, doc_id, segment)
+            except Exception as e:
+                # 失败的段直接跳过，不影响其他段
+                logger.error(f"Error extracting components from segment {i + 1}/{len(segments)}: {str(e)}")
+                return []
+
+        results = await asyncio.gather(*(process(i, segment) for i, segment in enumerate(segments) if segment))
+        components = merge_components([c for result in results for c in result])
+        logger.info(f"Extracted {len(components)} components from document {doc_id}")
+        return components
+
+    def has_components(self, doc_id: str) -> bool:
+        return doc_id in self.component_index.documents()
+
+    async def replace_document_components(self, doc_id: str, chunks: List[Tuple[str, str]]):
+        """重新提取某个文档的组件并替换索引中该文档原有的组件，索引文件延迟保存"""
+        components = await self.extract_components(doc_id, chunks)
+        embeddings = await run_in_thread(self.encoder.encode, [component_text(c) for c in components]) \
+            if components else None
+        async with self._component_lock:
+            self.component_index.remove_document(doc_id)
+            self.component_index.add(components, embeddings)
+        self.notify_index_changed()
+        self._component_save_debouncer.trigger()
+
+    async def copy_document_components(self, source: str, doc_id: str):
+        """内容与 source 相同的文档直接沿用它的组件和组件向量，不调用 LLM"""
+        async with self._component_lock:
+            self.component_index.remove_document(doc_id)
+            copied = self.component_index.copy_document(source, doc_id)
+        self.notify_index_changed()
+        self._component_save_debouncer.trigger()
+        logger.info(f"Document {doc_id} reuses {copied} components of identical document {source}")
+
+    async def remove_document_components(self, doc_id: str):
+        """移除某个文档的组件，索引文件延迟保存"""
+        async with self._component_lock:
+            removed = self.component_index.remove_document(doc_id)
+        if removed:
+            self.notify_index_changed(removed_chunks=())
+            self._component_save_debouncer.trigger()
+
+    def load_components(self) -> bool:
+        """从磁盘加载组件索引；向量缺失或由其他句向量模型计算时重新计算向量（不需要再次调用 LLM）"""
+        if not self.component_store:
+            return False
+        loaded = self.component_store.load()
+        if loaded is None:
+            return False
+        components, embeddings, model_name, version = loaded
+        if components and (embeddings is None or model_name != self.encoder_model):
+            logger.info(f"Re-encoding {len(components)} components with {self.encoder_model}")
+            embeddings = self.encoder.encode([component_text(c) for c in components])
+        index = ComponentIndex(dtype=self.keyword_index.dtype)
+        index.set(components, embeddings)
+        self.component_index, self.component_version = index, version
+        self.notify_index_changed()
+        logger.info(f"Loaded {len(components)} components from disk (version {version})")
+        return True
+
+    def refresh_components(self) -> bool:
+        """磁盘上有其他进程保存的新版本时重新加载"""
+        if not self.component_store or self.component_store.current_version() <= self.component_version:
+            return False
+        return self.load_components()
+
+    def save_components(self):
+        if not self.component_store:
+            return
+        try:
+            self.component_version = self.component_store.save(
+                self.component_index.components, self.component_index.embeddings, self.encoder_model
+            )
+        except Exception as e:
+            logger.error(f"Error saving component index: {str(e)}")
+
+    def get_chunks(self, ids: List[str]) -> List[Document]:
+        """按块ID从向量数据库读取块内容，顺序与 ids 一致，不计算向量"""
+        if not ids:
+            return []
+        results = self.partitions.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=content, metadata=metadata or {})
+            for chunk_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        }
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def is_confident_lexical_hit(self, hits: List[Tuple[str, float, float]]) -> bool:
+        """第一名覆盖了几乎所有查询词且明显领先第二名时，认为词法命中足够确定"""
+        if not hits or self.lexical_fast_path_threshold is None:
+            return False
+        if hits[0][2] < self.lexical_fast_path_threshold:
+            return False
+        return len(hits) == 1 or hits[0][1] >= LEXICAL_FAST_PATH_MARGIN * hits[1][1]
+
+    def _lexical_route(self, hits: List[Tuple[str, float, float]], docs: List[Document]) -> QueryRoute:
+        return QueryRoute(
+            source_type="document",
+            confidence=hits[0][2],
+            source_documents=[doc.page_content for doc in docs],
+            answer=docs[0].page_content
+        )
+
+    def fuse_results(
+        self,
+        vector_docs: List[Tuple[Document, float]],
+        lexical_hits: List[Tuple[str, float, float]],
+        k: int = 3,
+    ) -> List[Tuple[str, float]]:
+        """倒数排名融合（RRF）：按 sum(1 / (rrf_k + 名次)) 合并向量和词法检索结果，返回前 k 个 (块ID, 融合分数)"""
+        scores: Dict[str, float] = {}
+        for rank, (doc, _) in enumerate(vector_docs):
+            chunk_id = content_hash(doc.page_content)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _, _) in enumerate(lexical_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def _fused_documents(
+        self,
+        vector_docs: List[Tuple[Document, float]],
+        lexical_hits: List[Tuple[str, float, float]],
+        k: int = 3,
+    ) -> List[Tuple[Document, float]]:
+        """融合后的前 k 个 (Document, 融合分数)；只出现在词法结果中的块从向量数据库读取
+
+        分数只由名次决定：向量距离（越小越好）和词法覆盖率（越大越好）方向和量纲都不同，不参与比较。
+        """
+        fused = self.fuse_results(vector_docs, lexical_hits, k)
+        vector_by_id = {content_hash(doc.page_content): doc for doc, _ in vector_docs}
+        missing = [chunk_id for chunk_id in dict(fused) if chunk_id not in vector_by_id]
+        fetched = {content_hash(doc.page_content): doc for doc in self.get_chunks(missing)}
+
+        docs = []
+        for chunk_id, score in fused:
+            doc = vector_by_id.get(chunk_id) or fetched.get(chunk_id)
+            if doc is not None:
+                docs.append((doc, score))
+        return docs
+
+    def _best_vector_doc(self, vector_docs: List[Tuple[Document, float]]) -> Optional[Tuple[Document, float]]:
+        """向量检索的第一名及其相似度（由距离换算），用于判断是否直接使用文档"""
+        if not vector_docs:
+            return None
+        doc, distance = vector_docs[0]
+        return doc, self.partitions.similarity(distance)
+
     async def update_keywords_from_docs(self):
-        """从向量数据库中的所有文档更新关键词库"""
+        """从向量数据库中的所有文档全量重建关键词库"""
+        async with self._rebuild_lock:
+            await self._update_keywords_from_docs()
+
+    async def _update_keywords_from_docs(self):
         try:
             # 获取所有文档
-            results = self.vectordb.get()
+            results = await run_in_thread(self.partitions.get, include=["documents", "metadatas"])
             
             # 确保我们有文档内容
             if not results or "documents" not in results or not results["documents"]:
                 logger.warning("No documents found in the vector store")
-                self.keywords = []
-                self.keyword_embeddings = []
+                self._reset_keywords()
                 return
             
-            # 合并所有文档内容
-            # 检查文档类型并相应地处理
-            if isinstance(results["documents"][0], str):
-                all_text = " ".join(results["documents"])
-                logger.info("Processing string documents")
-            else:
-                all_text = " ".join(doc.page_content for doc in results["documents"])
-                logger.info("Processing Document objects")
+            # 按文档分组，以便记录每个关键词的来源
+            metadatas = results.get("metadatas") or [None] * len(results["documents"])
+            texts_by_doc: Dict[str, List[str]] = {}
+            for content, metadata in zip(results["documents"], metadatas):
+                if not isinstance(content, str):
+                    content = content.page_content
+                texts_by_doc.setdefault(self.get_doc_id(metadata), []).append(content)
+            logger.info(f"Rebuilding keywords for {len(texts_by_doc)} documents")
             
             # 提取关键词
             try:
-                self.keywords = await self.extract_keywords(all_text)
-                logger.info(f"Extracted {len(self.keywords)} keywords")
-                
-                # 计算关键词的向量表示
+                self._reset_keywords()
+                for doc_id, texts in texts_by_doc.items():
+                    with usage_context(doc_id=doc_id):
+                        await self._add_document_keywords(doc_id, texts)
+
                 if self.keywords:
-                    self.keyword_embeddings = self.encoder.encode(self.keywords)
-                    logger.info("Keyword embeddings updated")
+                    logger.info(f"Extracted {len(self.keywords)} keywords")
                 else:
                     logger.warning("No keywords extracted")
-                    self.keyword_embeddings = []
+                self.save_keywords()
                     
             except Exception as e:
                 logger.error(f"Error extracting keywords: {str(e)}")
-                self.keywords = []
-                self.keyword_embeddings = []
+                self._reset_keywords()
                 
         except Exception as e:
             logger.error(f"Error updating keywords from docs: {str(e)}")
-            self.keywords = []
-            self.keyword_embeddings = []
+            self._reset_keywords()
             raise
 
     async def get_current_keywords(self) -> List[str]:
         """获取当前的关键词列表"""
         return self.keywords
 
-    def calculate_query_similarity(self, query: str) -> float:
+    def encode_query(self, query: str) -> np.ndarray:
+        """计算查询的向量表示"""
+        return self.encoder.encode([query])[0]
+
+    def calculate_query_similarity(self, query: str, query_embedding: Optional[np.ndarray] = None) -> float:
         """计算查询与关键词的最大相似度"""
         if not self.keywords:
             logger.warning("No keywords available for similarity calculation")
@@ -131,71 +824,438 @@ class AdvancedQueryEngine:
             
         try:
             # 计算查询的向量表示
-            query_embedding = self.encoder.encode([query])[0]
+            if query_embedding is None:
+                query_embedding = self.encode_query(query)
             
-            # 计算与所有关键词的相似度
-            similarities = np.dot(self.keyword_embeddings, query_embedding)
-            max_similarity = float(np.max(similarities))
+            # 计算与所有关键词的最大余弦相似度
+            max_similarity = self.keyword_index.max_similarity(query_embedding)
             
-            logger.info(f"Query similarity score: {max_similarity:.4f}")
+            logger.debug("Query similarity score: %.4f", max_similarity, extra=SAMPLED)
             return max_similarity
             
         except Exception as e:
             logger.error(f"Error calculating query similarity: {str(e)}")
             return 0.0
 
-    async def smart_query(self, query: str) -> QueryResult:
-        """智能查询：根据相似度决定使用文档还是LLM"""
-        try:
-            # 计算查询与关键词的相似度
-            similarity = self.calculate_query_similarity(query)
-            logger.info(f"Query: '{query}' - Similarity: {similarity:.4f}")
-            
-            if similarity >= self.similarity_threshold:
-                # 相似度高，优先使用文档
-                docs = self.vectordb.similarity_search_with_score(query, k=3)
-                
-                if docs:
-                    best_doc, best_score = docs[0]
-                    if best_score >= self.similarity_threshold:
-                        # 文档匹配度高，直接使用文档内容
-                        return QueryResult(
-                            answer=best_doc.page_content,
-                            source_documents=[doc.page_content for doc, _ in docs],
-                            confidence=best_score,
-                            source_type="document"
-                        )
-                    else:
-                        # 文档匹配度不够，使用混合模式
-                        context = "\n".join([doc.page_content for doc, _ in docs[:2]])
-                        prompt = """基于以下文档内容回答用户问题。如果内容与问题不够相关，请说明无法从文档中找到相关信息。
+    def match_keywords(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """返回与查询最相似的 k 个关键词及相似度"""
+        if not self.keywords:
+            return []
+        return self.keyword_index.search(self.encode_query(query), k)
 
-                        文档内容：
-                        {context}
+    async def smart_query(self, query: str, filters: Optional[QueryFilter] = None) -> QueryResult:
+        """智能查询：相同的并发查询只计算一次；filters 限定检索的文档、来源类型和页码"""
+        if filters is not None and filters.is_empty():
+            filters = None
+        key = (" ".join(query.split()), self.index_version, filters.key() if filters else None)
+        return await self.inflight_queries.do(key, lambda: self._smart_query(query, filters))
 
-                        用户问题：{query}"""
-                        
-                        response = await self.llm.ainvoke([HumanMessage(content=prompt.format(
-                            context=context,
-                            query=query
-                        ))])
-                        
-                        return QueryResult(
-                            answer=response.content,
-                            source_documents=[doc.page_content for doc, _ in docs],
-                            confidence=similarity,
-                            source_type="hybrid"
-                        )
-            
-            # 相似度低，直接使用LLM
-            response = await self.llm.ainvoke([HumanMessage(content=query)])
-            return QueryResult(
-                answer=response.content,
-                source_documents=[],
-                confidence=1.0,
-                source_type="llm"
+    async def _smart_query(self, query: str, filters: Optional[QueryFilter] = None) -> QueryResult:
+        """优先使用语义缓存，未命中时根据相似度决定使用文档还是LLM
+
+        回答缓存只按查询向量匹配，限定了检索范围的查询不读取也不写入缓存。
+        """
+        with timed(QUERY_STAGE_SECONDS, "embed_query"):
+            query_embedding = await run_in_thread(self.encode_query, query)
+        version = self.index_version
+        scope = await run_in_thread(self.resolve_filter, filters) if filters else None
+
+        if self.answer_cache and scope is None:
+            with timed(QUERY_STAGE_SECONDS, "cache_lookup"):
+                cached = self.answer_cache.get(query_embedding, version)
+            if cached is not None:
+                QUERIES_TOTAL.inc(source_type=cached.source_type, cached="true")
+                return cached.served_from_cache()
+
+        result = await self._answer_query(query, query_embedding, scope)
+        QUERIES_TOTAL.inc(source_type=result.source_type, cached="false")
+
+        if scope is None:
+            self._cache_result(query_embedding, result, version)
+        return result
+
+    def resolve_filter(self, filters: QueryFilter) -> SearchScope:
+        """把查询的过滤条件解析为检索范围：限定了文档时只在这些文档的块中、只在它们所在的分区中检索"""
+        where = filters.where()
+        if not filters.doc_ids:
+            return SearchScope(where=where)
+        partitions = self.partitions.partitions_of(filters.doc_ids)
+        if self.document_registry is None:
+            # 没有文档记录时按块元数据中的文档ID过滤，内容相同的块只记在其中一个文档名下
+            return SearchScope(
+                where=combine_where([{"doc_id": {"$in": filters.doc_ids}}, where]), partitions=partitions
             )
+        ids = list(dict.fromkeys(
+            chunk_id for doc_id in filters.doc_ids for chunk_id in self.document_registry.chunk_ids(doc_id)
+        ))
+        return SearchScope(where=where, ids=ids, partitions=partitions)
+
+    def _search_lexical(self, query: str, scope: Optional[SearchScope] = None) -> List[Tuple[str, float, float]]:
+        """词法检索；有检索范围时只返回范围内的块"""
+        if scope is None:
+            return self.lexical_index.search(query, self.fusion_candidates)
+        allowed = set(scope.ids) if scope.ids is not None else None
+        if scope.where is None:
+            return self.lexical_index.search(query, self.fusion_candidates, allowed)
+        # 来源类型和页码只记录在向量数据库中，多取一些候选再按 where 条件过滤
+        hits = self.lexical_index.search(query, self.fusion_candidates * FILTERED_LEXICAL_FACTOR, allowed)
+        if not hits:
+            return hits
+        matched = set(self.partitions.get(
+            ids=[chunk_id for chunk_id, _, _ in hits], where=scope.where, include=[], partitions=scope.partitions
+        )["ids"])
+        return [hit for hit in hits if hit[0] in matched][:self.fusion_candidates]
+
+    def _cache_result(self, query_embedding: np.ndarray, result: QueryResult, version: int):
+        """缓存回答，并记录回答引用的块，删除文档时据此淘汰"""
+        # 计算期间索引发生变化时，结果可能已经过期，不写入缓存
+        if self.answer_cache and version == self.index_version:
+            chunk_ids = [content_hash(doc) for doc in result.source_documents]
+            self.answer_cache.put(query_embedding, result, version, chunk_ids)
+
+    async def route_query(
+        self, query: str, query_embedding: np.ndarray, scope: Optional[SearchScope] = None
+    ) -> QueryRoute:
+        """根据查询与关键词的相似度决定使用文档、混合模式还是LLM，并准备好提示词
+
+        先在本地词法索引中检索，命中足够确定时直接返回文档，不调用向量 API；
+        否则按原来的方式路由，检索文档时融合向量和词法结果。
+        给出检索范围时只在范围内检索，并且总是检索文档：关键词库不区分文档，不能据此判断范围内有没有相关内容。
+        """
+        with timed(QUERY_STAGE_SECONDS, "lexical"):
+            lexical_hits = await run_in_thread(self._search_lexical, query, scope)
+        if self.is_confident_lexical_hit(lexical_hits):
+            docs = await run_in_thread(self.get_chunks, [chunk_id for chunk_id, _, _ in lexical_hits[:3]])
+            if docs:
+                logger.info(
+                    "Query: '%.200s' - answered by lexical match, coverage %.4f", query, lexical_hits[0][2], extra=SAMPLED
+                )
+                return self._lexical_route(lexical_hits, docs)
+
+        # 计算查询与关键词的相似度
+        with timed(QUERY_STAGE_SECONDS, "route"):
+            similarity = self.calculate_query_similarity(query, query_embedding)
+        logger.info("Query: '%.200s' - Similarity: %.4f", query, similarity, extra=SAMPLED)
+        
+        docs = None
+        best = None
+        if similarity >= self.similarity_threshold or scope is not None:
+            # 相似度高，优先使用文档
+            with timed(QUERY_STAGE_SECONDS, "retrieve"):
+                k = self.context_candidates
+                if self.reuse_query_embeddings:
+                    query_vector = query_embedding
+                else:
+                    query_vector = await run_in_thread(self.partitions.embedding_function.embed_query, query)
+                vector_docs = (await run_in_thread(
+                    self.search_documents_batch, [query], k, [query_vector], None, scope
+                ))[0]
+                docs = await run_in_thread(self._fused_documents, vector_docs, lexical_hits, k)
+            best = self._best_vector_doc(vector_docs)
+        return self._build_route(query, similarity, docs, best)
+
+    def _build_route(
+        self, query: str, similarity: float, docs, best: Optional[Tuple[Document, float]] = None
+    ) -> QueryRoute:
+        """根据关键词相似度和检索到的融合文档 [(Document, 融合分数)] 生成路由结果
+
+        best 为向量检索第一名的 (Document, 相似度)，相似度达到阈值时直接使用这个块回答；
+        融合分数只反映名次，不与相似度阈值比较。
+        """
+        if docs:
+            if best is not None and best[1] >= self.similarity_threshold:
+                best_doc, best_score = best
+                # 文档匹配度高，直接使用文档内容
+                best_content = best_doc.page_content
+                others = [doc.page_content for doc, _ in docs if doc.page_content != best_content]
+                return QueryRoute(
+                    source_type="document",
+                    confidence=best_score,
+                    source_documents=[best_content] + others[:2],
+                    answer=best_content
+                )
+            else:
+                # 文档匹配度不够，使用混合模式：按排名去重后在 token 预算内拼接上下文
+                packed = self.context_builder.build([doc.page_content for doc, _ in docs])
+                logger.info(
+                    "Context: %d/%d passages, %d tokens, %d duplicate tokens removed",
+                    len(packed.sources), len(docs), packed.tokens, packed.duplicate_tokens, extra=SAMPLED
+                )
+                return QueryRoute(
+                    source_type="hybrid",
+                    confidence=similarity,
+                    source_documents=[docs[i][0].page_content for i in packed.sources],
+                    prompt=HYBRID_PROMPT.format(context=packed.text, query=query),
+                    context_tokens=packed.tokens
+                )
+        
+        # 相似度低，直接使用LLM
+        return QueryRoute(
+            source_type="llm",
+            confidence=1.0,
+            source_documents=[],
+            prompt=query
+        )
+
+    def search_documents_batch(
+        self,
+        queries: List[str],
+        k: int = 3,
+        query_embeddings: Optional[np.ndarray] = None,
+        ids: Optional[List[str]] = None,
+        scope: Optional[SearchScope] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """批量向量检索：一次计算所有查询的向量（已经给出 query_embeddings 时直接使用），各分区并行检索后合并
+
+        给出 ids 时只在这些块中检索；给出 scope 时只在检索范围内、范围涉及的分区中检索。
+        """
+        if query_embeddings is None:
+            query_embeddings = self.partitions.embedding_function.embed_documents(queries)
+        if scope is not None:
+            if ids is None:
+                ids = scope.ids
+            elif scope.ids is not None:
+                allowed = set(scope.ids)
+                ids = [chunk_id for chunk_id in ids if chunk_id in allowed]
+        return self.partitions.query(
+            query_embeddings, k,
+            where=scope.where if scope else None,
+            ids=ids,
+            partitions=scope.partitions if scope else None,
+        )
+
+    async def batch_query_stream(
+        self, queries: List[str], concurrency: int = 8
+    ) -> AsyncIterator[Tuple[int, QueryResult]]:
+        """批量查询，按输入顺序逐个产生 (下标, 结果)
+
+        所有查询一次批量编码、批量计算关键词相似度、批量向量检索，LLM 调用并发数受 concurrency 限制。
+        """
+        with timed(QUERY_STAGE_SECONDS, "embed_query"):
+            query_embeddings = await run_in_thread(self.encoder.encode, queries)
+        version = self.index_version
+
+        results: List[Optional[QueryResult]] = [None] * len(queries)
+        if self.answer_cache:
+            with timed(QUERY_STAGE_SECONDS, "cache_lookup"):
+                for i, embedding in enumerate(query_embeddings):
+                    results[i] = self.answer_cache.get(embedding, version)
+            for i, result in enumerate(results):
+                if result is not None:
+                    QUERIES_TOTAL.inc(source_type=result.source_type, cached="true")
+                    results[i] = result.served_from_cache()
+        pending = [i for i, result in enumerate(results) if result is None]
+        logger.info(f"Batch query: {len(queries)} queries, {len(queries) - len(pending)} answered from cache")
+
+        # 词法检索：命中足够确定的查询直接使用文档，不再计算向量
+        lexical_hits = {}
+        lexical_routes = {}
+        with timed(QUERY_STAGE_SECONDS, "lexical"):
+            for i in pending:
+                lexical_hits[i] = await run_in_thread(self.lexical_index.search, queries[i], self.fusion_candidates)
+                if self.is_confident_lexical_hit(lexical_hits[i]):
+                    ids = [chunk_id for chunk_id, _, _ in lexical_hits[i][:3]]
+                    docs = await run_in_thread(self.get_chunks, ids)
+                    if docs:
+                        lexical_routes[i] = self._lexical_route(lexical_hits[i], docs)
+        pending_routing = [i for i in pending if i not in lexical_routes]
+
+        # 批量计算关键词相似度，只有相似度足够高的查询才需要检索文档
+        similarities = np.zeros(len(queries), dtype=np.float32)
+        if pending_routing and self.keywords:
+            with timed(QUERY_STAGE_SECONDS, "route"):
+                scores, _ = self.keyword_index.search_batch(query_embeddings[pending_routing], 1)
+            similarities[pending_routing] = scores[:, 0]
+        to_search = [i for i in pending_routing if similarities[i] >= self.similarity_threshold]
+        docs_by_query = {}
+        best_docs = {}
+        if to_search:
+            with timed(QUERY_STAGE_SECONDS, "retrieve"):
+                searched = await run_in_thread(
+                    self.search_documents_batch,
+                    [queries[i] for i in to_search],
+                    self.context_candidates,
+                    query_embeddings[to_search] if self.reuse_query_embeddings else None
+                )
+                for i, vector_docs in zip(to_search, searched):
+                    docs_by_query[i] = await run_in_thread(
+                        self._fused_documents, vector_docs, lexical_hits[i], self.context_candidates
+                    )
+                    best_docs[i] = self._best_vector_doc(vector_docs)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def answer(i: int) -> QueryResult:
+            route = lexical_routes.get(i) or self._build_route(
+                queries[i], float(similarities[i]), docs_by_query.get(i), best_docs.get(i)
+            )
+            if route.prompt is None:
+                result = self._make_result(route, route.answer)
+            else:
+                async with semaphore:
+                    start = time.perf_counter()
+                    with timed(QUERY_STAGE_SECONDS, "generate"):
+                        response = await self.llm.ainvoke([HumanMessage(content=route.prompt)])
+                usage = self._record_answer_usage(route, response.content, response.usage_metadata, start)
+                result = self._make_result(route, response.content, usage)
+            QUERIES_TOTAL.inc(source_type=result.source_type, cached="false")
+            self._cache_result(query_embeddings[i], result, version)
+            return result
+
+        tasks = {i: asyncio.create_task(answer(i)) for i in pending}
+        try:
+            for i in range(len(queries)):
+                if i in tasks:
+                    results[i] = await tasks[i]
+                yield i, results[i]
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def batch_query(self, queries: List[str], concurrency: int = 8) -> List[QueryResult]:
+        """批量查询，结果顺序与输入一致"""
+        return [result async for _, result in self.batch_query_stream(queries, concurrency)]
+
+    def _record_answer_usage(
+        self, route: QueryRoute, answer: str, usage_metadata: Optional[dict], start: float
+    ) -> Tuple[int, int]:
+        return record_llm_usage(
+            "answer", route.prompt, answer, usage_metadata, model=self.llm_model,
+            latency=time.perf_counter() - start, source_type=route.source_type
+        )
+
+    def _make_result(self, route: QueryRoute, answer: str, usage: Optional[Tuple[int, int]] = None) -> QueryResult:
+        """生成查询结果；调用了 LLM 时记录本次请求的提示词、上下文和生成 token 数"""
+        prompt_tokens, completion_tokens = usage or (0, 0)
+        if usage:
+            ANSWER_TOKENS.observe(prompt_tokens, kind="prompt")
+            ANSWER_TOKENS.observe(completion_tokens, kind="completion")
+            if route.context_tokens:
+                ANSWER_TOKENS.observe(route.context_tokens, kind="context")
+        return QueryResult(
+            answer=answer,
+            source_documents=route.source_documents,
+            confidence=route.confidence,
+            source_type=route.source_type,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            context_tokens=route.context_tokens
+        )
+
+    async def _answer_query(
+        self, query: str, query_embedding: np.ndarray, scope: Optional[SearchScope] = None
+    ) -> QueryResult:
+        """路由查询并生成完整回答"""
+        try:
+            route = await self.route_query(query, query_embedding, scope)
+            if route.prompt is None:
+                return self._make_result(route, route.answer)
+            start = time.perf_counter()
+            with timed(QUERY_STAGE_SECONDS, "generate"):
+                response = await self.llm.ainvoke([HumanMessage(content=route.prompt)])
+            usage = self._record_answer_usage(route, response.content, response.usage_metadata, start)
+            return self._make_result(route, response.content, usage)
             
         except Exception as e:
             logger.error(f"Smart query error: {str(e)}")
             raise
+
+    async def stream_query(
+        self, query: str, filters: Optional[QueryFilter] = None
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """流式查询：先返回路由结果和来源文档，再逐个返回 LLM 生成的 token
+
+        依次产生 ("route", ...)、("sources", ...)、若干 ("token", ...) 和 ("done", ...) 事件。
+        filters 与 smart_query() 相同，限定了检索范围时不使用回答缓存。
+        """
+        with timed(QUERY_STAGE_SECONDS, "embed_query"):
+            query_embedding = await run_in_thread(self.encode_query, query)
+        version = self.index_version
+        scope = await run_in_thread(self.resolve_filter, filters) if filters and not filters.is_empty() else None
+
+        with timed(QUERY_STAGE_SECONDS, "cache_lookup"):
+            cached = self.answer_cache.get(query_embedding, version) if self.answer_cache and scope is None else None
+        if cached is not None:
+            QUERIES_TOTAL.inc(source_type=cached.source_type, cached="true")
+            yield "route", {"source_type": cached.source_type, "confidence": cached.confidence, "cached": True}
+            yield "sources", {"source_documents": cached.source_documents}
+            yield "token", {"content": cached.answer}
+            yield "done", {"answer": cached.answer, **cached.served_from_cache().token_usage()}
+            return
+
+        route = await self.route_query(query, query_embedding, scope)
+        yield "route", {"source_type": route.source_type, "confidence": route.confidence, "cached": False}
+        yield "sources", {"source_documents": route.source_documents}
+
+        usage = None
+        if route.prompt is None:
+            answer = route.answer
+            yield "token", {"content": answer}
+        else:
+            parts = []
+            usage_metadata = None
+            # 生成耗时包括等待客户端读取 token 的时间
+            start = time.perf_counter()
+            with timed(QUERY_STAGE_SECONDS, "generate"):
+                async for chunk in self.llm.astream([HumanMessage(content=route.prompt)]):
+                    usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield "token", {"content": chunk.content}
+            answer = "".join(parts)
+            usage = self._record_answer_usage(route, answer, usage_metadata, start)
+
+        result = self._make_result(route, answer, usage)
+        QUERIES_TOTAL.inc(source_type=result.source_type, cached="false")
+        if scope is None:
+            self._cache_result(query_embedding, result, version)
+        yield "done", {"answer": answer, **result.token_usage()}
+
+    async def component_aware_search(self, query: str) -> QueryResult:
+        """组件感知查询：先用一次矩阵乘法匹配组件，再只在匹配到的组件引用的块中检索
+
+        没有匹配到组件时按普通查询处理。
+        """
+        with timed(QUERY_STAGE_SECONDS, "embed_query"):
+            query_embedding = await run_in_thread(self.encode_query, query)
+        with timed(QUERY_STAGE_SECONDS, "components"):
+            matches = self.component_index.search(query_embedding, self.component_matches, self.component_threshold)
+        if not matches:
+            logger.info("Query: '%.200s' - no matching components", query, extra=SAMPLED)
+            return await self.smart_query(query)
+
+        components = [component for component, _ in matches]
+        # 按组件的匹配顺序合并引用的块，只在这些块中检索
+        chunk_ids = list(dict.fromkeys(chunk_id for component in components for chunk_id in component.chunk_ids))
+        logger.info(
+            "Query: '%.200s' - matched %d components, searching %d chunks",
+            query, len(components), len(chunk_ids), extra=SAMPLED
+        )
+        with timed(QUERY_STAGE_SECONDS, "retrieve"):
+            if self.reuse_query_embeddings:
+                query_vector = query_embedding
+            else:
+                query_vector = await run_in_thread(self.partitions.embedding_function.embed_query, query)
+            docs = (await run_in_thread(
+                self.search_documents_batch, [query], self.context_candidates, [query_vector], chunk_ids
+            ))[0]
+
+        packed = self.context_builder.build([doc.page_content for doc, _ in docs])
+        route = QueryRoute(
+            source_type="component",
+            confidence=matches[0][1],
+            source_documents=[docs[i][0].page_content for i in packed.sources],
+            prompt=COMPONENT_PROMPT.format(
+                components="\n".join(f"- {component_text(c)}" for c in components),
+                context=packed.text,
+                query=query
+            ),
+            context_tokens=packed.tokens
+        )
+        start = time.perf_counter()
+        with timed(QUERY_STAGE_SECONDS, "generate"):
+            response = await self.llm.ainvoke([HumanMessage(content=route.prompt)])
+        usage = self._record_answer_usage(route, response.content, response.usage_metadata, start)
+        result = self._make_result(route, response.content, usage)
+        QUERIES_TOTAL.inc(source_type=result.source_type, cached="false")
+        return result.model_copy(update={"matched_components": components})
@@ -1,16 +1,36 @@
+import time
+
+_IMPORT_START = time.perf_counter()
+
+import asyncio
+import json
 import os
 import sys
-from typing import List
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import uuid
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredEPubLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from logger_config import setup_logger
+from logger_config import SAMPLED, request_id_var, setup_logger
+from executors import run_in_thread, shutdown_executors
+from ingest_jobs import JOB_STAGES, IngestionWorker, JobStore
+from document_registry import DocumentRegistry
+from embedding_cache import CachedEmbeddings
+from embedding_backends import create_embeddings, ensure_store_model, load_encoder_model
+from semantic_cache import SemanticCache
+from keyword_index import KeywordIndex
+from metrics import (
+    HTTP_REQUEST_SECONDS, INGEST_STAGE_SECONDS, REGISTRY,
+    finish_request_timings, server_timing_header, start_request_timings, timed
+)
+from startup import StartupTracker
+from leader import LeaderLock
+from usage_store import BudgetExceeded, configure_usage_store, usage_context
+from vector_partitions import (
+    CHUNK_METADATA_KEY, CHUNK_METADATA_VERSION, QueryFilter, VectorPartitions, source_type_of
+)
 
 # 设置日志记录器
 logger = setup_logger('app')
@@ -19,10 +39,90 @@ logger = setup_logger('app')
 load_dotenv()
 
 # 设置目录
-UPLOAD_DIRECTORY = os.path.join(os.path.dirname(__file__), "uploads")
-PERSIST_DIRECTORY = os.path.join(os.path.dirname(__file__), "db")
+UPLOAD_DIRECTORY = os.getenv("UPLOAD_DIRECTORY", os.path.join(os.path.dirname(__file__), "uploads"))
+PERSIST_DIRECTORY = os.getenv("PERSIST_DIRECTORY", os.path.join(os.path.dirname(__file__), "db"))
+KEYWORD_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "keywords")
+LEXICAL_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "lexical")
+COMPONENT_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "components")
+JOBS_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "jobs")
+EMBEDDING_CACHE_PATH = os.path.join(PERSIST_DIRECTORY, "embedding_cache", "embeddings.db")
+USAGE_DB_PATH = os.path.join(PERSIST_DIRECTORY, "usage", "usage.db")
+DOCUMENTS_DB_PATH = os.path.join(PERSIST_DIRECTORY, "documents", "documents.db")
 ALLOWED_EXTENSIONS = {'.pdf', '.epub'}
 
+# 上传文件按块写入磁盘，每次读取的字节数
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# 计算查询与关键词相似度的句向量模型
+ENCODER_MODEL = os.getenv("ENCODER_MODEL", "all-MiniLM-L6-v2")
+
+# 文档向量模型：openai 调用 OpenAI 向量 API，local 使用本地 sentence-transformers 模型（名称或本地目录，默认与 ENCODER_MODEL 相同）
+# 切换模型后需要运行 reindex.py 重新生成已有文档的向量
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or (ENCODER_MODEL if EMBEDDING_BACKEND == "local" else "text-embedding-ada-002")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# 关键词提取的并发与限流配置（0 表示不限制）
+KEYWORD_CONCURRENCY = int(os.getenv("KEYWORD_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")) or None
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")) or None
+
+# 关键词库保存与重建的防抖时间（秒）
+KEYWORD_DEBOUNCE_SECONDS = float(os.getenv("KEYWORD_DEBOUNCE_SECONDS", "2"))
+
+# 词法检索：覆盖率达到阈值的明确命中直接返回文档（0 表示关闭快速路径），融合时每路取的候选数
+LEXICAL_FAST_PATH_THRESHOLD = float(os.getenv("LEXICAL_FAST_PATH_THRESHOLD", "0.9")) or None
+FUSION_CANDIDATES = int(os.getenv("FUSION_CANDIDATES", "10"))
+
+# 回答使用的聊天模型
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+
+# 混合模式的上下文：token 预算、参与拼接的检索结果数、近似重复判定阈值，
+# 计算 token 数的方式（auto 优先使用 tiktoken，heuristic 按字符估算，不需要下载编码文件）
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "5"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+TOKENIZER = os.getenv("TOKENIZER", "auto")
+
+# 组件索引：导入时是否提取组件（每个文档额外调用 LLM），查询时组件的最低匹配相似度与最多匹配数
+COMPONENT_EXTRACTION_ENABLED = os.getenv("COMPONENT_EXTRACTION_ENABLED", "1") == "1"
+COMPONENT_MATCH_THRESHOLD = float(os.getenv("COMPONENT_MATCH_THRESHOLD", "0.4"))
+COMPONENT_MATCHES = int(os.getenv("COMPONENT_MATCHES", "5"))
+
+# 本月 API 用量上限（美元，按本地用量记录估算），达到后拒绝导入新文档；0 表示不限制
+USAGE_MONTHLY_BUDGET_USD = float(os.getenv("USAGE_MONTHLY_BUDGET_USD", "0"))
+
+# 批量查询配置：单次最多问题数与 LLM 并发数
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "1000"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+# 关键词索引配置：向量存储类型（float32/float16/int8）与启用近似检索的关键词数量
+KEYWORD_INDEX_DTYPE = os.getenv("KEYWORD_INDEX_DTYPE", "float32")
+KEYWORD_ANN_THRESHOLD = int(os.getenv("KEYWORD_ANN_THRESHOLD", "20000"))
+
+# 语义回答缓存配置
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_MB = float(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+
+# 多进程部署：协调循环的间隔（秒），用于选举导入进程、领取其他进程提交的任务和同步关键词库
+COORDINATION_INTERVAL_SECONDS = float(os.getenv("COORDINATION_INTERVAL_SECONDS", "2"))
+
+# 使用独立的 Chroma 服务（多进程部署时推荐，本地持久化目录不支持多个进程同时写入）
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+
+# 向量分区数：文档按文档ID的哈希分到多个集合，检索时并行查询后合并；修改后需要运行 reindex.py --partitions
+VECTOR_PARTITIONS = int(os.getenv("VECTOR_PARTITIONS", "1"))
+
+# 延迟启动：启动后立即接受请求，模型和关键词库在后台加载（1 开启）
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") == "1"
+
+# 是否在响应中返回 Server-Timing 头（各阶段耗时，单位毫秒）
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "0") == "1"
+
 # 创建FastAPI应用
 app = FastAPI(
     title="智能文档问答系统",
@@ -39,25 +139,279 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    """记录请求耗时；开启 SERVER_TIMING_ENABLED 时在响应头中返回各阶段耗时
+
+    每个请求分配一个请求ID（沿用请求头 X-Request-ID），附加在本次请求的所有日志上并在响应头中返回；
+    请求结束时在日志文件中记录一条带各阶段耗时的 DEBUG 日志（高频日志，受 LOG_SAMPLE_RATE 采样）。
+    流式响应在返回响应头时还没有开始生成内容，只包含此前已经完成的阶段。
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    request_token = request_id_var.set(request_id)
+    token = start_request_timings()
+    start = time.perf_counter()
+    status = 500
+    try:
+        # 本次请求产生的 LLM 和向量调用记在这个接口名下
+        with usage_context(endpoint=request.url.path):
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        total = time.perf_counter() - start
+        timings = finish_request_timings(token)
+        # 使用路由模板作为标签，避免 /jobs/{job_id} 之类的路径产生过多时间序列
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(
+            total,
+            method=request.method,
+            path=path,
+            status=status
+        )
+        logger.debug(
+            "%s %s %d %.1fms", request.method, path, status, total * 1000,
+            extra={
+                **SAMPLED,
+                "http": {"method": request.method, "path": path, "status": status},
+                "duration_ms": round(total * 1000, 1),
+                "stages": {stage: round(seconds * 1000, 1) for stage, (seconds, _) in timings.items()},
+            }
+        )
+        request_id_var.reset(request_token)
+    response.headers["X-Request-ID"] = request_id
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = server_timing_header(timings, total)
+    return response
+
 # 确保目录存在
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 os.makedirs(PERSIST_DIRECTORY, exist_ok=True)
 
-# 初始化组件
-embeddings = OpenAIEmbeddings()
-vectordb = Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=embeddings)
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-query_engine = None  # 将在启动时初始化
-
-def get_document_loader(file_path: str):
-    """根据文件扩展名选择合适的文档加载器"""
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext == '.pdf':
-        return PyPDFLoader(file_path)
-    elif ext == '.epub':
-        return UnstructuredEPubLoader(file_path)
-    else:
-        raise ValueError(f"不支持的文件格式: {ext}")
+# 初始化组件：重量级依赖（OpenAI 客户端、Chroma、句向量模型）在启动时才导入和创建
+embeddings = None
+vectordb = None
+partitions = None
+llm = None
+query_engine = None
+job_store = JobStore(JOBS_DIRECTORY)
+document_registry = DocumentRegistry(DOCUMENTS_DB_PATH)
+usage_store = configure_usage_store(USAGE_DB_PATH, USAGE_MONTHLY_BUDGET_USD)
+ingestion_worker = None  # 只在持有导入锁的进程中运行
+leader_lock = LeaderLock(os.path.join(PERSIST_DIRECTORY, "ingest.lock"))
+coordinator_task = None
+startup = StartupTracker(started_at=_IMPORT_START)
+startup.record("import", time.perf_counter() - _IMPORT_START)
+warmup_task = None
+
+def init_components():
+    """创建向量模型、向量数据库、LLM 和查询引擎，已经设置的组件保持不变"""
+    global embeddings, vectordb, partitions, llm, query_engine
+    with startup.step("embeddings"):
+        if embeddings is None:
+            embeddings = CachedEmbeddings(
+                create_embeddings(EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE),
+                EMBEDDING_CACHE_PATH
+            )
+    with startup.step("vectordb"):
+        if vectordb is None:
+            from langchain_chroma import Chroma
+            if CHROMA_HOST:
+                import chromadb
+                vectordb = Chroma(
+                    client=chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT),
+                    embedding_function=embeddings
+                )
+            else:
+                vectordb = Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=embeddings)
+        # 向量库由其他模型构建时拒绝启动，查询向量和文档向量必须来自同一个模型
+        partitions = VectorPartitions(vectordb, VECTOR_PARTITIONS)
+        for index in range(partitions.count):
+            ensure_store_model(partitions.collection(index), EMBEDDING_BACKEND, EMBEDDING_MODEL)
+        # 分区数与向量库不一致时拒绝启动，否则文档会在错误的分区中查找和写入
+        partitions.ensure_layout()
+    with startup.step("llm"):
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(temperature=0, model=LLM_MODEL)
+    with startup.step("query_engine"):
+        from advanced_query import AdvancedQueryEngine
+        from keyword_store import KeywordStore
+        from lexical_index import LexicalStore
+        from context_builder import ContextBuilder
+        from component_index import ComponentStore
+        from tokenizer import configure_tokenizer
+        query_engine = AdvancedQueryEngine(
+            vectordb=vectordb,
+            llm=llm,
+            similarity_threshold=0.8,  # 设置相似度阈值为80%
+            keyword_store=KeywordStore(KEYWORD_DIRECTORY),
+            encoder_model=ENCODER_MODEL,
+            keyword_concurrency=KEYWORD_CONCURRENCY,
+            requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+            answer_cache=SemanticCache(
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                max_bytes=int(ANSWER_CACHE_MAX_MB * 1024 * 1024)
+            ) if ANSWER_CACHE_ENABLED else None,
+            keyword_index=KeywordIndex(
+                dtype=KEYWORD_INDEX_DTYPE,
+                ann_threshold=KEYWORD_ANN_THRESHOLD
+            ),
+            keyword_debounce_seconds=KEYWORD_DEBOUNCE_SECONDS,
+            lexical_store=LexicalStore(LEXICAL_DIRECTORY),
+            lexical_fast_path_threshold=LEXICAL_FAST_PATH_THRESHOLD,
+            fusion_candidates=FUSION_CANDIDATES,
+            reuse_query_embeddings=EMBEDDING_BACKEND == "local" and EMBEDDING_MODEL == ENCODER_MODEL,
+            context_builder=ContextBuilder(
+                max_tokens=CONTEXT_MAX_TOKENS,
+                duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+                tokenizer=configure_tokenizer(LLM_MODEL, TOKENIZER)
+            ),
+            context_candidates=CONTEXT_CANDIDATES,
+            component_store=ComponentStore(COMPONENT_DIRECTORY),
+            component_extraction=COMPONENT_EXTRACTION_ENABLED,
+            component_threshold=COMPONENT_MATCH_THRESHOLD,
+            component_matches=COMPONENT_MATCHES,
+            partitions=partitions,
+            document_registry=document_registry
+        )
+
+def preload_shared_models():
+    """在 gunicorn 主进程中预先加载只读的句向量模型，fork 出的工作进程共享这部分内存"""
+    load_encoder_model(ENCODER_MODEL)
+    if EMBEDDING_BACKEND == "local":
+        load_encoder_model(EMBEDDING_MODEL)
+
+def start_ingestion_worker():
+    """启动后台导入任务，继续处理重启前未完成的任务和其他进程提交的任务"""
+    global ingestion_worker
+    ingestion_worker = IngestionWorker(job_store, partitions, embeddings, query_engine, document_registry)
+    ingestion_worker.start()
+
+async def coordinate():
+    """多进程协调循环
+
+    导入进程：领取其他进程提交的任务，执行其他进程收到的关键词重建请求。
+    其他进程：加载导入进程保存的新版本关键词库，文档变化时使回答缓存失效，导入进程退出后尝试接管。
+    """
+    last_completed = await run_in_thread(job_store.last_completed_at)
+    while True:
+        await asyncio.sleep(COORDINATION_INTERVAL_SECONDS)
+        try:
+            if ingestion_worker:
+                ingestion_worker.enqueue_pending()
+                if query_engine.keyword_store.take_rebuild_request():
+                    query_engine.request_keyword_rebuild()
+                continue
+
+            await run_in_thread(query_engine.refresh_keywords)
+            await run_in_thread(query_engine.refresh_lexical_index)
+            await run_in_thread(query_engine.refresh_components)
+            completed = await run_in_thread(job_store.last_completed_at)
+            if completed != last_completed:
+                last_completed = completed
+                query_engine.notify_index_changed()
+
+            if leader_lock.try_acquire():
+                logger.info(f"Process {os.getpid()} took over ingestion")
+                # 开始导入前重新计算语料指纹，之后随导入增量更新
+                await run_in_thread(query_engine.corpus_fingerprint)
+                start_ingestion_worker()
+        except Exception as e:
+            logger.error(f"Error in coordination loop: {str(e)}")
+
+def backfill_documents():
+    """升级前导入的文档没有文档记录，按块元数据中的文档ID生成"""
+    if document_registry.count() or not partitions.count_chunks():
+        return
+    results = partitions.get(include=["metadatas"])
+    chunks = [
+        (chunk_id, query_engine.get_doc_id(metadata))
+        for chunk_id, metadata in zip(results["ids"], results["metadatas"])
+    ]
+    file_paths = {doc_id: os.path.join(UPLOAD_DIRECTORY, doc_id) for _, doc_id in chunks}
+    document_registry.backfill(chunks, {k: v for k, v in file_paths.items() if os.path.isfile(v)})
+
+def backfill_chunk_metadata():
+    """升级前导入的块没有来源类型，按所属文档ID（即文件名）的扩展名补上；完成后记录在集合元数据中，只执行一次"""
+    base = partitions.collection(0)
+    if (base.metadata or {}).get(CHUNK_METADATA_KEY, 0) >= CHUNK_METADATA_VERSION:
+        return
+    updated = 0
+    for index in range(partitions.count):
+        collection = partitions.collection(index)
+        results = collection.get(include=["metadatas"])
+        updates = [
+            (chunk_id, {**metadata, "source_type": source_type_of(query_engine.get_doc_id(metadata))})
+            for chunk_id, metadata in zip(results["ids"], (m or {} for m in results["metadatas"]))
+            if "source_type" not in metadata
+        ]
+        for start in range(0, len(updates), 1000):
+            batch = updates[start:start + 1000]
+            collection.update(ids=[chunk_id for chunk_id, _ in batch], metadatas=[metadata for _, metadata in batch])
+        updated += len(updates)
+    base.modify(metadata={**(base.metadata or {}), CHUNK_METADATA_KEY: CHUNK_METADATA_VERSION})
+    if updated:
+        logger.info(f"Added source type to {updated} existing chunks")
+
+async def warm_up():
+    """创建组件、加载句向量模型和关键词库并启动后台导入任务，完成后服务进入就绪状态"""
+    global coordinator_task
+    startup.mark_warming()
+    try:
+        await run_in_thread(init_components)
+        with startup.step("encoder"):
+            await run_in_thread(query_engine.load_encoder)
+        with startup.step("tokenizer"):
+            await run_in_thread(query_engine.context_builder.tokenizer.load)
+
+        # 多个工作进程中只有一个负责导入和重建关键词库
+        is_leader = leader_lock.try_acquire()
+
+        # 优先从磁盘加载关键词库，只有语料变化时才重新提取
+        with startup.step("keywords"):
+            if await run_in_thread(query_engine.load_keywords):
+                logger.info("Keywords loaded from disk, skipping keyword update")
+            elif not is_leader:
+                # 由导入进程负责重建，这里先使用已保存的版本，之后由协调循环同步
+                await run_in_thread(query_engine.load_keywords, False)
+            elif await run_in_thread(partitions.count_chunks) > 0:
+                logger.info("Found documents in database, updating keywords...")
+                await query_engine.update_keywords_from_docs()
+            else:
+                logger.info("No documents found, skipping keyword update")
+
+        # 词法索引只依赖块内容，语料变化时直接从向量数据库重建
+        with startup.step("lexical_index"):
+            if not await run_in_thread(query_engine.load_lexical_index):
+                if is_leader:
+                    await run_in_thread(query_engine.rebuild_lexical_index)
+                else:
+                    await run_in_thread(query_engine.load_lexical_index, False)
+
+        # 组件由导入任务提取，这里只加载已保存的索引
+        with startup.step("components"):
+            await run_in_thread(query_engine.load_components)
+
+        with startup.step("ingestion_worker"):
+            if is_leader:
+                await run_in_thread(backfill_documents)
+                await run_in_thread(backfill_chunk_metadata)
+                start_ingestion_worker()
+        coordinator_task = asyncio.create_task(coordinate())
+
+        startup.mark_ready()
+    except Exception as e:
+        startup.mark_failed(e)
+        raise
+
+def require_ready():
+    """预热完成前拒绝依赖模型和索引的请求"""
+    if not startup.ready:
+        raise HTTPException(status_code=503, detail="服务正在启动，请稍后重试")
 
 @app.on_event("startup")
 async def startup_event():
@@ -70,24 +424,14 @@ async def startup_event():
             
         logger.info("Starting application...")
         
-        # 导入和初始化查询引擎
-        from advanced_query import AdvancedQueryEngine
-        global query_engine
-        query_engine = AdvancedQueryEngine(
-            vectordb=vectordb,
-            llm=llm,
-            similarity_threshold=0.8  # 设置相似度阈值为80%
-        )
-        
-        # 只在有文档且关键词为空时更新关键词库
-        docs = vectordb.get()
-        if docs.get('documents', []) and not query_engine.keywords:
-            logger.info("Found documents in database, updating keywords...")
-            await query_engine.update_keywords_from_docs()
+        if LAZY_STARTUP:
+            # 立即开始接受请求，模型和关键词库在后台加载，就绪状态见 /health/ready
+            global warmup_task
+            warmup_task = asyncio.create_task(warm_up())
+            logger.info("Application accepting requests, warming up in background")
         else:
-            logger.info("No documents found or keywords already exist, skipping keyword update")
-        
-        logger.info("Application started successfully")
+            await warm_up()
+            logger.info("Application started successfully")
         
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
@@ -100,9 +444,28 @@ async def shutdown_event():
         logger.info("Shutting down application...")
         
         # 清理全局变量
-        global vectordb, query_engine, llm
+        global partitions, query_engine, llm, ingestion_worker
+        
+        # 预热尚未完成时先取消
+        if warmup_task and not warmup_task.done():
+            warmup_task.cancel()
+            try:
+                await warmup_task
+            except (asyncio.CancelledError, Exception):
+                pass
         
-        # 关闭向量数据库连接
+        # 停止协调循环和后台导入任务，未完成的任务会在下次启动时继续
+        if coordinator_task:
+            coordinator_task.cancel()
+        if ingestion_worker:
+            await ingestion_worker.stop()
+            ingestion_worker = None
+        leader_lock.release()
+        
+        # 关闭分区检索线程池和向量数据库连接
+        if partitions:
+            partitions.close()
+            partitions = None
         if vectordb:
             try:
                 # 新版本的 Chroma 会自动持久化数据
@@ -111,10 +474,17 @@ async def shutdown_event():
             except Exception as e:
                 logger.error(f"Error closing vector database connection: {str(e)}")
         
-        # 清理查询引擎
+        # 清理查询引擎，先保存尚未写入磁盘的关键词库
         if query_engine:
+            await query_engine.flush()
             query_engine = None
         
+        # 关闭解析进程池和 IO 线程池
+        shutdown_executors()
+        
+        # 写入尚未保存的用量记录
+        usage_store.close()
+        
         # 清理 LLM
         if llm:
             llm = None
@@ -127,10 +497,81 @@ async def shutdown_event():
 
 class QueryRequest(BaseModel):
     query: str
+    filters: Optional[QueryFilter] = None  # /query 和 /query/stream：只在指定的文档、来源类型和页码范围内检索
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    stream: bool = False  # 为 True 时按输入顺序以 NDJSON 逐行返回
+
+def format_query_result(result) -> dict:
+    """将查询结果转换为接口返回格式"""
+    return {
+        "answer": result.answer,
+        "source_type": result.source_type,
+        "confidence": result.confidence,
+        "has_source_documents": len(result.source_documents) > 0,
+        "source_documents": result.source_documents if result.source_documents else None,
+        "usage": result.token_usage()
+    }
+
+def check_upload_budget(filename: str):
+    """本月用量达到上限时不再接收新文档"""
+    try:
+        usage_store.check_budget()
+    except BudgetExceeded as e:
+        logger.error(f"{str(e)} - 文件名: {filename}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e)
+        )
+
+async def save_upload(file: UploadFile, file_path: str):
+    """保存上传的文件：按块读取并写入临时文件，内存占用与文件大小无关；写完后再替换同名文件"""
+    tmp_path = file_path + ".part"
+    try:
+        size = 0
+        with timed(INGEST_STAGE_SECONDS, "save"):
+            with open(tmp_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await run_in_thread(buffer.write, chunk)
+                    size += len(chunk)
+        if not size:
+            os.remove(tmp_path)
+            error_msg = "文件内容为空"
+            logger.error(f"{error_msg} - 文件名: {file.filename}")
+            raise HTTPException(
+                status_code=400,
+                detail=error_msg
+            )
+        os.replace(tmp_path, file_path)
+            
+        logger.info(f"File saved successfully: {file_path} ({size} bytes)")
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        error_msg = f"保存文件时出错: {str(e)}"
+        logger.error(f"{error_msg} - 文件名: {file.filename}")
+        raise HTTPException(
+            status_code=500,
+            detail=error_msg
+        )
+
+def submit_job(filename: str, file_path: str, doc_id: str, kind: str = "ingest") -> dict:
+    """提交后台任务；不负责导入的进程只写入任务表，由导入进程领取"""
+    if ingestion_worker:
+        return ingestion_worker.submit(filename, file_path, doc_id=doc_id, kind=kind)
+    return job_store.create(filename, file_path, doc_id=doc_id, kind=kind)
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
-    """上传文件到知识库"""
+    """上传文件到知识库；同名文件作为同一文档，重新上传时替换原有内容"""
+    require_ready()
     try:
         # 检查文件扩展名
         if not file.filename:
@@ -150,84 +591,125 @@ async def upload_file(file: UploadFile = File(...)):
                 detail=error_msg
             )
         
-        # 保存文件
+        await run_in_thread(check_upload_budget, file.filename)
+        
         file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
-        try:
-            content = await file.read()
-            if not content:
-                error_msg = "文件内容为空"
-                logger.error(f"{error_msg} - 文件名: {file.filename}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=error_msg
-                )
-                
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
-                
-            logger.info(f"File saved successfully: {file_path}")
-            
-        except Exception as e:
-            error_msg = f"保存文件时出错: {str(e)}"
-            logger.error(f"{error_msg} - 文件名: {file.filename}")
-            raise HTTPException(
-                status_code=500,
-                detail=error_msg
-            )
+        await save_upload(file, file_path)
         
-        try:
-            # 加载文档
-            loader = get_document_loader(file_path)
-            documents = loader.load()
-            
-            if not documents:
-                error_msg = "无法从文件中提取内容"
-                logger.error(f"{error_msg} - 文件名: {file.filename}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=error_msg
-                )
-                
-            logger.info(f"Loaded {len(documents)} documents from {file.filename}")
-            
-            # 分割文档
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len
-            )
-            texts = text_splitter.split_documents(documents)
-            
-            if not texts:
-                error_msg = "文档分割后没有内容"
-                logger.error(f"{error_msg} - 文件名: {file.filename}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=error_msg
-                )
-                
-            logger.info(f"Split into {len(texts)} chunks")
-            
-            # 添加到向量数据库
-            vectordb.add_documents(texts)
-            logger.info("Documents added to vector store")
-            
-            # 更新关键词库
-            await query_engine.update_keywords_from_docs()
-            logger.info("Keywords updated")
-            
-            return {"message": "文档已成功上传并处理", "filename": file.filename}
+        # 提交后台导入任务，立即返回任务ID
+        job = submit_job(file.filename, file_path, doc_id=file.filename)
+        return {
+            "message": "文档已上传，正在后台处理",
+            "filename": file.filename,
+            "job_id": job["id"],
+            "status": job["status"]
+        }
             
-        except HTTPException:
-            raise
-        except Exception as e:
-            error_msg = f"处理文档时出错: {str(e)}"
-            logger.error(f"{error_msg} - 文件名: {file.filename}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"服务器内部错误: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(
+            status_code=500,
+            detail=error_msg
+        )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询导入任务的状态、当前阶段和进度"""
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    job.pop("file_path", None)
+    job["stages"] = JOB_STAGES[job["kind"]]
+    return job
+
+def format_document(document: dict, job: dict = None) -> dict:
+    """文档列表中的一项，附带该文档最近的一个任务"""
+    return {
+        "doc_id": document["doc_id"],
+        "filename": document["filename"],
+        "chunk_count": document["chunk_count"],
+        "created_at": document["created_at"],
+        "updated_at": document["updated_at"],
+        "job": {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "error": job["error"],
+        } if job else None
+    }
+
+async def find_document(doc_id: str):
+    """返回 (文档记录, 该文档尚未完成的任务)；文档既没有记录也没有正在导入时返回 404"""
+    document = await run_in_thread(document_registry.get, doc_id)
+    pending = [job for job in await run_in_thread(job_store.pending) if job["doc_id"] == doc_id]
+    if document is None and not any(job["kind"] == "ingest" for job in pending):
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return document, pending
+
+@app.get("/documents")
+async def list_documents():
+    """列出知识库中的文档及其块数，包括首次导入尚未完成的文档"""
+    documents = await run_in_thread(document_registry.list)
+    latest = await run_in_thread(job_store.latest_by_document)
+    items = [format_document(document, latest.pop(document["doc_id"], None)) for document in documents]
+    for doc_id, job in latest.items():
+        if job["kind"] == "ingest" and job["status"] in ("queued", "running"):
+            items.append(format_document({
+                "doc_id": doc_id,
+                "filename": job["filename"],
+                "chunk_count": 0,
+                "created_at": job["created_at"],
+                "updated_at": None,
+            }, job))
+    return {"documents": items}
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """删除文档：删除只属于该文档的块，以及它的关键词、组件、上传的文件和引用它的缓存回答"""
+    require_ready()
+    document, pending = await find_document(doc_id)
+    for job in pending:
+        if job["kind"] == "delete":
+            return {"message": "文档正在删除", "doc_id": doc_id, "job_id": job["id"], "status": job["status"]}
+    # 与导入任务在同一个队列中按顺序执行，正在导入的文档在导入完成后删除
+    file_path = document["file_path"] if document else pending[-1]["file_path"]
+    job = submit_job(doc_id, file_path or "", doc_id=doc_id, kind="delete")
+    logger.info(f"Deleting document {doc_id} (job {job['id']})")
+    return {"message": "文档正在删除", "doc_id": doc_id, "job_id": job["id"], "status": job["status"]}
+
+@app.put("/documents/{doc_id}")
+async def replace_document(doc_id: str, file: UploadFile = File(...)):
+    """用新文件替换文档：只为内容变化的块计算向量，删除不再使用的块，并替换该文档的关键词和组件"""
+    require_ready()
+    try:
+        await find_document(doc_id)
+        # 文档ID即上传时的文件名，替换文件保存到同一位置，格式必须相同
+        ext = os.path.splitext(doc_id)[1].lower()
+        if file.filename and os.path.splitext(file.filename)[1].lower() != ext:
+            error_msg = f"替换文件的格式必须与原文档相同（{ext}）"
+            logger.error(f"{error_msg} - 文档: {doc_id}, 文件名: {file.filename}")
             raise HTTPException(
-                status_code=500,
+                status_code=400,
                 detail=error_msg
             )
-            
+        
+        await run_in_thread(check_upload_budget, doc_id)
+        
+        file_path = os.path.join(UPLOAD_DIRECTORY, doc_id)
+        await save_upload(file, file_path)
+        
+        job = submit_job(doc_id, file_path, doc_id=doc_id)
+        return {
+            "message": "文档已上传，正在后台替换",
+            "doc_id": doc_id,
+            "job_id": job["id"],
+            "status": job["status"]
+        }
+    
     except HTTPException:
         raise
     except Exception as e:
@@ -241,17 +723,12 @@ async def upload_file(file: UploadFile = File(...)):
 @app.post("/query")
 async def query_documents(query: QueryRequest):
     """查询知识库并获取回答"""
+    require_ready()
     try:
-        logger.info(f"Received query: {query.query}")
-        result = await query_engine.smart_query(query.query)
-        logger.info("Query processed successfully")
-        return {
-            "answer": result.answer,
-            "source_type": result.source_type,
-            "confidence": result.confidence,
-            "has_source_documents": len(result.source_documents) > 0,
-            "source_documents": result.source_documents if result.source_documents else None
-        }
+        logger.info("Received query: %.200s", query.query, extra=SAMPLED)
+        result = await query_engine.smart_query(query.query, query.filters)
+        logger.debug("Query processed successfully", extra=SAMPLED)
+        return format_query_result(result)
     except Exception as e:
         error_msg = f"查询处理出错: {str(e)}"
         logger.error(error_msg)
@@ -260,30 +737,150 @@ async def query_documents(query: QueryRequest):
             detail=error_msg
         )
 
+@app.post("/query/batch")
+async def query_documents_batch(request: BatchQueryRequest):
+    """批量查询：批量编码和检索，LLM 调用并发执行，结果顺序与输入一致"""
+    require_ready()
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多查询 {MAX_BATCH_QUERIES} 个问题"
+        )
+    logger.info("Received batch of %d queries", len(request.queries))
+
+    if request.stream:
+        async def ndjson_stream():
+            try:
+                async for i, result in query_engine.batch_query_stream(request.queries, BATCH_LLM_CONCURRENCY):
+                    yield json.dumps({"index": i, **format_query_result(result)}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                error_msg = f"批量查询处理出错: {str(e)}"
+                logger.error(error_msg)
+                yield json.dumps({"error": error_msg}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    try:
+        results = await query_engine.batch_query(request.queries, BATCH_LLM_CONCURRENCY)
+        logger.info("Batch query processed successfully")
+        return {"results": [format_query_result(result) for result in results]}
+    except Exception as e:
+        error_msg = f"批量查询处理出错: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(
+            status_code=500,
+            detail=error_msg
+        )
+
+@app.post("/query/stream")
+async def query_documents_stream(query: QueryRequest):
+    """流式查询：通过 Server-Sent Events 先返回路由结果和来源文档，再逐个返回 token"""
+    require_ready()
+
+    async def event_stream():
+        try:
+            logger.info("Received streaming query: %.200s", query.query, extra=SAMPLED)
+            async for event, data in query_engine.stream_query(query.query, query.filters):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            logger.debug("Streaming query processed successfully", extra=SAMPLED)
+        except Exception as e:
+            error_msg = f"查询处理出错: {str(e)}"
+            logger.error(error_msg)
+            yield f"event: error\ndata: {json.dumps({'detail': error_msg}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/query/components")
 async def query_with_components(query: QueryRequest):
-    """组件感知查询"""
-    result = await query_engine.component_aware_search(query.query)
+    """组件感知查询：匹配导入时提取的组件，只在它们引用的块中检索"""
+    require_ready()
+    try:
+        logger.info("Received component query: %.200s", query.query, extra=SAMPLED)
+        result = await query_engine.component_aware_search(query.query)
+    except Exception as e:
+        error_msg = f"查询处理出错: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
     return {
-        "answer": result.answer,
-        "source_type": result.source_type,
-        "confidence": result.confidence,
-        "has_source_documents": len(result.source_documents) > 0,
-        "source_documents": result.source_documents if result.source_documents else None,
+        **format_query_result(result),
         "matched_components": [
             {
                 "name": comp.name,
-                "description": comp.description
+                "description": comp.description,
+                "doc_id": comp.doc_id
             } for comp in result.matched_components
         ] if result.matched_components else None
     }
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """获取语义回答缓存的命中统计"""
+    if not query_engine:
+        raise HTTPException(status_code=500, detail="Query engine not initialized")
+    coalesced = query_engine.inflight_queries.shared
+    if not query_engine.answer_cache:
+        return {"enabled": False, "coalesced_queries": coalesced}
+    return {"enabled": True, "coalesced_queries": coalesced, **query_engine.answer_cache.stats()}
+
+def collect_cache_metrics() -> list:
+    """抓取时读取各缓存已有的统计值"""
+    families = [
+        ("rag_startup_component_seconds", "gauge", "Import and initialization time of each startup component",
+         [({"component": name}, seconds) for name, seconds in startup.components.items()]),
+        ("rag_ready", "gauge", "Whether warm-up has finished", [({}, int(startup.ready))]),
+    ]
+    if embeddings is not None:
+        families.extend([
+            ("rag_embedding_cache_hits_total", "counter", "Document embeddings served from the cache",
+             [({}, embeddings.hits)]),
+            ("rag_embedding_cache_misses_total", "counter", "Document embeddings computed by the model",
+             [({}, embeddings.misses)]),
+        ])
+    if query_engine:
+        families.append(("rag_coalesced_queries_total", "counter",
+                         "Queries that shared the result of an identical in-flight query",
+                         [({}, query_engine.inflight_queries.shared)]))
+        families.append(("rag_keywords", "gauge", "Keywords in the keyword index",
+                         [({}, len(query_engine.keywords))]))
+        if query_engine.answer_cache:
+            stats = query_engine.answer_cache.stats()
+            families.extend([
+                ("rag_answer_cache_hits_total", "counter", "Answer cache hits", [({}, stats["hits"])]),
+                ("rag_answer_cache_misses_total", "counter", "Answer cache misses", [({}, stats["misses"])]),
+                ("rag_answer_cache_entries", "gauge", "Entries in the answer cache", [({}, stats["entries"])]),
+                ("rag_answer_cache_bytes", "gauge", "Estimated answer cache size", [({}, stats["bytes"])]),
+            ])
+    return families
+
+REGISTRY.register_collector(collect_cache_metrics)
+
+@app.get("/health/live")
+async def liveness():
+    """存活检查：进程能处理请求即返回 200"""
+    return {"status": "alive", "state": startup.state}
+
+@app.get("/health/ready")
+async def readiness():
+    """就绪检查：预热完成后返回 200，否则返回 503；同时返回各组件的启动耗时"""
+    report = startup.report()
+    report["ingestion_leader"] = ingestion_worker is not None
+    report["pid"] = os.getpid()
+    return JSONResponse(report, status_code=200 if startup.ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 格式的指标：各阶段耗时直方图、按来源类型的查询数、LLM token 数和缓存命中情况"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/keywords")
 async def get_keywords():
     """获取当前的关键词列表"""
+    require_ready()
     try:
-        if not query_engine:
-            raise HTTPException(status_code=500, detail="Query engine not initialized")
         
         keywords = await query_engine.get_current_keywords()
         return {
@@ -294,6 +891,17 @@ async def get_keywords():
         logger.error(f"Error getting keywords: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/keywords/rebuild")
+async def rebuild_keywords():
+    """全量重建关键词库，短时间内的多次请求合并为一次重建"""
+    require_ready()
+    if not ingestion_worker:
+        # 由负责导入的进程执行重建，完成后各进程通过协调循环加载新版本
+        query_engine.keyword_store.request_rebuild()
+        return {"status": "queued", "total_keywords": len(query_engine.keywords)}
+    await query_engine.request_keyword_rebuild()
+    return {"status": "completed", "total_keywords": len(query_engine.keywords)}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,138 @@
+"""导入内存基准：比较一次性解析与流式导入在不同文件大小下的峰值内存和耗时
+
+whole 为原来的做法：在一个解析进程中加载全部页面并分割，所有块一次性计算向量，再写入 Chroma 和词法索引。
+streaming 为导入任务的实际流程：按页范围并行解析，分批分割、计算向量和写入索引，中间结果逐条写入磁盘。
+每次测量在独立的子进程中进行，分别记录服务进程和解析进程的峰值内存（VmHWM / ru_maxrss）。
+
+用法：cd server && python benchmarks/bench_ingest.py --pages 100,400,1600
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+MODES = ("whole", "streaming")
+
+
+def peak_rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def ingest_whole(workdir: str, path: str, embeddings) -> dict:
+    from langchain_chroma import Chroma
+    from document_processing import load_and_split
+    from executors import run_in_process, run_in_thread
+    from lexical_index import LexicalIndex
+
+    vectordb = Chroma(persist_directory=os.path.join(workdir, "db"), embedding_function=embeddings)
+    pages, chunks = await run_in_process(load_and_split, path)
+    texts = [chunk.page_content for chunk in chunks]
+    vectors = await run_in_thread(embeddings.embed_documents, texts)
+    # Chroma 单次写入的数量有上限，超过时只能分批写入
+    ids = [str(i) for i in range(len(chunks))]
+    limit = vectordb._client.get_max_batch_size()
+    for i in range(0, len(chunks), limit):
+        await run_in_thread(
+            vectordb._collection.upsert,
+            ids=ids[i:i + limit],
+            embeddings=vectors[i:i + limit],
+            documents=texts[i:i + limit],
+        )
+    await run_in_thread(LexicalIndex().add, ids, texts)
+    return {"pages": pages, "chunks": len(chunks)}
+
+
+async def ingest_streaming(workdir: str, path: str, embeddings) -> dict:
+    from langchain_chroma import Chroma
+    from advanced_query import AdvancedQueryEngine
+    from document_registry import DocumentRegistry
+    from embedding_backends import register_encoder_model
+    from ingest_jobs import STAGES, IngestionWorker, JobStore
+    from benchmarks.fakes import FakeChatModel, FakeEncoder
+
+    vectordb = Chroma(persist_directory=os.path.join(workdir, "db"), embedding_function=embeddings)
+    engine = AdvancedQueryEngine(vectordb=vectordb, llm=FakeChatModel(0))
+    register_encoder_model(engine.encoder_model, FakeEncoder())
+    store = JobStore(os.path.join(workdir, "jobs"))
+    registry = DocumentRegistry(os.path.join(workdir, "documents", "documents.db"))
+    worker = IngestionWorker(store, engine.partitions, embeddings, engine, registry)
+    job = store.create(os.path.basename(path), path, doc_id=os.path.basename(path))
+    # 关键词和组件提取调用 LLM，与文件解析的内存无关，这里不执行
+    for stage in STAGES[:STAGES.index("keywords")]:
+        await getattr(worker, f"_stage_{stage}")(job)
+    job = store.get(job["id"])
+    return {"pages": job["page_count"], "chunks": job["chunk_count"]}
+
+
+def run_once(mode: str, path: str) -> dict:
+    """在当前（子）进程中执行一次导入并输出测量结果"""
+    from executors import get_process_pool
+    from benchmarks.fakes import FakeEmbeddings
+
+    embeddings = FakeEmbeddings(size=384)
+    ingest = ingest_whole if mode == "whole" else ingest_streaming
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        result = asyncio.run(ingest(workdir, path, embeddings))
+        result["seconds"] = round(time.perf_counter() - start, 2)
+    # 等待解析进程退出后，RUSAGE_CHILDREN 才包含它们的峰值内存
+    get_process_pool().shutdown(wait=True)
+    result["server_peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["parser_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="100,400,1600", help="逗号分隔的 PDF 页数")
+    parser.add_argument("--lines-per-page", type=int, default=40, help="每页的文本行数")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔的导入方式")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_once(*args.run)))
+        return
+
+    from benchmarks.corpus import write_pdf
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in [int(p) for p in args.pages.split(",")]:
+            path = os.path.join(tmp, f"doc_{pages}.pdf")
+            write_pdf(path, pages, args.lines_per_page)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in args.modes.split(","):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run", mode, path],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result = {"mode": mode, "file_mb": round(size_mb, 2), **json.loads(output.strip().splitlines()[-1])}
+                results.append(result)
+                print(
+                    f"{mode:>9} {pages:>5} pages ({size_mb:6.1f} MB): {result['seconds']:6.2f}s, "
+                    f"server peak {result['server_peak_rss_mb']:7.1f} MB, parser peak {result['parser_peak_rss_mb']:7.1f} MB",
+                    flush=True
+                )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
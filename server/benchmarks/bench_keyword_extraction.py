@@ -0,0 +1,40 @@
+"""关键词提取吞吐量基准：使用本地假 LLM 验证吞吐量随并发数增长
+
+用法：cd server && python benchmarks/bench_keyword_extraction.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advanced_query import AdvancedQueryEngine  # noqa: E402
+from benchmarks.fakes import FakeChatModel  # noqa: E402
+
+
+def make_text(chunks: int) -> str:
+    paragraph = "keyword extraction benchmark paragraph about vector search and retrieval. "
+    return (paragraph * 60 + "\n\n") * chunks
+
+
+async def run(concurrency: int, text: str, latency: float) -> dict:
+    engine = AdvancedQueryEngine(vectordb=None, llm=FakeChatModel(latency), keyword_concurrency=concurrency)
+    start = time.perf_counter()
+    await engine.extract_keywords(text)
+    elapsed = time.perf_counter() - start
+    chunks = engine.llm.calls
+    return {"concurrency": concurrency, "chunks": chunks, "seconds": round(elapsed, 3),
+            "chunks_per_second": round(chunks / elapsed, 2)}
+
+
+def main():
+    text = make_text(int(os.getenv("BENCH_CHUNKS", "32")))
+    latency = float(os.getenv("BENCH_LLM_LATENCY", "0.1"))
+    for concurrency in (1, 2, 4, 8, 16):
+        print(json.dumps(asyncio.run(run(concurrency, text, latency))))
+
+
+if __name__ == "__main__":
+    main()
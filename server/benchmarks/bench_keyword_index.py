@@ -0,0 +1,66 @@
+"""关键词相似度检索微基准：比较原来的未归一化全量扫描与 KeywordIndex 各种存储方式
+
+用法：cd server && python benchmarks/bench_keyword_index.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import keyword_index  # noqa: E402
+from keyword_index import KeywordIndex  # noqa: E402
+
+DIM = 384
+SIZES = (1_000, 10_000, 100_000)
+QUERIES = 200
+
+
+def time_per_query(func, queries) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def recall_at_1(index: KeywordIndex, queries, exact_top) -> float:
+    hits = sum(int(index.search_batch(q, 1)[1][0, 0] == t) for q, t in zip(queries, exact_top))
+    return hits / len(queries)
+
+
+def clustered(rng, centers: np.ndarray, count: int, noise: float = 0.5) -> np.ndarray:
+    """围绕若干主题中心生成向量，比独立高斯向量更接近真实的关键词向量分布"""
+    picks = centers[rng.integers(0, len(centers), count)]
+    return (picks + noise * rng.standard_normal((count, DIM))).astype(np.float32)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        centers = rng.standard_normal((max(10, size // 50), DIM))
+        vectors = clustered(rng, centers, size)
+        keywords = [f"keyword-{i}" for i in range(size)]
+        queries = clustered(rng, centers, QUERIES)
+        exact_top = np.argmax(queries @ (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).T, axis=1)
+
+        results = {"keywords": size}
+        # 原实现：未归一化向量的点积全量扫描
+        results["baseline_us"] = round(time_per_query(lambda q: float(np.max(np.dot(vectors, q))), queries), 1)
+
+        configs = [("float32", None), ("float16", None), ("int8", None)]
+        if keyword_index.hnswlib is not None:
+            configs.append(("float32", 0))
+        for dtype, ann_threshold in configs:
+            index = KeywordIndex(dtype=dtype, ann_threshold=size + 1 if ann_threshold is None else ann_threshold)
+            index.set(keywords, vectors)
+            name = f"{dtype}_ann" if ann_threshold == 0 else dtype
+            results[f"{name}_us"] = round(time_per_query(index.max_similarity, queries), 1)
+            results[f"{name}_top10_us"] = round(time_per_query(lambda q: index.search(q, 10), queries), 1)
+            results[f"{name}_recall@1"] = round(recall_at_1(index, queries[:50], exact_top[:50]), 3)
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""日志开销基准：比较不同日志模式下 /query 每个请求的延迟
+
+每种模式在独立的子进程中启动服务（本地替身，LLM 与向量模型没有延迟，关闭回答缓存），
+先导入一个文档，再通过 ASGI 直接顺序发送查询，测量请求延迟；控制台输出写入管道，由父进程读取。
+另外单独测量一个查询的日志调用在调用线程中的耗时（log calls），不受其他处理的波动影响。
+
+- off：关闭所有日志，作为基准
+- sync：原来的方式，在调用线程中格式化并写入文件和控制台
+- queue：LOG_QUEUE=1，调用线程只把记录放入队列
+- queue-json：队列模式，输出 JSON
+- queue-json-sampled：队列模式，输出 JSON，高频日志只保留 10%
+
+用法：cd server && python benchmarks/bench_logging.py --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = {
+    "off": {},
+    "sync": {"LOG_QUEUE": "0", "LOG_FORMAT": "text"},
+    "queue": {"LOG_QUEUE": "1", "LOG_FORMAT": "text"},
+    "queue-json": {"LOG_QUEUE": "1", "LOG_FORMAT": "json"},
+    "queue-json-sampled": {"LOG_QUEUE": "1", "LOG_FORMAT": "json", "LOG_SAMPLE_RATE": "0.1"},
+}
+
+QUERIES = ["vector retrieval latency", "知识库 检索 性能", "how does the parser handle chunk upload", "embedding cache"]
+
+
+async def measure(mode: str, requests: int) -> dict:
+    import logging
+    import httpx
+    import numpy as np
+    from langchain_chroma import Chroma
+    import app as server
+    from embedding_backends import register_encoder_model
+    from embedding_cache import CachedEmbeddings
+    from benchmarks.corpus import write_pdf
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings, FakeEncoder
+
+    server.embeddings = CachedEmbeddings(FakeEmbeddings(size=384), server.EMBEDDING_CACHE_PATH)
+    server.vectordb = Chroma(persist_directory=server.PERSIST_DIRECTORY, embedding_function=server.embeddings)
+    server.llm = FakeChatModel(latency=0)
+    register_encoder_model(server.ENCODER_MODEL, FakeEncoder())
+    await server.startup_event()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        path = os.path.join(server.UPLOAD_DIRECTORY, "corpus.pdf")
+        write_pdf(path, 10)
+        with open(path, "rb") as f:
+            job = (await client.post("/upload", files={"file": ("corpus.pdf", f)})).json()
+        while (await client.get(f"/jobs/{job['job_id']}")).json()["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.05)
+
+        if mode == "off":
+            logging.disable(logging.CRITICAL)
+        # 预热
+        for i in range(50):
+            await client.post("/query", json={"query": QUERIES[i % len(QUERIES)]})
+
+        latencies = []
+        start = time.perf_counter()
+        for i in range(requests):
+            query = f"{QUERIES[i % len(QUERIES)]} {i}"
+            t = time.perf_counter()
+            response = await client.post("/query", json={"query": query})
+            latencies.append(time.perf_counter() - t)
+            response.raise_for_status()
+        elapsed = time.perf_counter() - start
+
+    # 只测调用线程中的日志开销：按 /query 的日志调用顺序模拟请求，不包含其他处理
+    from logger_config import SAMPLED, request_id_var, setup_logger
+    app_logger, engine_logger = setup_logger("app"), setup_logger("query_engine")
+    call_start = time.perf_counter()
+    for i in range(requests):
+        token = request_id_var.set(f"{i:016x}")
+        query = QUERIES[i % len(QUERIES)]
+        app_logger.info("Received query: %.200s", query, extra=SAMPLED)
+        engine_logger.debug("Query similarity score: %.4f", 0.5, extra=SAMPLED)
+        engine_logger.info("Query: '%.200s' - Similarity: %.4f", query, 0.5, extra=SAMPLED)
+        app_logger.debug("Query processed successfully", extra=SAMPLED)
+        app_logger.debug("%s %s %d %.1fms", "POST", "/query", 200, 3.0, extra={
+            **SAMPLED, "http": {"method": "POST", "path": "/query", "status": 200},
+            "duration_ms": 3.0, "stages": {"embed_query": 0.4, "retrieve": 1.2},
+        })
+        request_id_var.reset(token)
+    log_call_us = (time.perf_counter() - call_start) / requests * 1e6
+
+    await server.shutdown_event()
+    latencies = np.array(latencies) * 1e6
+    return {
+        "mode": mode,
+        "requests": requests,
+        "mean_us": round(float(latencies.mean()), 1),
+        "p50_us": round(float(np.percentile(latencies, 50)), 1),
+        "p99_us": round(float(np.percentile(latencies, 99)), 1),
+        "requests_per_second": round(requests / elapsed, 1),
+        "log_calls_us": round(log_call_us, 1),
+    }
+
+
+def run_mode(mode: str, requests: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            **MODES[mode],
+            "OPENAI_API_KEY": "sk-offline-benchmark",
+            "PERSIST_DIRECTORY": os.path.join(tmp, "db"),
+            "UPLOAD_DIRECTORY": os.path.join(tmp, "uploads"),
+            "LOG_DIRECTORY": os.path.join(tmp, "log"),
+            "LAZY_STARTUP": "0",
+            "ANSWER_CACHE_ENABLED": "0",
+            "KEYWORD_DEBOUNCE_SECONDS": "0.1",
+        }
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", mode, "--requests", str(requests)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["log_bytes"] = sum(
+            os.path.getsize(os.path.join(tmp, "log", name)) for name in os.listdir(os.path.join(tmp, "log"))
+        ) if os.path.isdir(os.path.join(tmp, "log")) else 0
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="每种模式的查询数")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔的日志模式")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(asyncio.run(measure(args.run, args.requests))))
+        return
+
+    results = []
+    baseline = None
+    for mode in args.modes.split(","):
+        result = run_mode(mode, args.requests)
+        if mode == "off":
+            baseline = result["mean_us"]
+        if baseline is not None:
+            result["overhead_us"] = round(result["mean_us"] - baseline, 1)
+        results.append(result)
+        overhead = f", overhead {result['overhead_us']:7.1f} us" if "overhead_us" in result else ""
+        print(
+            f"{mode:>18}: mean {result['mean_us']:8.1f} us, p50 {result['p50_us']:8.1f} us, "
+            f"p99 {result['p99_us']:8.1f} us, log calls {result['log_calls_us']:6.1f} us, "
+            f"{result['log_bytes'] / 1024:8.1f} KB logged{overhead}",
+            flush=True
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""分区检索基准：比较单个集合与多个分区在语料增长时的检索延迟
+
+每种语料规模分别构建两个向量库：不分区（1 个集合）和 --partitions 个分区，
+文档按文档ID的哈希分配到分区，块带有文档、来源类型和页码元数据，并在文档记录中登记。
+每个向量库测量三类检索（不含计算查询向量的时间，查询向量预先生成）：
+
+- all：不限范围，分区时并行检索所有分区后合并
+- doc：限定一个文档，分区时只检索该文档所在的分区
+- source_type：按来源类型过滤（约四分之一的文档），分区时检索所有分区
+
+同时计算每类检索相对于精确最近邻（numpy 暴力计算）的 recall@k：HNSW 是近似检索，
+随机向量上单个大集合的召回率会下降，分区后每个分区各取 k 个再合并，召回率通常更高。
+
+用法：cd server && python benchmarks/bench_partitions.py --sizes 1000,5000,20000 --partitions 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+import numpy as np  # noqa: E402
+from langchain_chroma import Chroma  # noqa: E402
+from advanced_query import AdvancedQueryEngine  # noqa: E402
+from document_registry import DocumentRegistry  # noqa: E402
+from embedding_cache import content_hash  # noqa: E402
+from vector_partitions import QueryFilter, VectorPartitions  # noqa: E402
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings  # noqa: E402
+
+SOURCE_TYPES = ("pdf", "pdf", "pdf", "epub")
+BATCH_SIZE = 1000
+
+
+def make_corpus(rng: np.random.Generator, chunks: int, chunks_per_doc: int, dimension: int):
+    """生成文档和随机单位向量，返回 [(文档ID, 来源类型, [(块ID, 内容, 页码)])] 和 {块ID: 向量}"""
+    documents = []
+    vectors = {}
+    for d in range(max(1, chunks // chunks_per_doc)):
+        source_type = SOURCE_TYPES[d % len(SOURCE_TYPES)]
+        doc_id = f"doc{d:05d}.{source_type}"
+        doc_chunks = []
+        for c in range(chunks_per_doc):
+            text = f"{doc_id} chunk {c}"
+            chunk_id = content_hash(text)
+            vector = rng.standard_normal(dimension).astype(np.float32)
+            vectors[chunk_id] = vector / np.linalg.norm(vector)
+            doc_chunks.append((chunk_id, text, c // 4))
+        documents.append((doc_id, source_type, doc_chunks))
+    return documents, vectors
+
+
+def build_engine(directory: str, documents, vectors, count: int, dimension: int) -> AdvancedQueryEngine:
+    vectordb = Chroma(persist_directory=os.path.join(directory, "db"), embedding_function=FakeEmbeddings(dimension))
+    partitions = VectorPartitions(vectordb, count)
+    partitions.ensure_layout()
+    registry = DocumentRegistry(os.path.join(directory, "documents.db"))
+    pending = {index: [] for index in range(count)}
+
+    def flush(index: int):
+        batch, pending[index] = pending[index], []
+        partitions.collection(index).upsert(
+            ids=[item[0] for item in batch],
+            embeddings=[vectors[item[0]].tolist() for item in batch],
+            documents=[item[1] for item in batch],
+            metadatas=[item[2] for item in batch],
+        )
+
+    for doc_id, source_type, doc_chunks in documents:
+        index = partitions.partition_of(doc_id)
+        for chunk_id, text, page in doc_chunks:
+            pending[index].append((chunk_id, text, {"doc_id": doc_id, "source_type": source_type, "page": page}))
+        if len(pending[index]) >= BATCH_SIZE:
+            flush(index)
+        registry.register(doc_id, doc_id, None, [chunk_id for chunk_id, _, _ in doc_chunks])
+    for index in range(count):
+        if pending[index]:
+            flush(index)
+    return AdvancedQueryEngine(
+        vectordb=vectordb, llm=FakeChatModel(0), partitions=partitions, document_registry=registry
+    )
+
+
+def exact_top_k(matrix: np.ndarray, ids, allowed: np.ndarray, queries, k: int):
+    """在 allowed 标记的块中精确计算每个查询最近的 k 个块ID（L2 距离，与 Chroma 默认一致）"""
+    subset, subset_ids = matrix[allowed], [chunk_id for chunk_id, keep in zip(ids, allowed) if keep]
+    results = []
+    for vector in queries:
+        distances = ((subset - vector) ** 2).sum(axis=1)
+        results.append([subset_ids[i] for i in np.argsort(distances)[:k]])
+    return results
+
+
+def measure(engine: AdvancedQueryEngine, queries, filters, k: int):
+    """依次执行检索，返回 (各次延迟, 各次结果的块ID)"""
+    latencies, results = [], []
+    for vector, query_filter in zip(queries, filters):
+        start = time.perf_counter()
+        scope = engine.resolve_filter(query_filter) if query_filter else None
+        docs = engine.search_documents_batch(["query"], k, [vector], None, scope)[0]
+        latencies.append(time.perf_counter() - start)
+        results.append([content_hash(doc.page_content) for doc, _ in docs])
+    return latencies, results
+
+
+def summarize(latencies) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,5000,20000", help="逗号分隔的语料块数")
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--chunks-per-doc", type=int, default=50)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        rng = np.random.default_rng(size)
+        documents, vectors = make_corpus(rng, size, args.chunks_per_doc, args.dimension)
+        queries = rng.standard_normal((args.queries, args.dimension)).astype(np.float32)
+        pick = random.Random(size)
+        filters = {
+            "all": [None] * args.queries,
+            "doc": [QueryFilter(doc_ids=[pick.choice(documents)[0]]) for _ in range(args.queries)],
+            "source_type": [QueryFilter(source_types=["epub"])] * args.queries,
+        }
+
+        # 精确最近邻，用于计算召回率
+        ids = list(vectors)
+        matrix = np.stack([vectors[chunk_id] for chunk_id in ids])
+        doc_of = {
+            chunk_id: (doc_id, source_type)
+            for doc_id, source_type, chunks in documents for chunk_id, _, _ in chunks
+        }
+        exact = {
+            "all": exact_top_k(matrix, ids, np.ones(len(ids), dtype=bool), queries, args.k),
+            "doc": [
+                exact_top_k(matrix, ids, np.array([doc_of[c][0] == f.doc_ids[0] for c in ids]), [q], args.k)[0]
+                for q, f in zip(queries, filters["doc"])
+            ],
+            "source_type": exact_top_k(matrix, ids, np.array([doc_of[c][1] == "epub" for c in ids]), queries, args.k),
+        }
+
+        row = {"chunks": size, "documents": len(documents)}
+        for label, count in (("single", 1), ("partitioned", args.partitions)):
+            with tempfile.TemporaryDirectory() as directory:
+                start = time.perf_counter()
+                engine = build_engine(directory, documents, vectors, count, args.dimension)
+                row[f"{label}_build_seconds"] = round(time.perf_counter() - start, 2)
+                for mode, mode_filters in filters.items():
+                    # 预热：加载各分区的索引
+                    measure(engine, queries[:10], mode_filters[:10], args.k)
+                    latencies, ranked = measure(engine, queries, mode_filters, args.k)
+                    row[f"{label}/{mode}"] = {
+                        **summarize(latencies),
+                        "recall": round(float(np.mean([
+                            len(set(found) & set(expected)) / len(expected)
+                            for found, expected in zip(ranked, exact[mode])
+                        ])), 3),
+                    }
+                engine.partitions.close()
+                engine.document_registry.close()
+        results.append(row)
+        print(
+            f"{size:>7} chunks: "
+            + ", ".join(
+                f"{label}/{mode} p50 {row[f'{label}/{mode}']['p50_ms']:6.2f} ms "
+                f"(recall {row[f'{label}/{mode}']['recall']:.2f})"
+                for label in ("single", "partitioned") for mode in filters
+            ),
+            flush=True
+        )
+
+    print(json.dumps({"partitions": args.partitions, "k": args.k, "results": results}, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""上传期间的查询延迟基准：比较在事件循环上直接解析与使用执行层时 /query 的 p50/p99
+
+用法：cd server && python benchmarks/bench_query_latency.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from langchain_chroma import Chroma  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+from advanced_query import AdvancedQueryEngine  # noqa: E402
+from document_processing import load_and_split  # noqa: E402
+from embedding_backends import register_encoder_model  # noqa: E402
+from executors import run_in_process, run_in_thread, shutdown_executors  # noqa: E402
+from benchmarks.corpus import WORDS, write_pdf  # noqa: E402
+from benchmarks.fakes import FakeChatModel, FakeEncoder  # noqa: E402
+
+QUERIES = ["vector retrieval latency", "知识库 检索", "how does the parser work", "chunk upload"]
+
+
+async def query_loop(engine: AdvancedQueryEngine, stop: asyncio.Event) -> list:
+    latencies = []
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await engine.smart_query(QUERIES[i % len(QUERIES)])
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    return latencies
+
+
+async def upload_inline(vectordb: Chroma, path: str):
+    """旧的实现：解析、分割和写入都在事件循环上执行"""
+    _, texts = load_and_split(path)
+    vectordb.add_documents(texts)
+
+
+async def upload_offloaded(vectordb: Chroma, path: str):
+    _, texts = await run_in_process(load_and_split, path)
+    await run_in_thread(vectordb.add_documents, texts)
+
+
+async def run_scenario(name: str, engine: AdvancedQueryEngine, upload, path: str, idle_seconds: float) -> dict:
+    stop = asyncio.Event()
+    loop_task = asyncio.create_task(query_loop(engine, stop))
+    # 先让查询循环跑起来，再开始上传
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    if upload:
+        await upload(engine.vectordb, path)
+    else:
+        await asyncio.sleep(idle_seconds)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    latencies = np.array(await loop_task) * 1000
+    return {
+        "scenario": name,
+        "seconds": round(elapsed, 3),
+        "queries": int(len(latencies)),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+    }
+
+
+async def main():
+    pages = int(os.getenv("BENCH_PAGES", "300"))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.pdf")
+        write_pdf(path, pages)
+        vectordb = Chroma(
+            persist_directory=os.path.join(tmp, "db"),
+            embedding_function=DeterministicFakeEmbedding(size=384),
+        )
+        engine = AdvancedQueryEngine(vectordb=vectordb, llm=FakeChatModel(latency=0.005))
+        register_encoder_model(engine.encoder_model, FakeEncoder())
+        await engine._merge_keywords("seed", WORDS)
+        await run_in_thread(vectordb.add_texts, [" ".join(WORDS)] * 10)
+        # 预热进程池，避免把子进程启动时间计入结果
+        await run_in_process(len, "warmup")
+
+        results = [
+            await run_scenario("idle", engine, None, path, idle_seconds=2.0),
+            await run_scenario("upload_inline", engine, upload_inline, path, 0),
+            await run_scenario("upload_offloaded", engine, upload_offloaded, path, 0),
+        ]
+        for result in results:
+            print(json.dumps(result))
+    shutdown_executors()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
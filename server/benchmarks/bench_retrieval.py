@@ -0,0 +1,168 @@
+"""检索基准：比较纯向量检索、BM25 词法检索、RRF 融合检索和词法快速路径的召回率与延迟
+
+pipeline 为查询时的实际流程：词法命中足够确定时直接使用词法结果，否则使用融合结果。
+
+语料中每个块包含一个唯一的代码标识符和一个唯一的中文术语，查询分为三类：
+标识符查询、中文术语查询和从块中抽取若干词组成的描述性查询。
+向量模型使用带固定延迟的特征哈希替身，模拟每次查询调用一次向量 API。
+
+用法：cd server && python benchmarks/bench_retrieval.py --chunks 2000 --queries 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+from langchain_chroma import Chroma  # noqa: E402
+from advanced_query import AdvancedQueryEngine  # noqa: E402
+from embedding_cache import content_hash  # noqa: E402
+from benchmarks.corpus import WORDS  # noqa: E402
+from benchmarks.fakes import FakeChatModel, HashingEmbeddings  # noqa: E402
+
+EXTRA_WORDS = (
+    "configuration timeout retry session token cache worker queue pipeline schema "
+    "migration replica shard cluster backup restore metrics logging tracing alert configure"
+).split()
+CJK_CHARS = "数据配置服务节点集群缓存队列日志监控备份恢复迁移副本分片权限认证加密压缩"
+
+
+def make_corpus(rng: random.Random, count: int):
+    vocabulary = WORDS + EXTRA_WORDS
+    chunks = []
+    for i in range(count):
+        identifier = f"{rng.choice(EXTRA_WORDS)}{rng.choice(EXTRA_WORDS).title()}{i}.{rng.choice(EXTRA_WORDS)}"
+        term = "".join(rng.sample(CJK_CHARS, 4)) + str(i)
+        words = [rng.choice(vocabulary) for _ in range(120)]
+        words.insert(rng.randrange(len(words)), identifier)
+        words.insert(rng.randrange(len(words)), term)
+        chunks.append({"text": " ".join(words), "identifier": identifier, "term": term, "words": words})
+    return chunks
+
+
+def make_queries(rng: random.Random, chunks, count: int):
+    queries = []
+    for i in range(count):
+        target = rng.randrange(len(chunks))
+        chunk = chunks[target]
+        kind = ("identifier", "cjk", "descriptive")[i % 3]
+        if kind == "identifier":
+            text = f"how do I configure {chunk['identifier']}"
+        elif kind == "cjk":
+            text = f"{chunk['term']} 是什么"
+        else:
+            start = rng.randrange(len(chunk["words"]) - 8)
+            text = " ".join(chunk["words"][start:start + 8])
+        queries.append({"text": text, "kind": kind, "target": content_hash(chunk["text"])})
+    return queries
+
+
+def summarize(latencies, hits_at_1, hits_at_3) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "recall_at_1": round(sum(hits_at_1) / len(hits_at_1), 3),
+        "recall_at_3": round(sum(hits_at_3) / len(hits_at_3), 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="模拟向量 API 每次调用的延迟（秒）")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    chunks = make_corpus(rng, args.chunks)
+    queries = make_queries(rng, chunks, args.queries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        embeddings = HashingEmbeddings(latency=0.0)
+        vectordb = Chroma(persist_directory=directory, embedding_function=embeddings)
+        texts = [c["text"] for c in chunks]
+        ids = [content_hash(t) for t in texts]
+        for i in range(0, len(texts), 500):
+            vectordb._collection.upsert(
+                ids=ids[i:i + 500], documents=texts[i:i + 500],
+                embeddings=embeddings.embed_documents(texts[i:i + 500])
+            )
+        engine = AdvancedQueryEngine(vectordb=vectordb, llm=FakeChatModel())
+        start = time.perf_counter()
+        asyncio.run(engine.index_chunks(ids, texts))
+        build_seconds = time.perf_counter() - start
+        embeddings.latency = args.embed_latency
+
+        methods = {
+        name: {"latencies": [], "at1": [], "at3": []} for name in ("vector", "lexical", "fused", "pipeline")
+    }
+        by_kind = {}
+        fast_path = {"answered": 0, "correct": 0}
+        for query in queries:
+            text, target = query["text"], query["target"]
+
+            start = time.perf_counter()
+            hits = engine.lexical_index.search(text, engine.fusion_candidates)
+            if engine.is_confident_lexical_hit(hits):
+                pipeline_ids = [chunk_id for chunk_id, _, _ in hits[:3]]
+            else:
+                docs = vectordb.similarity_search_with_score(text, k=engine.fusion_candidates)
+                pipeline_ids = [chunk_id for chunk_id, _ in engine.fuse_results(docs, hits, k=3)]
+            pipeline_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            vector_docs = vectordb.similarity_search_with_score(text, k=engine.fusion_candidates)
+            vector_seconds = time.perf_counter() - start
+            vector_ids = [content_hash(doc.page_content) for doc, _ in vector_docs]
+
+            start = time.perf_counter()
+            lexical_hits = engine.lexical_index.search(text, engine.fusion_candidates)
+            lexical_seconds = time.perf_counter() - start
+            lexical_ids = [chunk_id for chunk_id, _, _ in lexical_hits]
+
+            start = time.perf_counter()
+            fused_ids = [chunk_id for chunk_id, _ in engine.fuse_results(vector_docs, lexical_hits, k=3)]
+            fused_seconds = vector_seconds + lexical_seconds + time.perf_counter() - start
+
+            if engine.is_confident_lexical_hit(lexical_hits):
+                fast_path["answered"] += 1
+                fast_path["correct"] += int(lexical_ids[0] == target)
+
+            for name, ranked, seconds in (
+                ("vector", vector_ids, vector_seconds),
+                ("lexical", lexical_ids, lexical_seconds),
+                ("fused", fused_ids, fused_seconds),
+                ("pipeline", pipeline_ids, pipeline_seconds),
+            ):
+                for bucket in (methods[name], by_kind.setdefault((query["kind"], name), {"at1": [], "at3": []})):
+                    bucket["at1"].append(int(ranked[:1] == [target]))
+                    bucket["at3"].append(int(target in ranked[:3]))
+                methods[name]["latencies"].append(seconds)
+
+    results = {
+        "chunks": args.chunks,
+        "queries": args.queries,
+        "embed_latency_ms": args.embed_latency * 1000,
+        "lexical_build_seconds": round(build_seconds, 3),
+        "methods": {name: summarize(m["latencies"], m["at1"], m["at3"]) for name, m in methods.items()},
+        "recall_at_3_by_kind": {
+            f"{kind}/{name}": round(sum(b["at3"]) / len(b["at3"]), 3) for (kind, name), b in by_kind.items()
+        },
+        "fast_path": {
+            "share": round(fast_path["answered"] / len(queries), 3),
+            "precision": round(fast_path["correct"] / fast_path["answered"], 3) if fast_path["answered"] else None,
+        },
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
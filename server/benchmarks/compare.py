@@ -0,0 +1,39 @@
+"""比较两次基准测试结果，输出每个数值指标的变化
+
+用法：python benchmarks/compare.py before.json after.json
+"""
+import json
+import sys
+
+
+def flatten(data, prefix=""):
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        before = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        after = json.load(f)
+    before.pop("config", None)
+    after.pop("config", None)
+
+    old, new = flatten(before), flatten(after)
+    print(f"{'metric':<45}{'before':>12}{'after':>12}{'change':>10}")
+    for name in sorted(set(old) | set(new)):
+        a, b = old.get(name), new.get(name)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+        print(f"{name:<45}{a if a is not None else '-':>12}{b if b is not None else '-':>12}{change:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""生成基准测试使用的合成 PDF 语料"""
+import random
+from typing import List, Sequence
+
+WORDS = (
+    "vector retrieval keyword embedding chroma document chunk query answer "
+    "model index search latency throughput upload parser splitter context "
+    "知识库 文档 检索 向量 关键词 问答 模型 索引"
+).split()
+
+
+def page_marker(seed: int, page: int) -> str:
+    """PDF 每页第一行的标记词，只出现在这一页，用于构造只靠词法检索就能确定命中的查询"""
+    return f"marker{seed}p{page}"
+
+
+def make_lines(rng: random.Random, count: int, words_per_line: int = 12) -> List[str]:
+    return [" ".join(rng.choice(WORDS) for _ in range(words_per_line)) for _ in range(count)]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 0, short_pages: Sequence[str] = ()):
+    """写出一个只包含 ASCII 文本的最小 PDF 文件
+
+    每页第一行是 page_marker(seed, 页号)，其后是随机词；short_pages 中的每个短语单独追加为一页。
+    """
+    rng = random.Random(seed)
+    texts = [[page_marker(seed, page)] + make_lines(rng, lines_per_page) for page in range(pages)]
+    texts += [[phrase] for phrase in short_pages]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # 页面树，所有页对象确定后再填充
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page_lines in texts:
+        lines = [line.encode("ascii", "ignore").decode() for line in page_lines]
+        text = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = text.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(texts)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_epub(path: str, chapters: int, paragraphs_per_chapter: int = 30, seed: int = 0):
+    """写出一个最小的 EPUB 3 文件，每章一个 XHTML 文档"""
+    import zipfile
+    from xml.sax.saxutils import escape
+
+    rng = random.Random(seed)
+    items, spine, navs = [], [], []
+    with zipfile.ZipFile(path, "w") as book:
+        # mimetype 必须是第一个文件且不压缩
+        book.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        book.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            "</rootfiles></container>",
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        for i in range(chapters):
+            name = f"chapter{i + 1}.xhtml"
+            body = "".join(f"<p>{escape(line)}</p>" for line in make_lines(rng, paragraphs_per_chapter, 40))
+            book.writestr(
+                f"OEBPS/{name}",
+                '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                f"<head><title>Chapter {i + 1}</title></head><body><h1>Chapter {i + 1}</h1>{body}</body></html>",
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+            items.append(f'<item id="c{i + 1}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{i + 1}"/>')
+            navs.append(f'<li><a href="{name}">Chapter {i + 1}</a></li>')
+        book.writestr(
+            "OEBPS/nav.xhtml",
+            '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>Contents</title></head><body>'
+            f'<nav epub:type="toc"><ol>{"".join(navs)}</ol></nav></body></html>',
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        book.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="id"><metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="id">bench-{seed}</dc:identifier><dc:title>Benchmark {seed}</dc:title>'
+            '<dc:language>en</dc:language><meta property="dcterms:modified">2024-01-01T00:00:00Z</meta>'
+            '</metadata><manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" '
+            f'properties="nav"/>{"".join(items)}</manifest><spine>{"".join(spine)}</spine></package>',
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
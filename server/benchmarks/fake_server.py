@@ -0,0 +1,36 @@
+"""使用本地替身启动 FastAPI 服务：假的向量模型、句向量模型和聊天模型，不访问 OpenAI，也不下载模型
+
+由 run_suite.py 以子进程方式启动，配置通过环境变量传入：
+PERSIST_DIRECTORY / UPLOAD_DIRECTORY 指向临时目录，
+BENCH_PORT、BENCH_LLM_LATENCY、BENCH_EMBED_LATENCY 控制端口和模拟延迟。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+    import uvicorn
+    from langchain_chroma import Chroma
+    import app as server
+    from embedding_backends import register_encoder_model
+    from embedding_cache import CachedEmbeddings
+    from benchmarks.fakes import FakeChatModel, FakeEncoder, HashingEmbeddings
+
+    # 词袋哈希向量：与块的词越接近相似度越高，查询可以命中 document 路由
+    server.embeddings = CachedEmbeddings(
+        HashingEmbeddings(latency=float(os.getenv("BENCH_EMBED_LATENCY", "0.05"))),
+        server.EMBEDDING_CACHE_PATH
+    )
+    server.vectordb = Chroma(persist_directory=server.PERSIST_DIRECTORY, embedding_function=server.embeddings)
+    server.llm = FakeChatModel(latency=float(os.getenv("BENCH_LLM_LATENCY", "0.2")))
+    register_encoder_model(server.ENCODER_MODEL, FakeEncoder())
+
+    uvicorn.run(server.app, host="127.0.0.1", port=int(os.getenv("BENCH_PORT", "8765")), log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
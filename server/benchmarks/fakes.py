@@ -0,0 +1,120 @@
+"""离线基准测试使用的本地替身，不访问任何网络服务"""
+import asyncio
+import hashlib
+import re
+import time
+from typing import List, Union
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_]{3,}|[一-鿿]{2,4}")
+
+# 提示词中正文开始的位置（关键词、组件提取为“文本内容：”，回答为“文档内容：”），之前是给模型的说明
+CONTENT_MARKERS = ("文本内容：", "文档内容：")
+
+
+class FakeChatModel:
+    """模拟 ChatOpenAI 的聊天模型，每次调用固定延迟后返回确定性的内容"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0  # 同时进行的调用数的最大值
+
+    def _reply(self, messages) -> str:
+        """取提示词正文中的前 15 个不同的词，每行一个；没有正文标记时（直接提问）取整个提示词"""
+        text = messages[-1].content
+        for marker in CONTENT_MARKERS:
+            if marker in text:
+                text = text.split(marker, 1)[1]
+                break
+        words = list(dict.fromkeys(WORD_PATTERN.findall(text)))
+        return "\n".join(words[:15]) or "fake"
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        return AIMessage(content=self._reply(messages))
+
+    async def astream(self, messages, **kwargs):
+        """先等待一个延迟（首个 token），之后逐词返回"""
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        for word in self._reply(messages).split("\n"):
+            yield AIMessageChunk(content=word + "\n")
+
+
+class FakeEmbeddings(Embeddings):
+    """模拟 OpenAIEmbeddings：根据文本哈希生成确定性的单位向量，每次调用固定延迟"""
+
+    def __init__(self, size: int = 1536, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"fake-{size}"
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbeddings(Embeddings):
+    """按词袋做特征哈希的向量模型：词重叠越多相似度越高，用于比较检索召回率；每次调用固定延迟"""
+
+    def __init__(self, size: int = 512, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"hashing-{size}"
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+            vector[digest % self.size] += 1.0 if digest & 1 << 31 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeEncoder:
+    """模拟 SentenceTransformer 的句向量模型，用于查询路由、关键词和组件匹配，不下载模型
+
+    按词袋做特征哈希，词重叠越多相似度越高；每次调用固定延迟。
+    """
+
+    def __init__(self, size: int = 384, latency: float = 0.0):
+        self.hashing = HashingEmbeddings(size)
+        self.latency = latency
+        self.calls = 0
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        self.calls += 1
+        time.sleep(self.latency)
+        if isinstance(sentences, str):
+            return np.asarray(self.hashing._vector(sentences), dtype=np.float32)
+        vectors = [self.hashing._vector(text) for text in sentences]
+        return np.asarray(vectors, dtype=np.float32).reshape(-1, self.hashing.size)
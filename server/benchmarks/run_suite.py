@@ -0,0 +1,247 @@
+"""离线基准测试套件：用本地替身启动服务，测量启动时间、上传吞吐量、各路由的查询延迟和峰值内存
+
+用法：cd server && python benchmarks/run_suite.py --pdf-docs 2 --pages 100 --output bench.json
+结果为 JSON，可以用 benchmarks/compare.py 比较两次提交的结果。
+查询轮流使用为每个路由（document、hybrid、lexical、llm）构造的问题，某个路由没有任何查询时以非零状态退出。
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from benchmarks.corpus import page_marker, write_epub, write_pdf  # noqa: E402
+
+# 每个 PDF 末尾单独成页的词：与关键词和这一页的向量都完全匹配，走 document 路由
+SHORT_PAGES = ["latency", "throughput"]
+# 关键词库中有、但没有单独成页的词：检索到的块相似度不够，走 hybrid 路由
+HYBRID_QUERIES = ["vector", "retrieval", "parser", "splitter"]
+# 与语料无关的问题，走 llm 路由
+GENERAL_QUERIES = ["what is the capital of france", "write a haiku about autumn", "explain recursion briefly"]
+ROUTES = ["document", "hybrid", "lexical", "llm"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(url: str, body: bytes = None, headers: dict = None, timeout: float = 600) -> dict:
+    req = urllib.request.Request(url, data=body, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def post_query(url: str, query: str) -> str:
+    """发送查询，返回实际使用的路由
+
+    词法快速路径返回的 source_type 也是 document，按 Server-Timing 中没有 route 阶段区分；
+    命中回答缓存时没有 lexical 阶段，记为 cached。
+    """
+    req = urllib.request.Request(
+        url, json.dumps({"query": query}).encode("utf-8"), {"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req, timeout=600) as response:
+        result = json.loads(response.read())
+        stages = {part.split(";")[0].strip() for part in response.headers.get("Server-Timing", "").split(",")}
+    if "lexical" not in stages:
+        return "cached"
+    if result["source_type"] == "document" and "route" not in stages:
+        return "lexical"
+    return result["source_type"]
+
+
+def post_file(url: str, path: str) -> dict:
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        content = f.read()
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+        f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: application/octet-stream\r\n\r\n"
+    ).encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return request(url, body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+
+def peak_rss_mb(pid: int) -> float:
+    """从 /proc 读取进程的峰值常驻内存（Linux）"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 2)
+
+    return {"count": len(values), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(values[-1] * 1000, 2)}
+
+
+class Server:
+    """以子进程方式运行 benchmarks/fake_server.py"""
+
+    def __init__(self, workdir: str, args):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "PERSIST_DIRECTORY": os.path.join(workdir, "db"),
+            "UPLOAD_DIRECTORY": os.path.join(workdir, "uploads"),
+            "BENCH_PORT": str(self.port),
+            "BENCH_LLM_LATENCY": str(args.llm_latency),
+            "BENCH_EMBED_LATENCY": str(args.embed_latency),
+            "ANSWER_CACHE_ENABLED": "1" if args.answer_cache else "0",
+            "SERVER_TIMING_ENABLED": "1",
+        }
+        self.process = None
+
+    def start(self, timeout: float = 300) -> dict:
+        """启动服务并等待就绪，返回就绪耗时和服务报告的各组件启动耗时"""
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(SERVER_DIR, "benchmarks", "fake_server.py")],
+            cwd=SERVER_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        while time.perf_counter() - start < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError("benchmark server exited during startup")
+            try:
+                report = request(f"{self.base_url}/health/ready", timeout=1)
+                return {"seconds": round(time.perf_counter() - start, 3), "components": report["components"]}
+            except (urllib.error.URLError, ConnectionError, OSError):
+                # 预热期间就绪检查返回 503（HTTPError 是 URLError 的子类）
+                time.sleep(0.05)
+        raise TimeoutError("benchmark server did not start")
+
+    def stop(self) -> float:
+        rss = peak_rss_mb(self.process.pid)
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        return rss
+
+
+def run_uploads(server: Server, files: list) -> dict:
+    pages = chunks = 0
+    start = time.perf_counter()
+    for path in files:
+        job = post_file(f"{server.base_url}/upload", path)
+        while True:
+            status = request(f"{server.base_url}/jobs/{job['job_id']}")
+            if status["status"] in ("completed", "failed"):
+                break
+            time.sleep(0.05)
+        if status["status"] == "failed":
+            raise RuntimeError(f"ingestion of {path} failed: {status['error']}")
+        pages += status["page_count"]
+        chunks += status["chunk_count"]
+    elapsed = time.perf_counter() - start
+    return {"files": len(files), "pages": pages, "chunks": chunks, "seconds": round(elapsed, 3),
+            "pages_per_second": round(pages / elapsed, 2), "chunks_per_second": round(chunks / elapsed, 2)}
+
+
+def route_queries(pdf_docs: int, pages: int) -> dict:
+    """每个路由使用的查询；lexical 查询是只出现在某一页的标记词"""
+    lexical = [page_marker(i % pdf_docs, i % pages) for i in range(10)] if pdf_docs and pages else []
+    return {"document": SHORT_PAGES, "hybrid": HYBRID_QUERIES, "lexical": lexical, "llm": GENERAL_QUERIES}
+
+
+def run_queries(server: Server, count: int, queries: dict) -> dict:
+    """轮流发送各路由的查询，按实际使用的路由统计延迟"""
+    latencies = {}
+    routes = [route for route in ROUTES if queries[route]]
+    for i in range(count):
+        candidates = queries[routes[i % len(routes)]]
+        query = candidates[i // len(routes) % len(candidates)]
+        start = time.perf_counter()
+        route = post_query(f"{server.base_url}/query", query)
+        latencies.setdefault(route, []).append(time.perf_counter() - start)
+    return {route: percentiles(values) for route, values in latencies.items()}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SERVER_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-docs", type=int, default=2, help="合成 PDF 文档数")
+    parser.add_argument("--pages", type=int, default=50, help="每个 PDF 的页数")
+    parser.add_argument("--epub-docs", type=int, default=1, help="合成 EPUB 文档数")
+    parser.add_argument("--chapters", type=int, default=10, help="每个 EPUB 的章节数")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假聊天模型每次调用的延迟（秒）")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="假向量模型每次调用的延迟（秒）")
+    parser.add_argument("--answer-cache", action="store_true", help="测量时启用语义回答缓存")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = []
+        for i in range(args.pdf_docs):
+            path = os.path.join(workdir, f"bench-{i}.pdf")
+            write_pdf(path, args.pages, seed=i, short_pages=SHORT_PAGES)
+            files.append(path)
+        for i in range(args.epub_docs):
+            path = os.path.join(workdir, f"bench-{i}.epub")
+            write_epub(path, args.chapters, seed=i)
+            files.append(path)
+
+        server = Server(workdir, args)
+        cold_start = server.start()
+        try:
+            upload = run_uploads(server, files)
+            query = run_queries(server, args.queries, route_queries(args.pdf_docs, args.pages))
+        finally:
+            peak_rss = server.stop()
+
+        # 第二次启动时关键词库从磁盘加载
+        warm_start = server.start()
+        warm_rss = server.stop()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": vars(args),
+        "startup": {"cold": cold_start, "warm": warm_start},
+        "upload": upload,
+        "query": query,
+        "peak_rss_mb": {"ingest_and_query": peak_rss, "warm_start": warm_rss},
+    }
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    missing = [route for route in ROUTES if route not in query]
+    if missing:
+        sys.exit(f"no queries took route(s): {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,121 @@
+"""API 用量报表：汇总服务本地记录的 LLM 和向量调用，不访问 OpenAI
+
+服务的每次 LLM 和向量 API 调用都会记录 token 数、耗时、模型和估算费用（db/usage/usage.db），
+本脚本按天、接口、来源类型、文档等维度汇总。费用按 usage_store.DEFAULT_PRICES（可用 USAGE_PRICES 覆盖）估算。
+
+用法：
+    cd server && python check_usage.py                     # 最近 30 天，按天、接口、来源类型和文档汇总
+    cd server && python check_usage.py --days 7 --by doc_id model
+    cd server && python check_usage.py --json
+"""
+import argparse
+import json
 import os
-from datetime import datetime, timedelta
-import requests
+import sys
+import time
+import unicodedata
 from dotenv import load_dotenv
+from usage_store import DIMENSIONS, UsageStore, month_start
 
 # 加载环境变量
 load_dotenv()
 
-# 获取 API 密钥
-api_key = os.getenv("OPENAI_API_KEY")
-
-# 获取当前日期和上个月的日期
-end_date = datetime.now()
-start_date = end_date - timedelta(days=30)
+# 与服务使用相同的数据目录
+PERSIST_DIRECTORY = os.getenv("PERSIST_DIRECTORY", os.path.join(os.path.dirname(__file__), "db"))
+USAGE_DB_PATH = os.path.join(PERSIST_DIRECTORY, "usage", "usage.db")
+USAGE_MONTHLY_BUDGET_USD = float(os.getenv("USAGE_MONTHLY_BUDGET_USD", "0"))
 
-# API 端点
-usage_url = "https://api.openai.com/v1/dashboard/billing/usage"
-subscription_url = "https://api.openai.com/v1/dashboard/billing/subscription"
+DEFAULT_DIMENSIONS = ("day", "endpoint", "source_type", "doc_id")
 
-# 设置请求头
-headers = {
-    "Authorization": f"Bearer {api_key}",
-    "Content-Type": "application/json"
+TITLES = {
+    "day": "日期",
+    "endpoint": "接口",
+    "source_type": "来源类型",
+    "doc_id": "文档",
+    "model": "模型",
+    "kind": "类型",
+    "purpose": "用途",
 }
 
-try:
-    # 获取使用情况
-    params = {
-        "start_date": start_date.strftime("%Y-%m-%d"),
-        "end_date": end_date.strftime("%Y-%m-%d")
-    }
-    
-    usage_response = requests.get(usage_url, headers=headers, params=params)
-    usage_data = usage_response.json()
-    
-    # 获取订阅信息
-    subscription_response = requests.get(subscription_url, headers=headers)
-    subscription_data = subscription_response.json()
-    
-    print("\nOpenAI API 使用情况:")
+
+COLUMNS = (
+    ("calls", "调用次数", "{}"),
+    ("prompt_tokens", "输入 token", "{}"),
+    ("completion_tokens", "输出 token", "{}"),
+    ("cost", "费用 ($)", "{:.4f}"),
+    ("avg_latency_ms", "平均耗时 (ms)", "{:.0f}"),
+)
+
+
+def display_width(text: str) -> int:
+    """终端中的显示宽度，中文字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def pad(text: str, width: int, right: bool = False) -> str:
+    padding = " " * max(0, width - display_width(text))
+    return padding + text if right else text + padding
+
+
+def print_table(dimension: str, rows: list):
+    print(f"\n按{TITLES[dimension]}:")
+    if not rows:
+        print("  (无记录)")
+        return
+    header = [TITLES[dimension]] + [title for _, title, _ in COLUMNS]
+    lines = [
+        [str(row[dimension])] + [fmt.format(row[key]) if row[key] is not None else "-" for key, _, fmt in COLUMNS]
+        for row in rows
+    ]
+    widths = [max(display_width(line[i]) for line in [header] + lines) for i in range(len(header))]
+    for line in [header] + lines:
+        cells = [pad(line[0], widths[0])] + [pad(cell, width, right=True) for cell, width in zip(line[1:], widths[1:])]
+        print("  " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=30, help="统计最近多少天")
+    parser.add_argument("--by", nargs="+", choices=DIMENSIONS, default=list(DEFAULT_DIMENSIONS), help="汇总维度")
+    parser.add_argument("--db", default=USAGE_DB_PATH, help="用量数据库路径")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"没有用量记录：{args.db} 不存在，服务调用 API 后才会生成", file=sys.stderr)
+        sys.exit(1)
+
+    store = UsageStore(args.db, monthly_budget=USAGE_MONTHLY_BUDGET_USD)
+    try:
+        since = time.time() - args.days * 86400
+        reports = {dimension: store.report(dimension, since) for dimension in args.by}
+        month_spent = store.spent(month_start())
+    finally:
+        store.close()
+
+    if args.json:
+        print(json.dumps({
+            "days": args.days,
+            "month_spent": month_spent,
+            "monthly_budget": USAGE_MONTHLY_BUDGET_USD or None,
+            "reports": reports,
+        }, ensure_ascii=False, indent=2))
+        return
+
+    total = sum(row["cost"] for row in next(iter(reports.values()), []))
+    print("\nAPI 使用情况（本地记录，费用为估算值）:")
     print("-----------------------------------")
-    print(f"时间段: {start_date.date()} 到 {end_date.date()}")
-    
-    if "total_usage" in usage_data:
-        print(f"总使用金额: ${usage_data['total_usage'] / 100:.2f}")  # 转换为美元
-    
-    if "hard_limit_usd" in subscription_data:
-        print(f"账户额度上限: ${subscription_data['hard_limit_usd']:.2f}")
-    
-    # 显示每日使用情况
-    print("\n每日使用情况:")
-    if "daily_costs" in usage_data:
-        for day in usage_data["daily_costs"]:
-            date = datetime.fromtimestamp(day["timestamp"]).date()
-            cost = sum(item["cost"] for item in day["line_items"]) / 100
-            print(f"{date}: ${cost:.3f}")
-
-except Exception as e:
-    print(f"Error fetching usage data: {str(e)}")
-    print("提示：请确保您的 API 密钥有权限访问账单信息")
+    print(f"时间段: 最近 {args.days:g} 天")
+    if reports:
+        print(f"总费用: ${total:.4f}")
+    print(f"本月费用: ${month_spent:.4f}", end="")
+    if USAGE_MONTHLY_BUDGET_USD:
+        print(f" / 上限 ${USAGE_MONTHLY_BUDGET_USD:.2f}{'（已达到上限，暂停导入）' if month_spent >= USAGE_MONTHLY_BUDGET_USD else ''}")
+    else:
+        print()
+    for dimension, rows in reports.items():
+        print_table(dimension, rows)
+
+
+if __name__ == "__main__":
+    main()
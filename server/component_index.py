@@ -0,0 +1,236 @@
+import glob
+import json
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from pydantic import BaseModel
+from keyword_index import KeywordIndex
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('component_index')
+
+FORMAT_VERSION = 1
+META_FILENAME = "components.json"
+
+# LLM 返回的每一行：名称 + 冒号 + 描述，允许列表符号和中英文冒号
+LINE_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)、])?\s*([^:：]{1,80}?)\s*[:：]\s*(.+?)\s*$")
+
+
+class Component(BaseModel):
+    """文档中具名的组件（模块、类、服务、接口、配置项等）"""
+    name: str
+    description: str
+    doc_id: str
+    chunk_ids: List[str]  # 提到该组件的块
+
+
+def component_text(component: Component) -> str:
+    """计算组件向量时使用的文本"""
+    return f"{component.name}: {component.description}"
+
+
+def parse_components(
+    response: str, doc_id: str, chunks: List[Tuple[str, str]]
+) -> List[Component]:
+    """解析 LLM 返回的 "名称: 描述" 列表
+
+    每个组件引用 chunks [(块ID, 内容)] 中提到其名称的块；都没有直接提到时引用全部块。
+    """
+    components = []
+    for line in response.splitlines():
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+        name, description = match.group(1).strip("`*\"'“”"), match.group(2)
+        if not name:
+            continue
+        lowered = name.lower()
+        chunk_ids = [chunk_id for chunk_id, text in chunks if lowered in text.lower()]
+        components.append(Component(
+            name=name,
+            description=description,
+            doc_id=doc_id,
+            chunk_ids=chunk_ids or [chunk_id for chunk_id, _ in chunks],
+        ))
+    return components
+
+
+def merge_components(components: List[Component]) -> List[Component]:
+    """合并同一文档中同名（不区分大小写）的组件：块引用取并集，保留较长的描述"""
+    merged: Dict[Tuple[str, str], Component] = {}
+    for component in components:
+        key = (component.doc_id, component.name.lower())
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = component.model_copy()
+            continue
+        existing.chunk_ids = list(dict.fromkeys(existing.chunk_ids + component.chunk_ids))
+        if len(component.description) > len(existing.description):
+            existing.description = component.description
+    return list(merged.values())
+
+
+class ComponentIndex:
+    """组件名称与描述的向量索引
+
+    向量归一化后放在 KeywordIndex 中，一次矩阵乘法即可算出查询与所有组件的相似度。
+    """
+
+    def __init__(self, dtype: str = "float32"):
+        self.components: List[Component] = []
+        self._vectors = KeywordIndex(dtype=dtype)
+
+    def __len__(self) -> int:
+        return len(self.components)
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._vectors.embeddings
+
+    def documents(self) -> Set[str]:
+        return {component.doc_id for component in self.components}
+
+    def set(self, components: List[Component], embeddings):
+        self.components = list(components)
+        self._vectors.set([f"{c.doc_id}\0{c.name}" for c in components], embeddings)
+
+    def add(self, components: List[Component], embeddings):
+        if not components:
+            return
+        self.components = self.components + list(components)
+        self._vectors.add([f"{c.doc_id}\0{c.name}" for c in components], embeddings)
+
+    def copy_document(self, source: str, doc_id: str) -> int:
+        """把 source 文档的组件及其向量复制给内容相同的文档 doc_id，返回复制的数量"""
+        rows = [i for i, component in enumerate(self.components) if component.doc_id == source]
+        if rows:
+            self.add(
+                [self.components[i].model_copy(update={"doc_id": doc_id}) for i in rows],
+                np.asarray(self.embeddings[rows], dtype=np.float32),
+            )
+        return len(rows)
+
+    def remove_document(self, doc_id: str) -> int:
+        """移除某个文档的所有组件，返回移除的数量"""
+        keep = np.array([component.doc_id != doc_id for component in self.components], dtype=bool)
+        removed = int((~keep).sum())
+        if removed:
+            self.components = [c for c, kept in zip(self.components, keep) if kept]
+            self._vectors.remove(keep)
+        return removed
+
+    def search_batch(
+        self, query_embeddings, k: int = 5, threshold: float = 0.0
+    ) -> List[List[Tuple[Component, float]]]:
+        """批量匹配组件，返回每个查询相似度不低于 threshold 的前 k 个 (组件, 相似度)"""
+        scores, indices = self._vectors.search_batch(query_embeddings, k)
+        return [
+            [(self.components[i], float(s)) for s, i in zip(row_scores, row_indices) if s >= threshold]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def search(self, query_embedding, k: int = 5, threshold: float = 0.0) -> List[Tuple[Component, float]]:
+        return self.search_batch(query_embedding, k, threshold)[0]
+
+
+class ComponentStore:
+    """将组件列表和组件向量保存在磁盘上
+
+    与 KeywordStore 相同：每次保存版本号加一，向量写入带版本号的 .npy 文件并以内存映射加载，
+    元数据文件最后写入，其他进程据此判断是否需要重新加载。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, META_FILENAME)
+        os.makedirs(directory, exist_ok=True)
+        self._version_stat = None
+        self._version = 0
+
+    def _embeddings_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"component_embeddings.{version}.npy")
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def current_version(self) -> int:
+        """磁盘上组件索引的版本号，元数据文件未变化时不重新读取"""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._version_stat:
+            try:
+                self._version = (self._read_meta() or {}).get("version", 0)
+            except (OSError, ValueError):
+                return self._version
+            self._version_stat = key
+        return self._version
+
+    def save(self, components: List[Component], embeddings, model_name: str) -> int:
+        """原子地保存组件索引，返回新的版本号"""
+        previous = self.current_version()
+        version = previous + 1
+        embeddings_path = self._embeddings_path(version)
+        tmp_embeddings_path = embeddings_path + ".tmp"
+        with open(tmp_embeddings_path, "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+        os.replace(tmp_embeddings_path, embeddings_path)
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "version": version,
+            "embeddings_file": os.path.basename(embeddings_path),
+            "model_name": model_name,
+            "components": [component.model_dump() for component in components],
+        }
+        tmp_meta_path = self.meta_path + ".tmp"
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta_path, self.meta_path)
+
+        # 保留上一个版本，供刚读取了旧元数据的进程打开
+        keep = {self._embeddings_path(version), self._embeddings_path(previous)}
+        for path in glob.glob(os.path.join(self.directory, "component_embeddings.*.npy")):
+            if path not in keep:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove old component embeddings {path}: {str(e)}")
+        logger.info(f"Saved {len(components)} components to {self.directory} (version {version})")
+        return version
+
+    def load(self) -> Optional[Tuple[List[Component], Optional[np.ndarray], str, int]]:
+        """加载组件索引，返回 (组件, 向量, 计算向量的模型, 版本号)
+
+        向量文件缺失或与组件数量不一致时向量为 None，由调用方用当前模型重新计算；
+        组件由 LLM 提取，代价较高，这种情况下不丢弃。
+        """
+        try:
+            meta = self._read_meta()
+            if meta is None:
+                return None
+            if meta.get("format_version") != FORMAT_VERSION:
+                logger.info("Component index format changed, ignoring saved components")
+                return None
+
+            components = [Component(**item) for item in meta["components"]]
+            embeddings = None
+            embeddings_path = os.path.join(self.directory, meta.get("embeddings_file", ""))
+            if os.path.isfile(embeddings_path):
+                embeddings = np.load(embeddings_path, mmap_mode="r")
+                if embeddings.shape[0] != len(components):
+                    logger.warning("Component embeddings are inconsistent, recomputing")
+                    embeddings = None
+            return components, embeddings, meta.get("model_name"), meta.get("version", 0)
+
+        except Exception as e:
+            logger.error(f"Error loading component index: {str(e)}")
+            return None
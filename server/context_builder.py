@@ -0,0 +1,110 @@
+import re
+from typing import List, Optional, Set, Tuple
+from pydantic import BaseModel
+from lexical_index import tokenize
+from tokenizer import Tokenizer, get_tokenizer
+
+# 按句切分段落，保留句末标点和换行；英文句号后须有空白，避免切开小数和 a.b 形式的标识符
+SPAN_PATTERN = re.compile(r".*?(?:[。！？；!?;]+|\.(?:\s+|$)|\n|$)")
+
+# 判断近似重复时使用的词组长度
+SHINGLE_SIZE = 3
+
+
+class PackedContext(BaseModel):
+    """在 token 预算内拼接好的上下文"""
+    text: str
+    sources: List[int]  # 放入上下文的段落在输入中的下标，按放入顺序
+    tokens: int
+    duplicate_tokens: int = 0  # 去掉的重复内容的 token 数
+    dropped: int = 0  # 因预算不足没有放入的段落数
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    tokens = tokenize(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+class ContextBuilder:
+    """按检索排名在 token 预算内拼接上下文
+
+    相邻的块之间有重叠（分割时的 chunk_overlap），不同文档中也可能有重复的段落：
+    逐句计算词组集合，已放入上下文的内容覆盖了一句中 duplicate_threshold 以上的词组时去掉这一句。
+    段落按排名依次放入，放不下时截断到剩余预算（剩余不足 min_passage_tokens 时跳过，尝试后面更短的段落）。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1500,
+        duplicate_threshold: float = 0.8,
+        min_passage_tokens: int = 50,
+        tokenizer: Optional[Tokenizer] = None,
+        separator: str = "\n\n",
+    ):
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.separator = separator
+
+    def _deduplicate(self, passage: str, seen: Set[Tuple[str, ...]]) -> Tuple[str, Set[Tuple[str, ...]], int]:
+        """去掉与已放入内容重复的句子，返回 (剩余文本, 剩余文本的词组集合, 去掉的 token 数)"""
+        kept = []
+        shingles: Set[Tuple[str, ...]] = set()
+        removed = 0
+        for match in SPAN_PATTERN.finditer(passage):
+            span = match.group()
+            if not span.strip():
+                if span:
+                    kept.append(span)
+                continue
+            span_shingles = _shingles(span)
+            if span_shingles and len(span_shingles & seen) >= self.duplicate_threshold * len(span_shingles):
+                removed += self.tokenizer.count(span)
+                continue
+            kept.append(span)
+            shingles |= span_shingles
+        return "".join(kept).strip(), shingles, removed
+
+    def build(self, passages: List[str]) -> PackedContext:
+        """passages 按相关度从高到低排列"""
+        separator_tokens = self.tokenizer.count(self.separator)
+        seen: Set[Tuple[str, ...]] = set()
+        parts: List[str] = []
+        sources: List[int] = []
+        used = 0
+        duplicate_tokens = 0
+        dropped = 0
+
+        for index, passage in enumerate(passages):
+            text, shingles, removed = self._deduplicate(passage, seen)
+            duplicate_tokens += removed
+            if not text:
+                continue
+
+            remaining = self.max_tokens - used - (separator_tokens if parts else 0)
+            cost = self.tokenizer.count(text)
+            if cost > remaining:
+                if remaining < self.min_passage_tokens:
+                    dropped += 1
+                    continue
+                text = self.tokenizer.truncate(text, remaining)
+                cost = self.tokenizer.count(text)
+                shingles = _shingles(text)
+
+            if parts:
+                used += separator_tokens
+            parts.append(text)
+            sources.append(index)
+            used += cost
+            seen |= shingles
+
+        return PackedContext(
+            text=self.separator.join(parts),
+            sources=sources,
+            tokens=used,
+            duplicate_tokens=duplicate_tokens,
+            dropped=dropped,
+        )
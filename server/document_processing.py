@@ -0,0 +1,99 @@
+import os
+from typing import List, Optional, Tuple
+from langchain_core.documents import Document
+
+# 文档加载器和文本分割器只在解析进程中导入，避免拖慢服务进程的启动
+
+# 文本分割参数
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# PDF 按页范围分配给解析进程，每个任务解析的页数
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+
+# 解析进程中最近打开的 PDF：((路径, 修改时间), PdfReader, 各页的页码标签)
+_pdf_reader = None
+
+
+def get_document_loader(file_path: str):
+    """根据文件扩展名选择合适的文档加载器"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.pdf':
+        from langchain_community.document_loaders import PyPDFLoader
+        return PyPDFLoader(file_path)
+    elif ext == '.epub':
+        from langchain_community.document_loaders import UnstructuredEPubLoader
+        return UnstructuredEPubLoader(file_path)
+    else:
+        raise ValueError(f"不支持的文件格式: {ext}")
+
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """将文档分割成块"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len
+    )
+    return text_splitter.split_documents(documents)
+
+
+def load_documents(file_path: str) -> List[Document]:
+    """加载文档的所有页面，在解析进程池中运行"""
+    return get_document_loader(file_path).load()
+
+
+def count_pages(file_path: str) -> Optional[int]:
+    """PDF 的页数，用于按页范围并行解析；其他格式返回 None，整体解析"""
+    if os.path.splitext(file_path)[1].lower() != '.pdf':
+        return None
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def _open_pdf(file_path: str) -> Tuple[object, List[str]]:
+    """打开 PDF，返回 (PdfReader, 各页的页码标签)；同一解析进程中连续解析同一文件的不同页范围时复用
+
+    pypdf 第一次按下标访问页面时需要展开整个页面树，reader.page_labels 每次访问都会计算全部页面的标签，
+    每个页范围都重新计算时，这部分开销与页数成正比，大文件的总解析时间会随页数平方增长。
+    """
+    global _pdf_reader
+    from pypdf import PdfReader
+    key = (file_path, os.stat(file_path).st_mtime_ns)
+    if _pdf_reader is None or _pdf_reader[0] != key:
+        reader = PdfReader(file_path)
+        _pdf_reader = (key, reader, reader.page_labels)
+    return _pdf_reader[1], _pdf_reader[2]
+
+
+def load_pdf_pages(file_path: str, start: int, end: int) -> List[Document]:
+    """解析 PDF 中 [start, end) 范围的页面，在解析进程池中运行
+
+    与 PyPDFLoader 一样每页一个 Document，元数据包括 source、page、page_label 和 total_pages。
+    """
+    reader, page_labels = _open_pdf(file_path)
+    total_pages = len(reader.pages)
+    documents = []
+    for number in range(start, min(end, total_pages)):
+        documents.append(Document(
+            page_content=reader.pages[number].extract_text().strip(),
+            metadata={
+                "source": file_path,
+                "total_pages": total_pages,
+                "page": number,
+                "page_label": page_labels[number],
+            }
+        ))
+    return documents
+
+
+def load_and_split(file_path: str):
+    """加载并分割文档，返回 (页数, 块列表)
+
+    该函数在解析进程池中运行，参数和返回值都必须可以被 pickle。
+    """
+    documents = load_documents(file_path)
+    if not documents:
+        return 0, []
+    return len(documents), split_documents(documents)
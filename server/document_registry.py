@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('document_registry')
+
+
+class DocumentRegistry:
+    """记录每个文档包含哪些块
+
+    块ID是内容哈希，内容相同的块在向量数据库中只存一份，可能同时属于多个文档。
+    删除或替换文档时，只有不再属于任何文档的块才从向量数据库和词法索引中删除。
+    与 JobStore 相同，每个进程使用自己的数据库连接，任何进程都可以读取，只有导入进程写入。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                components_extracted INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                doc_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (doc_id, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS document_chunks_chunk ON document_chunks (chunk_id);
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "components_extracted" not in columns:
+            self._conn.execute(
+                "ALTER TABLE documents ADD COLUMN components_extracted INTEGER NOT NULL DEFAULT 0"
+            )
+        self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """当前进程的数据库连接；fork 出的进程不能复用父进程的连接"""
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._db
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM documents ORDER BY created_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def chunk_ids(self, doc_id: str) -> List[str]:
+        """文档的块ID，按在文档中的顺序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM document_chunks WHERE doc_id = ? ORDER BY position", (doc_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def diff(self, doc_id: str, chunk_ids: List[str]) -> Tuple[bool, List[str], Dict[str, List[str]]]:
+        """文档的块变为 chunk_ids（删除文档时为空）时需要清理的块，不修改记录
+
+        返回 (文档是否已存在, 旧版本中将不再属于任何文档的块, 旧版本中仍属于其他文档的块 {块ID: 其他文档ID})。
+        先按结果清理向量数据库和索引，再调用 register() / remove()，中途中断后重新执行得到相同的结果。
+        """
+        keep = set(chunk_ids)
+        with self._lock:
+            conn = self._conn
+            existed = conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+            dropped = [
+                row[0] for row in conn.execute(
+                    "SELECT chunk_id FROM document_chunks WHERE doc_id = ? ORDER BY position", (doc_id,)
+                ) if row[0] not in keep
+            ]
+            orphaned, shared = [], {}
+            for chunk_id in dropped:
+                owners = [
+                    row[0] for row in conn.execute(
+                        "SELECT doc_id FROM document_chunks WHERE chunk_id = ? AND doc_id != ? ORDER BY doc_id",
+                        (chunk_id, doc_id)
+                    )
+                ]
+                if owners:
+                    shared[chunk_id] = owners
+                else:
+                    orphaned.append(chunk_id)
+        return existed, orphaned, shared
+
+    def register(self, doc_id: str, filename: str, file_path: Optional[str], chunk_ids: List[str]):
+        """记录文档当前的块，替换之前的版本；块发生变化时清除已提取组件的记录"""
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            previous = {
+                row[0] for row in conn.execute("SELECT chunk_id FROM document_chunks WHERE doc_id = ?", (doc_id,))
+            }
+            if previous != set(chunk_ids):
+                conn.execute("UPDATE documents SET components_extracted = 0 WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM document_chunks WHERE doc_id = ?", (doc_id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO document_chunks (doc_id, chunk_id, position) VALUES (?, ?, ?)",
+                ((doc_id, chunk_id, i) for i, chunk_id in enumerate(chunk_ids)),
+            )
+            conn.execute(
+                "INSERT INTO documents (doc_id, filename, file_path, chunk_count, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(doc_id) DO UPDATE SET "
+                "filename = excluded.filename, file_path = excluded.file_path, "
+                "chunk_count = excluded.chunk_count, updated_at = excluded.updated_at",
+                (doc_id, filename, file_path, len(set(chunk_ids)), now, now),
+            )
+            conn.commit()
+
+    def identical_documents(self, doc_id: str) -> List[str]:
+        """与文档的块完全相同的其他文档，按文档ID排序"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT other.doc_id FROM document_chunks AS mine
+                JOIN document_chunks AS other ON other.chunk_id = mine.chunk_id AND other.doc_id != mine.doc_id
+                JOIN documents ON documents.doc_id = other.doc_id
+                WHERE mine.doc_id = ?
+                GROUP BY other.doc_id
+                HAVING COUNT(*) = MAX(documents.chunk_count)
+                   AND COUNT(*) = (SELECT COUNT(*) FROM document_chunks WHERE doc_id = ?)
+                ORDER BY other.doc_id
+            """, (doc_id, doc_id)).fetchall()
+        return [row[0] for row in rows]
+
+    def components_extracted(self, doc_id: str) -> bool:
+        """文档当前的块是否已经提取过组件，包括没有提取到任何组件的情况"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT components_extracted FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def mark_components_extracted(self, doc_id: str):
+        with self._lock:
+            self._conn.execute("UPDATE documents SET components_extracted = 1 WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM document_chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+
+    def backfill(self, chunks: Iterable[Tuple[str, str]], file_paths: Dict[str, Optional[str]]) -> int:
+        """从已有的块 [(块ID, 文档ID)] 生成文档记录，用于升级前已经导入的数据，返回文档数
+
+        旧数据中每个块只记录了最先导入它的文档，内容相同的块只归属于该文档。
+        """
+        by_doc: Dict[str, List[str]] = {}
+        for chunk_id, doc_id in chunks:
+            by_doc.setdefault(doc_id, []).append(chunk_id)
+        for doc_id, chunk_ids in by_doc.items():
+            self.register(doc_id, doc_id, file_paths.get(doc_id), chunk_ids)
+        logger.info(f"Registered {len(by_doc)} existing documents")
+        return len(by_doc)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
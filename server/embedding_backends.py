@@ -0,0 +1,120 @@
+import threading
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('embedding_backends')
+
+BACKENDS = ("openai", "local")
+
+# 向量数据库集合元数据中记录构建向量所用模型的键
+BACKEND_KEY = "embedding_backend"
+MODEL_KEY = "embedding_model"
+DIMENSION_KEY = "embedding_dimension"
+
+# 在记录模型之前创建的向量库都是用 OpenAIEmbeddings 的默认模型构建的
+LEGACY_BACKEND = "openai"
+LEGACY_MODEL = "text-embedding-ada-002"
+
+# 进程内共享的句向量模型；gunicorn 预加载时在主进程中加载，fork 出的工作进程共享只读的模型权重
+_encoder_models: Dict[str, object] = {}
+_encoder_models_lock = threading.Lock()
+
+
+class EmbeddingModelMismatch(RuntimeError):
+    """向量库由其他向量模型构建，需要先用 reindex.py 重新生成向量"""
+
+
+def load_encoder_model(name: str):
+    """加载句向量模型（模型名称或本地目录），同一进程内相同名称的模型只加载一次"""
+    with _encoder_models_lock:
+        model = _encoder_models.get(name)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = _encoder_models[name] = SentenceTransformer(name)
+            logger.info(f"Loaded encoder model {name}")
+        return model
+
+
+def register_encoder_model(name: str, model):
+    """把已创建的模型登记为 name，之后 load_encoder_model(name) 直接返回它；用于基准测试中的本地替身"""
+    with _encoder_models_lock:
+        _encoder_models[name] = model
+
+
+class LocalEmbeddings(Embeddings):
+    """使用本地 sentence-transformers 模型计算向量，不调用向量 API
+
+    与查询路由共用同一个模型实例，模型相同时查询向量只需计算一次。
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        self.model = model_name
+        self.batch_size = batch_size
+
+    @property
+    def encoder(self):
+        return load_encoder_model(self.model)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.encoder.encode(list(texts), batch_size=self.batch_size).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encoder.encode([text])[0].tolist()
+
+
+def create_embeddings(backend: str, model: Optional[str] = None, batch_size: int = 64) -> Embeddings:
+    """按配置创建向量模型：openai 使用 OpenAIEmbeddings，local 使用本地 sentence-transformers 模型"""
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model or LEGACY_MODEL)
+    if backend == "local":
+        if not model:
+            raise ValueError("Local embedding backend requires a model name or path")
+        return LocalEmbeddings(model, batch_size=batch_size)
+    raise ValueError(f"Unknown embedding backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+def store_model(collection) -> Optional[dict]:
+    """读取集合记录的向量模型 {backend, model, dimension}；旧版本创建的非空集合按默认 OpenAI 模型处理"""
+    metadata = collection.metadata or {}
+    if MODEL_KEY in metadata:
+        return {
+            "backend": metadata.get(BACKEND_KEY),
+            "model": metadata[MODEL_KEY],
+            "dimension": metadata.get(DIMENSION_KEY),
+        }
+    if collection.count() > 0:
+        return {"backend": LEGACY_BACKEND, "model": LEGACY_MODEL, "dimension": None}
+    return None
+
+
+def model_metadata(backend: str, model: str, dimension: Optional[int] = None) -> dict:
+    metadata = {BACKEND_KEY: backend, MODEL_KEY: model}
+    if dimension:
+        metadata[DIMENSION_KEY] = dimension
+    return metadata
+
+
+def ensure_store_model(collection, backend: str, model: str):
+    """检查向量库与配置的向量模型是否一致
+
+    尚未记录模型的空集合记录为当前配置的模型，旧版本创建的非空集合记录为默认的 OpenAI 模型；
+    模型不一致时抛出 EmbeddingModelMismatch，
+    否则查询向量和文档向量不在同一个空间中，检索结果没有意义。
+    """
+    metadata = collection.metadata or {}
+    if MODEL_KEY not in metadata:
+        recorded = store_model(collection) or {"backend": backend, "model": model}
+        collection.modify(metadata={**metadata, **model_metadata(recorded["backend"], recorded["model"])})
+        logger.info(f"Recorded embedding model {recorded['backend']}:{recorded['model']} for collection {collection.name}")
+
+    recorded = store_model(collection)
+    if (recorded["backend"], recorded["model"]) != (backend, model):
+        raise EmbeddingModelMismatch(
+            f"Vector store was built with {recorded['backend']}:{recorded['model']}, "
+            f"but {backend}:{model} is configured; run `python reindex.py` to re-embed the documents"
+        )
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from logger_config import SAMPLED, setup_logger
+from tokenizer import get_tokenizer
+from usage_store import record_usage
+
+# 设置日志记录器
+logger = setup_logger('embedding_cache')
+
+
+def content_hash(text: str) -> str:
+    """文本内容的 SHA-256，用作块ID和缓存键"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """为文档向量增加持久化缓存的 Embeddings 包装器
+
+    缓存以 (模型, 内容哈希) 为键保存在 SQLite 中，相同文本只会调用一次向量 API。
+    查询向量不做缓存，直接交给底层模型。实际调用底层模型时记录 token 数和耗时。
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path: str, model_name: str = None):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", type(embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+        """)
+        self._conn.commit()
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    (self.model_name, *batch),
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [content_hash(text) for text in texts]
+        cached = self._lookup(hashes)
+
+        # 只为缓存中没有的文本调用底层模型，同一批中的重复文本只计算一次
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = text
+        if missing:
+            start = time.perf_counter()
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._record("documents", missing.values(), time.perf_counter() - start)
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        logger.info(
+            "Embedded %d texts, %d computed, %d from cache",
+            len(texts), len(missing), len(texts) - len(missing), extra=SAMPLED
+        )
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        self._record("query", [text], time.perf_counter() - start)
+        return vector
+
+    def _record(self, purpose: str, texts, latency: float):
+        tokenizer = get_tokenizer()
+        record_usage("embedding", purpose, self.model_name, sum(tokenizer.count(t) for t in texts), latency=latency)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, Optional, TypeVar
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('executors')
+
+T = TypeVar("T")
+
+# 解析/分割文档的进程数，以及向量计算和 Chroma 调用的线程数
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """CPU 密集的文档解析与分割使用的进程池"""
+    global _process_pool
+    if _process_pool is None:
+        # 使用 spawn 启动子进程，避免 fork 已加载 torch 等多线程库的主进程
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Started parse process pool with {PARSE_WORKERS} workers")
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """向量计算与 Chroma 读写使用的线程池"""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+        logger.info(f"Started IO thread pool with {IO_WORKERS} workers")
+    return _thread_pool
+
+
+async def run_in_process(func: Callable[..., T], *args, **kwargs) -> T:
+    """在进程池中运行函数，func 必须是模块级函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def map_in_process(
+    func: Callable[..., T], args_iter: Iterable[tuple], max_pending: Optional[int] = None
+) -> AsyncIterator[T]:
+    """在进程池中并行执行 func(*args)，按提交顺序逐个产生结果
+
+    同时最多有 max_pending 个任务在执行或等待（默认为进程数的两倍），
+    调用方处理完前面的结果后才提交后面的任务，内存中的结果数量有上限。
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    limit = max_pending or PARSE_WORKERS * 2
+    pending = deque()
+    try:
+        for args in args_iter:
+            pending.append(loop.run_in_executor(pool, functools.partial(func, *args)))
+            if len(pending) >= limit:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def run_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """在线程池中运行阻塞函数，不占用事件循环；与 asyncio.to_thread 一样带上当前的上下文变量"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """关闭进程池和线程池"""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    logger.info("Executors shut down")
@@ -0,0 +1,25 @@
+"""多进程部署配置：gunicorn -c gunicorn.conf.py app:app
+
+主进程预先导入应用并加载句向量模型，fork 出的工作进程共享只读的模型权重（写时复制）。
+每个工作进程各自创建 OpenAI 客户端、Chroma 连接和查询引擎；
+其中一个进程通过文件锁成为导入进程，其他进程只处理查询，并从磁盘同步关键词库。
+多进程部署时建议通过 CHROMA_HOST 使用独立的 Chroma 服务。
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    """在 fork 工作进程之前执行：加载共享模型，并冻结已有对象，减少引用计数变化引起的内存复制"""
+    import app
+    app.preload_shared_models()
+    gc.freeze()
+    server.log.info("Shared models loaded, forking workers")
@@ -0,0 +1,594 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+import numpy as np
+from langchain_core.documents import Document
+from document_processing import PAGES_PER_TASK, count_pages, load_documents, load_pdf_pages, split_documents
+from document_registry import DocumentRegistry
+from embedding_cache import content_hash
+from executors import map_in_process, run_in_process, run_in_thread
+from logger_config import setup_logger
+from metrics import INGEST_JOBS_TOTAL, INGEST_STAGE_SECONDS, timed
+from usage_store import get_usage_store, usage_context
+from vector_partitions import VectorPartitions, source_type_of
+
+# 设置日志记录器
+logger = setup_logger('ingest_jobs')
+
+# 导入流程的各个阶段，按顺序执行
+STAGES = ["parse", "split", "embed", "index", "register", "keywords", "components"]
+
+# 删除文档的任务只有一个阶段
+DELETE_STAGES = ["remove"]
+
+# 任务类型 -> 阶段
+JOB_STAGES = {"ingest": STAGES, "delete": DELETE_STAGES}
+
+# 每批计算向量和写入索引的块数
+EMBED_BATCH_SIZE = 256
+
+# 每个分割任务处理的页数
+SPLIT_BATCH_PAGES = 64
+
+
+class IngestionError(Exception):
+    """导入任务中不可重试的错误，例如文件中没有可提取的内容"""
+
+
+def documents_to_json(documents: List[Document]) -> list:
+    return [{"page_content": d.page_content, "metadata": d.metadata} for d in documents]
+
+
+def documents_from_json(data: list) -> List[Document]:
+    return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in data]
+
+
+def clean_metadata(metadata: dict) -> dict:
+    """Chroma 只接受基础类型的元数据值"""
+    return {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))}
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """按 size 个一组依次产生，不预先读取全部元素"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ArtifactWriter:
+    """逐条写入任务中间结果：写入临时文件，正常结束后才替换正式文件，出错时丢弃"""
+
+    def __init__(self, path: str, binary: bool = False):
+        self.path = path
+        self.count = 0
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, "wb" if binary else "w", encoding=None if binary else "utf-8")
+
+    def write(self, item: dict):
+        """写入一行 JSON"""
+        self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def write_array(self, array: np.ndarray):
+        """追加 float32 向量（二进制，按行连续存放）"""
+        self._file.write(np.ascontiguousarray(array, dtype=np.float32).tobytes())
+        self.count += len(array)
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+
+class JobStore:
+    """基于 SQLite 的持久化任务队列，每个任务的中间结果保存在独立目录中"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'ingest',
+                status TEXT NOT NULL,
+                stage TEXT,
+                completed_stage TEXT,
+                page_count INTEGER DEFAULT 0,
+                chunk_count INTEGER DEFAULT 0,
+                embedded_chunks INTEGER DEFAULT 0,
+                indexed_chunks INTEGER DEFAULT 0,
+                keyword_chunks_done INTEGER DEFAULT 0,
+                keyword_chunks_total INTEGER DEFAULT 0,
+                skipped_chunks INTEGER DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # 旧版本的任务表没有任务类型，都是导入任务
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "kind" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'ingest'")
+        self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """当前进程的数据库连接；gunicorn 预加载应用后 fork 出的进程不能复用父进程的连接"""
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(os.path.join(self.directory, "jobs.db"), check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            # 多个进程同时读写任务表时，WAL 模式下读不会被写阻塞
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._db
+
+    def job_dir(self, job_id: str) -> str:
+        path = os.path.join(self.directory, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def create(self, filename: str, file_path: str, doc_id: str, kind: str = "ingest") -> dict:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, file_path, doc_id, kind, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, filename, file_path, doc_id, kind, now, now),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pending(self) -> List[dict]:
+        """未完成的任务（包括重启前正在执行的任务），按创建时间排序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_by_document(self) -> Dict[str, dict]:
+        """每个文档最近的一个任务"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE rowid IN (SELECT MAX(rowid) FROM jobs GROUP BY doc_id)"
+            ).fetchall()
+        return {row["doc_id"]: dict(row) for row in rows}
+
+    def rewind_embeddings(self, stages: Iterable[str] = ("embed",)) -> int:
+        """未完成的任务中已经完成 stages 之一的，退回到重新计算向量
+
+        切换向量模型后退回已经计算好向量、尚未写入索引的任务；重新分区后还要退回已经写入旧分区、尚未登记的任务。
+        """
+        stages = list(stages)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET completed_stage = 'split', embedded_chunks = 0 "
+                f"WHERE status IN ('queued', 'running') AND completed_stage IN ({', '.join('?' * len(stages))})",
+                stages
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def last_completed_at(self) -> Optional[float]:
+        """最近一个完成的任务的完成时间，其他进程据此判断文档集合是否变化"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(updated_at) FROM jobs WHERE status = 'completed'").fetchone()
+        return row[0]
+
+    def save_artifact(self, job_id: str, name: str, data):
+        path = os.path.join(self.job_dir(job_id), name)
+        tmp_path = path + ".tmp"
+        if name.endswith(".npy"):
+            with open(tmp_path, "wb") as f:
+                np.save(f, data)
+        else:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def artifact_path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.job_dir(job_id), name)
+
+    def writer(self, job_id: str, name: str, binary: bool = False) -> ArtifactWriter:
+        return ArtifactWriter(self.artifact_path(job_id, name), binary)
+
+    def iter_jsonl(self, job_id: str, name: str) -> Iterator[dict]:
+        """逐行读取 JSON Lines 中间结果"""
+        with open(self.artifact_path(job_id, name), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def load_artifact(self, job_id: str, name: str):
+        path = os.path.join(self.job_dir(job_id), name)
+        if name.endswith(".npy"):
+            return np.load(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IngestionWorker:
+    """后台导入任务执行器：按阶段处理队列中的任务，每个阶段完成后记录进度，重启后从断点继续
+
+    多进程部署时只有一个进程运行执行器，其他进程提交的任务只写入任务表，由 enqueue_pending() 加入队列。
+    """
+
+    def __init__(
+        self, store: JobStore, partitions: VectorPartitions, embeddings, query_engine, registry: DocumentRegistry
+    ):
+        self.store = store
+        self.partitions = partitions
+        self.embeddings = embeddings
+        self.query_engine = query_engine
+        self.registry = registry
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[str] = set()  # 已在队列中或正在执行的任务
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台任务，并重新排队重启前未完成的任务"""
+        self.enqueue_pending()
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue_pending(self):
+        """将任务表中尚未排队的任务加入队列，包括重启前未完成的任务和其他进程提交的任务"""
+        for job in self.store.pending():
+            if job["id"] in self._queued:
+                continue
+            if job["completed_stage"]:
+                logger.info(f"Resuming job {job['id']} ({job['filename']}) after stage {job['completed_stage']}")
+            self._queued.add(job["id"])
+            self.queue.put_nowait(job["id"])
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, filename: str, file_path: str, doc_id: str, kind: str = "ingest") -> dict:
+        job = self.store.create(filename, file_path, doc_id, kind)
+        self._queued.add(job["id"])
+        self.queue.put_nowait(job["id"])
+        logger.info(f"Queued {kind} job {job['id']} for {filename}")
+        return job
+
+    async def _run(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.process(job_id)
+            except Exception as e:
+                logger.error(f"Unexpected error in job {job_id}: {str(e)}")
+            finally:
+                self._queued.discard(job_id)
+                self.queue.task_done()
+
+    async def process(self, job_id: str):
+        job = self.store.get(job_id)
+        if not job or job["status"] not in ("queued", "running"):
+            return
+
+        self.store.update(job_id, status="running", error=None)
+        completed = job["completed_stage"]
+        if completed and not os.path.exists(self.store.artifact_path(job_id, "pages.jsonl")):
+            # 旧版本一次性保存全部页面的任务，中间结果格式不同，从头开始
+            logger.info(f"Job {job_id}: intermediate results from an older version, restarting")
+            completed = None
+        stages = JOB_STAGES[job["kind"]]
+        start_index = stages.index(completed) + 1 if completed else 0
+
+        try:
+            # 导入过程中的向量和 LLM 调用都记在这个文档名下；回答缓存只淘汰受这个文档影响的回答
+            with usage_context(endpoint="ingest", doc_id=job["doc_id"]), \
+                    self.query_engine.document_change(job["doc_id"]):
+                for stage in stages[start_index:]:
+                    if stage == "embed":
+                        await self._check_budget()
+                    self.store.update(job_id, stage=stage)
+                    logger.info(f"Job {job_id}: running stage {stage}")
+                    with timed(INGEST_STAGE_SECONDS, stage):
+                        await getattr(self, f"_stage_{stage}")(job)
+                    self.store.update(job_id, completed_stage=stage)
+            self.store.update(job_id, status="completed", stage=None)
+            INGEST_JOBS_TOTAL.inc(status="completed")
+            logger.info(f"Job {job_id} completed")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed at stage {self.store.get(job_id)['stage']}: {str(e)}")
+            self.store.update(job_id, status="failed", error=str(e))
+            INGEST_JOBS_TOTAL.inc(status="failed")
+
+    async def _check_budget(self):
+        """开始调用向量 API 之前检查本月用量，达到上限时任务失败（提交后才达到上限的任务也不再继续）"""
+        usage_store = get_usage_store()
+        if usage_store:
+            await run_in_thread(usage_store.check_budget)
+
+    async def _stage_parse(self, job: dict):
+        """解析页面并逐页写入 pages.jsonl：PDF 按页范围分配到解析进程池并行解析，其他格式整体解析"""
+        file_path = job["file_path"]
+        page_count = await run_in_process(count_pages, file_path)
+        if page_count is None:
+            func, tasks = load_documents, [(file_path,)]
+        else:
+            func = load_pdf_pages
+            tasks = ((file_path, start, start + PAGES_PER_TASK) for start in range(0, page_count, PAGES_PER_TASK))
+
+        with self.store.writer(job["id"], "pages.jsonl") as writer:
+            async for documents in map_in_process(func, tasks):
+                for item in documents_to_json(documents):
+                    writer.write(item)
+                self.store.update(job["id"], page_count=writer.count)
+        if not writer.count:
+            raise IngestionError("无法从文件中提取内容")
+
+    async def _stage_split(self, job: dict):
+        """按批分割页面并逐块写入 chunks.jsonl，内存中只保留正在分割的几批页面"""
+        def page_batches():
+            for batch in batched(self.store.iter_jsonl(job["id"], "pages.jsonl"), SPLIT_BATCH_PAGES):
+                yield (documents_from_json(batch),)
+
+        # 块ID取内容哈希，同一文档内重复的块只保留一个；块记录所属文档、来源类型和页码（PDF），用于过滤检索
+        source_type = source_type_of(job["doc_id"])
+        seen = set()
+        with self.store.writer(job["id"], "chunks.jsonl") as writer:
+            async for chunks in map_in_process(split_documents, page_batches()):
+                for chunk in chunks:
+                    chunk_id = content_hash(chunk.page_content)
+                    if chunk_id in seen:
+                        continue
+                    seen.add(chunk_id)
+                    chunk.metadata["doc_id"] = job["doc_id"]
+                    chunk.metadata["source_type"] = source_type
+                    writer.write({"id": chunk_id, "page_content": chunk.page_content, "metadata": chunk.metadata})
+        if not seen:
+            raise IngestionError("文档分割后没有内容")
+        self.store.update(job["id"], chunk_count=len(seen))
+
+    async def _stage_embed(self, job: dict):
+        """按批计算新块的向量，新块写入 new_chunks.jsonl，向量按相同顺序追加到 embeddings.f32
+
+        只跳过文档所在分区中已有的块；其他分区中已有的块由向量缓存提供向量，不再调用 API。
+        """
+        collection = self.partitions.collection(self.partitions.partition_of(job["doc_id"]))
+        new_count = skipped = 0
+        dimension = None
+        with self.store.writer(job["id"], "new_chunks.jsonl") as chunk_writer, \
+                self.store.writer(job["id"], "embeddings.f32", binary=True) as vector_writer:
+            for batch in batched(self.store.iter_jsonl(job["id"], "chunks.jsonl"), EMBED_BATCH_SIZE):
+                # 已经在索引中的块直接跳过，其余的块通过带缓存的向量模型计算
+                existing = await run_in_thread(collection.get, ids=[c["id"] for c in batch], include=[])
+                existing_ids = set(existing["ids"])
+                new_chunks = [c for c in batch if c["id"] not in existing_ids]
+                skipped += len(batch) - len(new_chunks)
+                if new_chunks:
+                    vectors = np.asarray(
+                        await run_in_thread(self.embeddings.embed_documents, [c["page_content"] for c in new_chunks]),
+                        dtype=np.float32
+                    )
+                    dimension = vectors.shape[1]
+                    vector_writer.write_array(vectors)
+                    for chunk in new_chunks:
+                        chunk_writer.write(chunk)
+                    new_count += len(new_chunks)
+                self.store.update(job["id"], embedded_chunks=new_count, skipped_chunks=skipped)
+        self.store.save_artifact(job["id"], "embeddings.json", {"count": new_count, "dimension": dimension})
+        logger.info(f"Job {job['id']}: {new_count} new chunks, {skipped} already indexed")
+
+    async def _stage_index(self, job: dict):
+        """按批将新块及其向量写入文档所在的分区和词法索引，向量通过内存映射按需读取"""
+        meta = self.store.load_artifact(job["id"], "embeddings.json")
+        if not meta["count"]:
+            return
+        collection = self.partitions.collection(self.partitions.partition_of(job["doc_id"]))
+        vectors = np.memmap(
+            self.store.artifact_path(job["id"], "embeddings.f32"),
+            dtype=np.float32, mode="r", shape=(meta["count"], meta["dimension"])
+        )
+        indexed = 0
+        for batch in batched(self.store.iter_jsonl(job["id"], "new_chunks.jsonl"), EMBED_BATCH_SIZE):
+            ids = [c["id"] for c in batch]
+            texts = [c["page_content"] for c in batch]
+            # 块ID由内容决定，中断后重新写入是幂等的
+            await run_in_thread(
+                collection.upsert,
+                ids=ids,
+                embeddings=vectors[indexed:indexed + len(batch)].tolist(),
+                documents=texts,
+                metadatas=[clean_metadata(c["metadata"]) for c in batch],
+            )
+            # 同时写入本地词法索引
+            await self.query_engine.index_chunks(ids, texts)
+            indexed += len(batch)
+            self.store.update(job["id"], indexed_chunks=indexed)
+            self.query_engine.notify_index_changed()
+        del vectors
+
+    async def _stage_register(self, job: dict):
+        """记录文档当前的块，并删除旧版本中不再属于任何文档的块
+
+        新块已经在上一阶段写入索引，替换文档时查询在整个过程中都能检索到内容。
+        需要删除的块在第一次执行时记录下来，中断后重新执行时删除同样的块。
+        """
+        chunk_ids = [c["id"] for c in self.store.iter_jsonl(job["id"], "chunks.jsonl")]
+        if os.path.exists(self.store.artifact_path(job["id"], "register.json")):
+            plan = self.store.load_artifact(job["id"], "register.json")
+        else:
+            existed, orphaned, shared = await run_in_thread(self.registry.diff, job["doc_id"], chunk_ids)
+            plan = {"existed": existed, "orphaned": orphaned, "shared": shared}
+            self.store.save_artifact(job["id"], "register.json", plan)
+        await self._release_chunks(job["doc_id"], plan["orphaned"], plan["shared"])
+        await run_in_thread(self.registry.register, job["doc_id"], job["filename"], job["file_path"], chunk_ids)
+        if plan["orphaned"] or plan["shared"]:
+            logger.info(
+                f"Job {job['id']}: {len(plan['orphaned'])} chunks removed from the index, "
+                f"{len(plan['shared'])} still used by other documents"
+            )
+
+    async def _release_chunks(self, doc_id: str, orphaned: List[str], shared: Dict[str, List[str]]):
+        """从文档所在的分区中删除该分区不再使用的块，不再属于任何文档的块同时移出词法索引
+
+        仍属于同一分区其他文档的块保留，改为记在其中一个文档名下；
+        只属于其他分区文档的块从本分区删除，其他分区中的那一份不受影响。
+        """
+        partition = self.partitions.partition_of(doc_id)
+        collection = self.partitions.collection(partition)
+        local_owners: Dict[str, str] = {}
+        released = []
+        for chunk_id, owners in shared.items():
+            # 升级前的计划中每个块只记录了一个文档
+            owners = owners if isinstance(owners, list) else [owners]
+            local = [owner for owner in owners if self.partitions.partition_of(owner) == partition]
+            if local:
+                local_owners[chunk_id] = local[0]
+            else:
+                released.append(chunk_id)
+
+        for batch in batched(orphaned, EMBED_BATCH_SIZE):
+            await run_in_thread(collection.delete, ids=batch)
+            await self.query_engine.remove_chunks(batch)
+        for batch in batched(released, EMBED_BATCH_SIZE):
+            await run_in_thread(collection.delete, ids=batch)
+        if local_owners:
+            existing = await run_in_thread(collection.get, ids=list(local_owners), include=["metadatas"])
+            updates = [
+                (chunk_id, {
+                    **metadata, "doc_id": local_owners[chunk_id], "source_type": source_type_of(local_owners[chunk_id])
+                })
+                for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+                if (metadata or {}).get("doc_id") == doc_id
+            ]
+            if updates:
+                await run_in_thread(
+                    collection.update,
+                    ids=[chunk_id for chunk_id, _ in updates],
+                    metadatas=[metadata for _, metadata in updates],
+                )
+
+    def _content_changed(self, job: dict) -> bool:
+        """本次导入是否新增或删除了块，或者是新文档"""
+        if self.store.load_artifact(job["id"], "embeddings.json")["count"]:
+            return True
+        try:
+            plan = self.store.load_artifact(job["id"], "register.json")
+        except FileNotFoundError:
+            # 升级前已经完成 register 阶段之前各阶段的任务
+            return False
+        return not plan["existed"] or bool(plan["orphaned"] or plan["shared"])
+
+    async def _identical_document(self, job: dict) -> Optional[str]:
+        """没有新块、并且与某个已有文档的块完全相同时（如以新文件名上传同一个文件）返回该文档"""
+        if self.store.load_artifact(job["id"], "embeddings.json")["count"]:
+            return None
+        identical = await run_in_thread(self.registry.identical_documents, job["doc_id"])
+        return identical[0] if identical else None
+
+    async def _components_extracted(self, doc_id: str) -> bool:
+        # 没有提取到组件的文档也有记录；升级前提取过组件的文档没有记录，按索引中是否有组件判断
+        return await run_in_thread(self.registry.components_extracted, doc_id) \
+            or self.query_engine.has_components(doc_id)
+
+    async def _stage_keywords(self, job: dict):
+        # 文档内容没有变化时，关键词库保持不变，不再调用 LLM
+        if not self._content_changed(job):
+            logger.info(f"Job {job['id']}: document unchanged, keeping existing keywords")
+            return
+        # 与已有文档内容相同时沿用它的关键词
+        source = await self._identical_document(job)
+        if source and await self.query_engine.copy_document_keywords(source, job["doc_id"]):
+            self.query_engine.schedule_keywords_save()
+            return
+        texts = [c["page_content"] for c in self.store.iter_jsonl(job["id"], "chunks.jsonl")]
+
+        def progress(done: int, total: int):
+            self.store.update(job["id"], keyword_chunks_done=done, keyword_chunks_total=total)
+
+        # 重新上传时替换该文档旧的关键词，连续上传时关键词库只保存一次
+        await self.query_engine.replace_document_keywords(
+            job["doc_id"], texts, progress
+        )
+        self.query_engine.schedule_keywords_save()
+
+    async def _stage_components(self, job: dict):
+        """提取文档中的组件写入组件索引；文档内容没有变化且已经提取过时跳过，与已有文档内容相同时沿用它的组件"""
+        engine = self.query_engine
+        if not engine.component_extraction:
+            return
+        doc_id = job["doc_id"]
+        if not self._content_changed(job) and await self._components_extracted(doc_id):
+            logger.info(f"Job {job['id']}: document unchanged, keeping existing components")
+            return
+        source = await self._identical_document(job)
+        if source and await self._components_extracted(source):
+            await engine.copy_document_components(source, doc_id)
+            await run_in_thread(self.registry.mark_components_extracted, doc_id)
+            return
+        chunks = [(c["id"], c["page_content"]) for c in self.store.iter_jsonl(job["id"], "chunks.jsonl")]
+        await engine.replace_document_components(doc_id, chunks)
+        await run_in_thread(self.registry.mark_components_extracted, doc_id)
+
+    async def _stage_remove(self, job: dict):
+        """删除文档：删除只属于该文档的块，移除它的关键词、组件和上传的文件"""
+        doc_id = job["doc_id"]
+        if os.path.exists(self.store.artifact_path(job["id"], "remove.json")):
+            plan = self.store.load_artifact(job["id"], "remove.json")
+        else:
+            existed, orphaned, shared = await run_in_thread(self.registry.diff, doc_id, [])
+            if not existed:
+                raise IngestionError("文档不存在")
+            plan = {"orphaned": orphaned, "shared": shared}
+            self.store.save_artifact(job["id"], "remove.json", plan)
+        self.store.update(job["id"], chunk_count=len(plan["orphaned"]) + len(plan["shared"]))
+
+        await self._release_chunks(doc_id, plan["orphaned"], plan["shared"])
+        await self.query_engine.remove_document(doc_id)
+        await run_in_thread(self.registry.remove, doc_id)
+
+        # 删除之后又上传了同名文档时，文件属于新的导入任务
+        reuploaded = any(
+            other["doc_id"] == doc_id and other["kind"] == "ingest" and other["created_at"] > job["created_at"]
+            for other in self.store.pending()
+        )
+        if not reuploaded and os.path.isfile(job["file_path"]):
+            os.remove(job["file_path"])
+        logger.info(f"Job {job['id']}: removed document {doc_id} ({len(plan['orphaned'])} chunks deleted)")
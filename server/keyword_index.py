@@ -0,0 +1,190 @@
+from typing import List, Optional, Tuple
+import numpy as np
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('keyword_index')
+
+try:
+    import hnswlib
+except ImportError:  # 未安装时只使用精确检索
+    hnswlib = None
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# int8 量化时的缩放系数，归一化后的分量都在 [-1, 1] 之间
+INT8_SCALE = 127.0
+
+# 非 float32 存储时按块转换为 float32 再做矩阵乘法，控制临时内存
+SEARCH_BLOCK_ROWS = 16384
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """按行做 L2 归一化；已经归一化的 float32 矩阵原样返回，避免复制内存映射的数据"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    if np.allclose(norms, 1.0, atol=1e-3):
+        return matrix
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class KeywordIndex:
+    """关键词向量索引
+
+    向量经过 L2 归一化后存放在连续数组中，点积即余弦相似度。
+    可选 float16 / int8 量化以减少内存，检索时按块转换回 float32，速度慢于 float32 存储。
+    关键词数量超过 ann_threshold 且安装了 hnswlib 时，使用 HNSW 近似最近邻检索。
+    """
+
+    def __init__(self, dtype: str = "float32", ann_threshold: int = 20000, ann_ef: int = 128):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量类型: {dtype}")
+        self.dtype = dtype
+        self.ann_threshold = ann_threshold
+        self.ann_ef = ann_ef
+        self.keywords: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._ann = None
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._vectors is None else self._vectors.shape[1]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """反量化后的 float32 归一化向量，用于持久化"""
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self.dtype == "int8":
+            return self._vectors.astype(np.float32) / INT8_SCALE
+        return self._vectors.astype(np.float32, copy=False)
+
+    def _quantize(self, matrix: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            return matrix.astype(np.float16)
+        if self.dtype == "int8":
+            return np.clip(np.round(matrix * INT8_SCALE), -127, 127).astype(np.int8)
+        return matrix
+
+    def clear(self):
+        self.keywords = []
+        self._vectors = None
+        self._ann = None
+
+    def set(self, keywords: List[str], embeddings):
+        """用新的关键词和向量替换整个索引"""
+        self.clear()
+        if keywords:
+            self.keywords = list(keywords)
+            self._vectors = self._quantize(normalize_rows(embeddings))
+            self._sync_ann()
+
+    def add(self, keywords: List[str], embeddings):
+        """追加关键词"""
+        if not keywords:
+            return
+        vectors = self._quantize(normalize_rows(embeddings))
+        start = len(self.keywords)
+        self.keywords = self.keywords + list(keywords)
+        self._vectors = vectors if self._vectors is None else np.vstack([self._vectors, vectors])
+        if self._ann is not None:
+            self._ann.resize_index(len(self.keywords))
+            self._ann.add_items(self._float_rows(vectors), np.arange(start, len(self.keywords)))
+        else:
+            self._sync_ann()
+
+    def remove(self, keep_mask: np.ndarray):
+        """只保留 keep_mask 为 True 的关键词"""
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+        self.keywords = [k for k, kept in zip(self.keywords, keep_mask) if kept]
+        if not self.keywords:
+            self.clear()
+            return
+        self._vectors = self._vectors[keep_mask]
+        # 删除会改变行号，重新构建近似索引
+        self._ann = None
+        self._sync_ann()
+
+    def without(self, keep_mask: np.ndarray) -> "KeywordIndex":
+        """只保留 keep_mask 为 True 的关键词的新索引，原索引不变
+
+        需要重新构建近似索引时耗时与关键词数成正比，可以在线程池中构建，完成后由调用方整体替换。
+        """
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+        index = KeywordIndex(dtype=self.dtype, ann_threshold=self.ann_threshold, ann_ef=self.ann_ef)
+        index.keywords = [k for k, kept in zip(self.keywords, keep_mask) if kept]
+        if index.keywords:
+            index._vectors = self._vectors[keep_mask]
+            index._sync_ann()
+        return index
+
+    def _float_rows(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return vectors.astype(np.float32) / INT8_SCALE
+        return vectors.astype(np.float32, copy=False)
+
+    def _sync_ann(self):
+        """关键词数量超过阈值时构建 HNSW 索引"""
+        if hnswlib is None or self._ann is not None or len(self.keywords) < self.ann_threshold:
+            return
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=len(self.keywords), ef_construction=200, M=16)
+        for start in range(0, len(self.keywords), SEARCH_BLOCK_ROWS):
+            block = self._vectors[start:start + SEARCH_BLOCK_ROWS]
+            index.add_items(self._float_rows(block), np.arange(start, start + len(block)))
+        index.set_ef(self.ann_ef)
+        self._ann = index
+        logger.info(f"Built HNSW index for {len(self.keywords)} keywords")
+
+    def _exact_scores(self, queries: np.ndarray) -> np.ndarray:
+        """计算查询矩阵与所有关键词的余弦相似度，返回 (查询数, 关键词数)"""
+        if self.dtype == "float32":
+            return queries @ self._vectors.T
+        scores = np.empty((queries.shape[0], len(self.keywords)), dtype=np.float32)
+        for start in range(0, len(self.keywords), SEARCH_BLOCK_ROWS):
+            block = self._float_rows(self._vectors[start:start + SEARCH_BLOCK_ROWS])
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    def search_batch(self, query_embeddings, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """批量检索，返回按相似度降序排列的 (相似度, 关键词下标)，形状均为 (查询数, k)"""
+        queries = normalize_rows(query_embeddings)
+        n = queries.shape[0]
+        if not self.keywords:
+            return np.zeros((n, 0), dtype=np.float32), np.zeros((n, 0), dtype=np.int64)
+        k = min(k, len(self.keywords))
+
+        if self._ann is not None:
+            labels, distances = self._ann.knn_query(queries, k=k)
+            # 内积空间中 distance = 1 - 相似度
+            return (1.0 - distances).astype(np.float32), labels.astype(np.int64)
+
+        scores = self._exact_scores(queries)
+        if k == 1:
+            top = np.argmax(scores, axis=1)[:, None]
+            return np.take_along_axis(scores, top, axis=1), top
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (n, 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def search(self, query_embedding, k: int = 5) -> List[Tuple[str, float]]:
+        """返回与查询最相似的 k 个关键词及相似度"""
+        scores, indices = self.search_batch(query_embedding, k)
+        return [(self.keywords[i], float(s)) for s, i in zip(scores[0], indices[0])]
+
+    def max_similarity(self, query_embedding) -> float:
+        """查询与所有关键词的最大余弦相似度"""
+        scores, _ = self.search_batch(query_embedding, 1)
+        return float(scores[0, 0]) if scores.size else 0.0
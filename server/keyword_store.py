@@ -0,0 +1,214 @@
+import glob
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('keyword_store')
+
+FORMAT_VERSION = 1
+META_FILENAME = "keywords.json"
+EMBEDDINGS_FILENAME = "keyword_embeddings.npy"  # 旧版本不带版本号的向量文件
+REBUILD_REQUEST_FILENAME = "rebuild.request"
+
+
+FINGERPRINT_MODULUS = 1 << 256
+
+
+def _legacy_fingerprint(ids: Iterable[str]) -> str:
+    """旧版本的语料指纹：排序后所有块ID的 sha256，只能从完整的块ID列表计算"""
+    ids = sorted(ids)
+    digest = hashlib.sha256()
+    for chunk_id in ids:
+        digest.update(chunk_id.encode("utf-8"))
+        digest.update(b"\0")
+    return f"{len(ids)}:{digest.hexdigest()}"
+
+
+def _id_hash(chunk_id: str) -> int:
+    return int.from_bytes(hashlib.sha256(chunk_id.encode("utf-8")).digest(), "big")
+
+
+class CorpusFingerprint:
+    """语料指纹：块数加上所有块ID哈希之和（模 2^256），与块的顺序无关，可以随块的加入和删除增量更新
+
+    只在启动校验时读取向量数据库中的所有块ID，之后保存关键词库和词法索引时直接使用当前值。
+    调用方保证只加入语料中还没有的块、只删除语料中已有的块。
+    """
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self.count = 0
+        self.total = 0
+        self.legacy: Optional[str] = None  # 同一语料的旧版本指纹，只在从完整语料计算后、发生变化前有效
+        self.add(ids)
+
+    @classmethod
+    def of(cls, vectordb) -> "CorpusFingerprint":
+        """根据向量数据库（或 VectorPartitions 的所有分区）中所有块的ID计算语料指纹，只读取ID，不读取内容"""
+        ids = vectordb.get(include=[]).get("ids", [])
+        fingerprint = cls(ids)
+        fingerprint.legacy = _legacy_fingerprint(ids)
+        return fingerprint
+
+    def add(self, ids: Iterable[str]):
+        for chunk_id in ids:
+            self.count += 1
+            self.total = (self.total + _id_hash(chunk_id)) % FINGERPRINT_MODULUS
+            self.legacy = None
+
+    def remove(self, ids: Iterable[str]):
+        for chunk_id in ids:
+            self.count -= 1
+            self.total = (self.total - _id_hash(chunk_id)) % FINGERPRINT_MODULUS
+            self.legacy = None
+
+    @property
+    def value(self) -> str:
+        return f"{self.count}:{self.total:064x}"
+
+    def matches(self, saved: Optional[str]) -> bool:
+        """saved 是否为当前语料的指纹；也接受升级前保存的旧格式指纹，升级后不必重建"""
+        return saved is not None and saved in (self.value, self.legacy)
+
+
+class KeywordStore:
+    """将关键词、来源映射和关键词向量保存在磁盘上
+
+    关键词向量以 .npy 格式保存，加载时使用内存映射，启动时无需重新计算。
+    每次保存版本号加一，向量写入带版本号的新文件，元数据文件最后写入并指向该文件，
+    因此多个进程可以同时读取：已经映射旧版本的进程不受影响，新版本写完后才对其他进程可见。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, META_FILENAME)
+        self.rebuild_request_path = os.path.join(directory, REBUILD_REQUEST_FILENAME)
+        os.makedirs(directory, exist_ok=True)
+        self._version_stat = None  # 上次读取版本号时元数据文件的 (mtime, size)
+        self._version = 0
+
+    def _embeddings_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"keyword_embeddings.{version}.npy")
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def current_version(self) -> int:
+        """磁盘上关键词库的版本号，元数据文件未变化时不重新读取"""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._version_stat:
+            meta = self._read_meta() or {}
+            self._version = meta.get("version", 0)
+            self._version_stat = key
+        return self._version
+
+    def request_rebuild(self):
+        """记录一次全量重建请求，由负责导入的进程执行"""
+        with open(self.rebuild_request_path, "w", encoding="utf-8") as f:
+            f.write("1")
+
+    def take_rebuild_request(self) -> bool:
+        """取出重建请求，存在时返回 True"""
+        try:
+            os.remove(self.rebuild_request_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save(
+        self,
+        keywords: List[str],
+        keyword_sources: Dict[str, Set[str]],
+        keyword_embeddings,
+        model_name: str,
+        fingerprint: str,
+    ) -> int:
+        """原子地保存关键词库，返回新的版本号"""
+        previous = self.current_version()
+        version = previous + 1
+        embeddings = np.asarray(keyword_embeddings, dtype=np.float32)
+        embeddings_path = self._embeddings_path(version)
+        tmp_embeddings_path = embeddings_path + ".tmp"
+        with open(tmp_embeddings_path, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(tmp_embeddings_path, embeddings_path)
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "version": version,
+            "embeddings_file": os.path.basename(embeddings_path),
+            "model_name": model_name,
+            "fingerprint": fingerprint,
+            "keywords": keywords,
+            "sources": {k: sorted(keyword_sources.get(k, ())) for k in keywords},
+        }
+        tmp_meta_path = self.meta_path + ".tmp"
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta_path, self.meta_path)
+        self._remove_old_versions(keep={version, previous})
+        logger.info(f"Saved {len(keywords)} keywords to {self.directory} (version {version})")
+        return version
+
+    def _remove_old_versions(self, keep: Set[int]):
+        """删除旧版本的向量文件；保留上一个版本，供刚读取了旧元数据的进程打开
+
+        已经内存映射的文件在删除后仍然可以继续读取，直到映射被释放。
+        """
+        keep_paths = {self._embeddings_path(v) for v in keep}
+        legacy = os.path.join(self.directory, EMBEDDINGS_FILENAME)
+        for path in glob.glob(os.path.join(self.directory, "keyword_embeddings.*.npy")) + [legacy]:
+            if path not in keep_paths and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove old keyword embeddings {path}: {str(e)}")
+
+    def load(
+        self, model_name: str, fingerprint: Optional[CorpusFingerprint] = None
+    ) -> Optional[Tuple[List[str], Dict[str, Set[str]], np.ndarray, int]]:
+        """加载关键词库，返回 (关键词, 来源, 向量, 版本号)；模型或语料发生变化时返回 None
+
+        fingerprint 为 None 时不校验语料指纹，用于读取其他进程刚保存的版本。
+        """
+        try:
+            meta = self._read_meta()
+            if meta is None:
+                return None
+
+            if meta.get("format_version") != FORMAT_VERSION:
+                logger.info("Keyword store format changed, rebuild required")
+                return None
+            if meta.get("model_name") != model_name:
+                logger.info(f"Keyword store built with {meta.get('model_name')}, rebuild required")
+                return None
+            if fingerprint is not None and not fingerprint.matches(meta.get("fingerprint")):
+                logger.info("Corpus changed since keywords were saved, rebuild required")
+                return None
+
+            keywords = meta["keywords"]
+            embeddings_path = os.path.join(self.directory, meta.get("embeddings_file", EMBEDDINGS_FILENAME))
+            if not os.path.exists(embeddings_path):
+                return None
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+            if len(keywords) != embeddings.shape[0]:
+                logger.warning("Keyword store is inconsistent, rebuild required")
+                return None
+
+            sources = {k: set(v) for k, v in meta.get("sources", {}).items()}
+            return keywords, sources, embeddings, meta.get("version", 0)
+
+        except Exception as e:
+            logger.error(f"Error loading keyword store: {str(e)}")
+            return None
@@ -0,0 +1,57 @@
+import os
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('leader')
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只支持单进程部署
+    fcntl = None
+
+
+class LeaderLock:
+    """基于文件锁的主进程选举
+
+    多个工作进程竞争同一个锁文件，同一时间只有一个进程持有锁并负责导入；
+    持有锁的进程退出（包括崩溃）时操作系统自动释放锁，其他进程下次尝试时接管。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试获取锁，已经持有时直接返回 True"""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        # 写入进程号，便于排查哪个进程负责导入
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._fd = fd
+        logger.info(f"Process {os.getpid()} acquired leader lock {self.path}")
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
@@ -0,0 +1,367 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+from logger_config import setup_logger
+
+if TYPE_CHECKING:
+    from keyword_store import CorpusFingerprint
+
+# 设置日志记录器
+logger = setup_logger('lexical_index')
+
+FORMAT_VERSION = 2
+META_FILENAME = "lexical_index.meta.json"
+LEGACY_FILENAME = "lexical_index.json"
+
+# 增量文件中的块数超过索引块数的这个比例时，下次保存写入完整索引
+COMPACT_RATIO = 0.25
+
+# 英文单词、数字和代码标识符（允许 . _ - 连接），以及连续的中日韩文字
+TOKEN_PATTERN = re.compile(
+    r"[A-Za-z0-9_]+(?:[.\-][A-Za-z0-9_]+)*"
+    r"|[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+"
+)
+CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+CAMEL_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+# 中文疑问词和虚词，切分连续汉字时作为分隔符去掉
+CJK_STOP_PATTERN = re.compile("是什么|为什么|怎么样|怎么|如何|什么|哪些|哪个|的|了|吗|呢|吧|是")
+
+# 常见英文停用词，不参与检索
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its
+of on or that the their then there these this to was were what when where which who why
+will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词，代码标识符同时保留整体和拆分后的子词，中日韩文字按相邻两字切分"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        word = match.group()
+        if CJK_PATTERN.match(word):
+            for run in CJK_STOP_PATTERN.split(word):
+                if len(run) == 1:
+                    tokens.append(run)
+                else:
+                    tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            continue
+
+        lower = word.lower()
+        if lower in STOPWORDS:
+            continue
+        tokens.append(lower)
+        # get_user.name / getUserName / max-retries 额外拆成子词，用部分名称也能命中
+        parts = [p.lower() for piece in re.split(r"[._\-]", word) for p in CAMEL_PATTERN.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """基于 BM25 的本地倒排索引，按块ID索引块内容
+
+    检索只使用本地数据，不调用向量 API。所有读写都在锁内进行，可以在线程池中检索。
+    上次保存之后的修改记录在 _changes 中，LexicalStore 据此只写入增量。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}  # 词 -> {块ID: 词频}
+        self.doc_lengths: Dict[str, int] = {}  # 块ID -> 词数
+        self.total_length = 0
+        self.saved_version: Optional[int] = None  # 与磁盘上哪个版本加上 _changes 一致，None 表示需要完整保存
+        self._changes: Dict[str, Optional[Dict[str, int]]] = {}  # 块ID -> 加入的词频，删除时为 None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.doc_lengths
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.total_length = 0
+            self.saved_version = None
+            self._changes = {}
+
+    def _add_counts(self, chunk_id: str, counts: Dict[str, int]):
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(counts.values())
+        self.doc_lengths[chunk_id] = length
+        self.total_length += length
+
+    def _remove_ids(self, ids: Set[str]):
+        for term in list(self.postings):
+            posting = self.postings[term]
+            for chunk_id in ids.intersection(posting):
+                del posting[chunk_id]
+            if not posting:
+                del self.postings[term]
+        for chunk_id in ids:
+            self.total_length -= self.doc_lengths.pop(chunk_id)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> List[str]:
+        """加入块；块ID由内容决定，已经存在的块直接跳过。返回新加入的块ID"""
+        added = []
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self.doc_lengths:
+                    continue
+                counts = dict(Counter(tokenize(text)))
+                self._add_counts(chunk_id, counts)
+                self._changes[chunk_id] = counts
+                added.append(chunk_id)
+        return added
+
+    def remove(self, ids: Iterable[str]) -> List[str]:
+        """删除块，返回实际删除的块ID"""
+        with self._lock:
+            ids = {chunk_id for chunk_id in ids if chunk_id in self.doc_lengths}
+            if ids:
+                self._remove_ids(ids)
+            for chunk_id in ids:
+                self._changes[chunk_id] = None
+        return list(ids)
+
+    def changes(self) -> Dict[str, Optional[Dict[str, int]]]:
+        """上次保存之后的修改 {块ID: 加入的词频，删除时为 None}"""
+        with self._lock:
+            return dict(self._changes)
+
+    def mark_saved(self, changes: Dict[str, Optional[Dict[str, int]]], version: int):
+        """changes 已经写入磁盘上的 version；保存期间又发生的修改保留到下次保存"""
+        with self._lock:
+            for chunk_id, counts in changes.items():
+                if self._changes.get(chunk_id, ()) is counts:
+                    del self._changes[chunk_id]
+            self.saved_version = version
+
+    def apply_changes(self, changes: Dict[str, Optional[Dict[str, int]]]):
+        """应用其他进程保存的增量，不记录为本进程的修改；重复应用的结果相同"""
+        with self._lock:
+            existing = {chunk_id for chunk_id in changes if chunk_id in self.doc_lengths}
+            if existing:
+                self._remove_ids(existing)
+            for chunk_id, counts in changes.items():
+                if counts is not None:
+                    self._add_counts(chunk_id, counts)
+
+    def _idf(self, df: int) -> float:
+        n = len(self.doc_lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(
+        self, query: str, k: int = 10, allowed: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float, float]]:
+        """检索与查询最相关的 k 个块，返回 [(块ID, BM25 分数, 覆盖率)]，按分数降序
+
+        覆盖率是块中出现的查询词的 IDF 之和占全部查询词 IDF 之和的比例（0~1），
+        用于判断词法命中是否足够确定；索引中不存在的查询词按最大 IDF 计入分母。
+        给出 allowed 时只返回其中的块，IDF 仍按整个索引计算。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not terms or not self.doc_lengths:
+                return []
+            avg_length = self.total_length / len(self.doc_lengths) or 1.0
+            max_idf = self._idf(0)
+
+            scores: Dict[str, float] = {}
+            matched: Dict[str, float] = {}
+            total_idf = 0.0
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    total_idf += max_idf
+                    continue
+                idf = self._idf(len(posting))
+                total_idf += idf
+                for chunk_id, tf in posting.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                    matched[chunk_id] = matched.get(chunk_id, 0.0) + idf
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(chunk_id, score, matched[chunk_id] / total_idf) for chunk_id, score in top]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "k1": self.k1,
+                "b": self.b,
+                "doc_lengths": dict(self.doc_lengths),
+                "postings": {term: dict(posting) for term, posting in self.postings.items()},
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LexicalIndex":
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+class LexicalStore:
+    """将词法索引与语料指纹一起保存到磁盘，每次保存版本号加一，其他进程据此判断是否需要重新加载
+
+    完整的索引写入带版本号的基础文件，之后每次保存只把新增和删除的块写入增量文件；
+    增量累计超过索引的 COMPACT_RATIO 时重新写入基础文件。元数据文件最后写入，记录基础文件、
+    增量文件和版本号，其他进程只读取元数据判断版本，已加载的进程只需应用新的增量。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, META_FILENAME)
+        os.makedirs(directory, exist_ok=True)
+        self._version_stat = None  # 上次读取版本号时元数据文件的 (mtime, size)
+        self._version = 0
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.get("format_version") != FORMAT_VERSION:
+            return None
+        return meta
+
+    def _read(self, filename: str) -> dict:
+        with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, filename: str, data: dict):
+        path = os.path.join(self.directory, filename)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def current_version(self) -> int:
+        """磁盘上索引的版本号，元数据文件未变化时不重新读取"""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._version_stat:
+            try:
+                meta = self._read_meta() or {}
+            except (OSError, ValueError):
+                return self._version
+            self._version = meta.get("version", 0)
+            self._version_stat = key
+        return self._version
+
+    def save(self, index: LexicalIndex, fingerprint: str) -> int:
+        """原子地保存索引，返回新的版本号；索引与磁盘上的最新版本一致时只写入增量"""
+        meta = self._read_meta()
+        previous = meta["version"] if meta else 0
+        version = previous + 1
+        changes = index.changes()
+        incremental = (
+            meta is not None and index.saved_version == previous
+            and meta["delta_chunks"] + len(changes) <= len(index) * COMPACT_RATIO
+        )
+        if incremental:
+            new_meta = {**meta, "version": version, "fingerprint": fingerprint}
+            if changes:
+                filename = f"lexical_index.{version}.delta.json"
+                self._write(filename, {
+                    "added": {chunk_id: counts for chunk_id, counts in changes.items() if counts is not None},
+                    "removed": [chunk_id for chunk_id, counts in changes.items() if counts is None],
+                })
+                new_meta["deltas"] = meta["deltas"] + [{"version": version, "file": filename}]
+                new_meta["delta_chunks"] = meta["delta_chunks"] + len(changes)
+        else:
+            filename = f"lexical_index.{version}.json"
+            self._write(filename, {"index": index.to_dict()})
+            new_meta = {
+                "format_version": FORMAT_VERSION,
+                "version": version,
+                "fingerprint": fingerprint,
+                "base_version": version,
+                "base": filename,
+                "deltas": [],
+                "delta_chunks": 0,
+            }
+        self._write(META_FILENAME, new_meta)
+        index.mark_saved(changes, version)
+        self._remove_unused(new_meta, meta)
+        logger.info(
+            f"Saved lexical index with {len(index)} chunks (version {version}, "
+            f"{f'{len(changes)} changed chunks' if incremental else 'full'})"
+        )
+        return version
+
+    def _remove_unused(self, meta: dict, previous: Optional[dict]):
+        """删除当前和上一个版本都不再使用的文件；保留上一个版本，供刚读取了旧元数据的进程打开"""
+        keep = {META_FILENAME}
+        for m in (meta, previous):
+            if m:
+                keep.add(m["base"])
+                keep.update(delta["file"] for delta in m["deltas"])
+        for filename in os.listdir(self.directory):
+            if filename.startswith("lexical_index.") and filename.endswith(".json") and filename not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError as e:
+                    logger.warning(f"Could not remove old lexical index file {filename}: {str(e)}")
+
+    @staticmethod
+    def _delta_changes(delta: dict) -> Dict[str, Optional[Dict[str, int]]]:
+        changes: Dict[str, Optional[Dict[str, int]]] = {chunk_id: None for chunk_id in delta["removed"]}
+        changes.update(delta["added"])
+        return changes
+
+    def load(self, fingerprint: Optional["CorpusFingerprint"] = None) -> Optional[Tuple[LexicalIndex, int]]:
+        """加载索引，返回 (索引, 版本号)；语料变化时返回 None，fingerprint 为 None 时不校验"""
+        try:
+            meta = self._read_meta()
+            if meta is None:
+                if os.path.exists(os.path.join(self.directory, LEGACY_FILENAME)):
+                    logger.info("Lexical index format changed, rebuild required")
+                return None
+            if fingerprint is not None and not fingerprint.matches(meta.get("fingerprint")):
+                logger.info("Corpus changed since lexical index was saved, rebuild required")
+                return None
+            index = LexicalIndex.from_dict(self._read(meta["base"])["index"])
+            for delta in meta["deltas"]:
+                index.apply_changes(self._delta_changes(self._read(delta["file"])))
+        except Exception as e:
+            logger.error(f"Error loading lexical index: {str(e)}")
+            return None
+        index.saved_version = meta["version"]
+        return index, meta["version"]
+
+    def update(self, index: LexicalIndex, version: int) -> Optional[int]:
+        """把 version 之后保存的增量应用到已加载的索引，返回新的版本号
+
+        之后重新写入了基础文件，或者读取失败时返回 None，需要调用 load() 重新加载。
+        """
+        try:
+            meta = self._read_meta()
+            if meta is None or meta["base_version"] > version:
+                return None
+            for delta in meta["deltas"]:
+                if delta["version"] > version:
+                    index.apply_changes(self._delta_changes(self._read(delta["file"])))
+        except Exception as e:
+            logger.error(f"Error updating lexical index: {str(e)}")
+            return None
+        index.saved_version = meta["version"]
+        return meta["version"]
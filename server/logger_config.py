@@ -1,23 +1,155 @@
+import atexit
+import contextvars
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import random
+import zlib
 from datetime import datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+# 日志配置在各模块导入时读取，早于 app.py 加载 .env
+load_dotenv()
+
+LOG_DIRECTORY = os.getenv("LOG_DIRECTORY", os.path.join(os.path.dirname(__file__), 'log'))
+# 1 时日志记录放入队列，由后台线程格式化并写入文件和控制台，调用方不做任何 IO
+LOG_QUEUE = os.getenv("LOG_QUEUE", "0") == "1"
+# text 或 json（每行一个 JSON 对象，包含请求ID和附加字段）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_FILE_LEVEL = logging.getLevelName(os.getenv("LOG_FILE_LEVEL", "DEBUG").upper())
+# 高频日志（每个查询、每个块一条）的保留比例
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+# 队列或采样模式下，两种格式都不输出线程和进程信息，创建记录时不再收集（见 logging HOWTO 的 Optimization 一节）；
+# 这些是进程级设置，也作用于 uvicorn 和第三方库的日志，默认模式下保持不变
+if LOG_QUEUE or LOG_SAMPLE_RATE < 1:
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+# 高频日志用 extra=SAMPLED 标记，按 LOG_SAMPLE_RATE 采样
+SAMPLED = {"sampled": True}
+
+# 当前请求的ID，由 HTTP 中间件设置
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord 的标准属性，其余属性为 extra 传入的附加字段
+_STANDARD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "request_id", "sampled", "taskName"
+}
+
+
+class ContextFilter(logging.Filter):
+    """在调用日志的线程中执行：附加当前请求ID，并对标记为采样的记录按比例丢弃
+
+    有请求ID时按ID的哈希采样，同一请求的高频日志要么全部保留，要么全部丢弃。
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.request_id = request_id
+        if self.sample_rate >= 1 or not getattr(record, "sampled", False):
+            return True
+        if request_id:
+            return zlib.crc32(request_id.encode("utf-8")) / 2 ** 32 < self.sample_rate
+        return random.random() < self.sample_rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON：时间、级别、模块、消息、请求ID和 extra 传入的字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            data["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """只把记录原样放入队列：消息的 % 格式化和序列化都在后台线程中进行
+
+    记录的参数在写入前不会被复制，调用方不应在记录日志后修改作为参数传入的对象。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _Dispatcher(logging.Handler):
+    """后台线程中把记录交给对应模块的文件处理器和控制台处理器"""
+
+    def handle(self, record: logging.LogRecord):
+        for handler in _targets.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_targets: Dict[str, List[logging.Handler]] = {}  # 模块名 -> 实际写入的处理器
+_queue_handlers: List[LazyQueueHandler] = []
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_listener():
+    """创建队列和后台线程；fork 出的子进程中没有父进程的线程，需要重新创建"""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    for handler in _queue_handlers:
+        handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, _Dispatcher())
+    _listener.start()
+
+
+def _stop_listener():
+    """写完队列中剩余的记录后停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _queue_handler() -> LazyQueueHandler:
+    handler = LazyQueueHandler(queue.SimpleQueue())
+    _queue_handlers.append(handler)
+    if _listener is None:
+        _start_listener()
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_start_listener)
+    else:
+        handler.queue = _listener.queue
+    return handler
+
 
 def setup_logger(name='app'):
     # 创建日志目录（如果不存在）
-    log_dir = os.path.join(os.path.dirname(__file__), 'log')
-    os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(LOG_DIRECTORY, exist_ok=True)
 
-    # 创建logger
+    # 创建logger；级别不低于两个处理器中较低的级别，被过滤的调用不创建记录
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(min(LOG_FILE_LEVEL, logging.INFO))
 
     # 防止重复添加handler
     if logger.handlers:
         return logger
 
     # 创建文件处理器 - 按天滚动日志文件
-    log_file = os.path.join(log_dir, f'{name}.log')
+    log_file = os.path.join(LOG_DIRECTORY, f'{name}.log')
     file_handler = logging.handlers.TimedRotatingFileHandler(
         log_file,
         when='midnight',
@@ -25,21 +157,31 @@ def setup_logger(name='app'):
         backupCount=30,  # 保留30天的日志
         encoding='utf-8'
     )
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(LOG_FILE_LEVEL)
 
     # 创建控制台处理器
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
 
     # 创建格式器
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
-    # 添加处理器到logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # 请求ID与采样在调用线程中处理，之后才进入队列
+    logger.addFilter(ContextFilter(LOG_SAMPLE_RATE))
+
+    # 添加处理器到logger：队列模式下只添加队列处理器，文件和控制台由后台线程写入
+    if LOG_QUEUE:
+        _targets[name] = [file_handler, console_handler]
+        logger.addHandler(_queue_handler())
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
 
     return logger
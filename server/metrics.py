@@ -0,0 +1,254 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from tokenizer import get_tokenizer
+from usage_store import record_usage
+
+# 默认的延迟分桶（秒），覆盖从本地向量计算到 LLM 生成的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 每次请求 token 数的分桶
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 1500, 2000, 3000, 4000, 8000)
+
+# 当前请求的分阶段耗时 {阶段: [总秒数, 次数]}，由 HTTP 中间件在请求开始时设置
+_request_timings: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """累积分桶的直方图，与 Prometheus 的 histogram 类型一致"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        result = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    result.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, le), cumulative))
+                labels = _format_labels(self.labelnames, key)
+                result.append((f"{self.name}_sum", labels, series["sum"]))
+                result.append((f"{self.name}_count", labels, series["count"]))
+        return result
+
+
+class Registry:
+    """指标注册表，render() 输出 Prometheus 文本格式
+
+    除了直接注册的 Counter/Histogram，还可以注册采集函数，在抓取时读取缓存命中数等已有的统计值。
+    采集函数返回 [(名称, 类型, 说明, [(标签字典, 值), ...]), ...]。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], list]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], list]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# 查询与导入的分阶段耗时
+QUERY_STAGE_SECONDS = REGISTRY.histogram(
+    "rag_query_stage_duration_seconds",
+    "Time spent in each stage of answering a query",
+    ["stage"],
+)
+INGEST_STAGE_SECONDS = REGISTRY.histogram(
+    "rag_ingest_stage_duration_seconds",
+    "Time spent in each stage of ingesting a document",
+    ["stage"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_duration_seconds",
+    "HTTP request latency until the response headers are sent",
+    ["method", "path", "status"],
+)
+
+QUERIES_TOTAL = REGISTRY.counter(
+    "rag_queries_total",
+    "Answered queries by source type and whether the answer came from the cache",
+    ["source_type", "cached"],
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter(
+    "rag_llm_tokens_total",
+    "LLM tokens by purpose (answer/keywords) and kind (prompt/completion)",
+    ["purpose", "kind"],
+)
+ANSWER_TOKENS = REGISTRY.histogram(
+    "rag_answer_tokens",
+    "Tokens per LLM-generated answer by kind (prompt/completion/context)",
+    ["kind"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_CALLS_TOTAL = REGISTRY.counter(
+    "rag_llm_calls_total",
+    "LLM calls by purpose",
+    ["purpose"],
+)
+INGEST_JOBS_TOTAL = REGISTRY.counter(
+    "rag_ingest_jobs_total",
+    "Finished ingestion jobs by final status",
+    ["status"],
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, stage: str):
+    """记录代码块耗时到直方图，同时累加到当前请求的分阶段耗时中"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            entry = timings.setdefault(stage, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+
+def start_request_timings() -> contextvars.Token:
+    return _request_timings.set({})
+
+
+def finish_request_timings(token: contextvars.Token) -> Dict[str, List[float]]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing_header(timings: Dict[str, List[float]], total: float) -> str:
+    """生成 Server-Timing 响应头，耗时单位为毫秒"""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def record_llm_usage(
+    purpose: str,
+    prompt: str,
+    completion: str,
+    usage: Optional[dict] = None,
+    model: str = "unknown",
+    latency: Optional[float] = None,
+    source_type: Optional[str] = None,
+) -> Tuple[int, int]:
+    """记录一次 LLM 调用的 token 数，返回 (提示词 token 数, 生成 token 数)
+
+    优先使用接口返回的 usage_metadata，没有时用本地分词器计算。同时写入本地用量记录。
+    """
+    LLM_CALLS_TOTAL.inc(purpose=purpose)
+    if usage:
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+    else:
+        tokenizer = get_tokenizer()
+        prompt_tokens = tokenizer.count(prompt)
+        completion_tokens = tokenizer.count(completion)
+    LLM_TOKENS_TOTAL.inc(prompt_tokens, purpose=purpose, kind="prompt")
+    LLM_TOKENS_TOTAL.inc(completion_tokens, purpose=purpose, kind="completion")
+    record_usage(
+        "llm", purpose, model, prompt_tokens, completion_tokens, latency=latency, source_type=source_type
+    )
+    return prompt_tokens, completion_tokens
@@ -0,0 +1,108 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('rate_limiter')
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数，中英文混合时按每 2 个字符约 1 个 token 计算"""
+    return max(1, len(text) // 2)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为 429 限流错误"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return type(error).__name__ == "RateLimitError"
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """读取 429 响应中的 Retry-After 头（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        # 单次请求超过桶容量时按容量计算，避免永远等待
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.refill_rate)
+
+
+class RateLimiter:
+    """同时限制每分钟请求数（RPM）和每分钟 token 数（TPM）"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens: int = 1):
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket:
+            await self.token_bucket.acquire(tokens)
+
+
+async def call_with_retry(
+    func: Callable[[], Awaitable[T]],
+    rate_limiter: Optional[RateLimiter] = None,
+    tokens: int = 1,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+) -> T:
+    """在限流配额内调用 func，遇到 429 时按指数退避重试，其他异常直接抛出"""
+    attempt = 0
+    while True:
+        if rate_limiter:
+            await rate_limiter.acquire(tokens)
+        try:
+            return await func()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+            attempt += 1
+            logger.warning(f"Rate limited, retrying in {delay:.1f}s (attempt {attempt}/{max_retries})")
+            await asyncio.sleep(delay)
@@ -0,0 +1,287 @@
+"""切换向量库使用的向量模型，或修改向量分区数
+
+不带参数时只显示向量库当前记录的模型和分区数。
+--backend：用新模型重新计算所有分区中块的向量。每个分区先写入临时集合，全部写入并校验数量后再替换原集合，
+中途失败不影响原有数据。
+--partitions：按文档把块重新分配到指定数量的分区，直接复制已有的向量，不调用向量 API；
+先把块复制到新的分区并记录新的分区数，再删除旧分区中多余的块，中断后重新运行即可继续。
+两种操作都需要先停止服务。
+
+用法：
+    cd server && python reindex.py
+    cd server && python reindex.py --backend local --model all-MiniLM-L6-v2
+    cd server && python reindex.py --backend openai
+    cd server && python reindex.py --partitions 4
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "")
+
+import app as server  # noqa: E402  复用服务的目录与模型配置
+from embedding_backends import BACKENDS, create_embeddings, model_metadata, store_model  # noqa: E402
+from embedding_backends import BACKEND_KEY, DIMENSION_KEY, MODEL_KEY  # noqa: E402
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from logger_config import setup_logger  # noqa: E402
+from usage_store import usage_context  # noqa: E402
+from vector_partitions import CHUNK_METADATA_KEY, PARTITIONS_KEY  # noqa: E402
+from vector_partitions import partition_name, partition_of, source_type_of  # noqa: E402
+
+# 设置日志记录器
+logger = setup_logger('reindex')
+
+# langchain_chroma 的默认集合名，即分区0
+COLLECTION_NAME = "langchain"
+TEMP_SUFFIX = "_reindex"
+
+
+def open_client():
+    import chromadb
+    if server.CHROMA_HOST:
+        return chromadb.HttpClient(host=server.CHROMA_HOST, port=server.CHROMA_PORT)
+    return chromadb.PersistentClient(path=server.PERSIST_DIRECTORY)
+
+
+def collection_names(client) -> set:
+    return {getattr(c, "name", c) for c in client.list_collections()}
+
+
+def partition_count(client) -> int:
+    """向量库记录的分区数，记录分区数之前的向量库只有一个集合"""
+    if COLLECTION_NAME not in collection_names(client):
+        return 1
+    return (client.get_collection(COLLECTION_NAME).metadata or {}).get(PARTITIONS_KEY, 1)
+
+
+def partition_collections(client) -> dict:
+    """已经存在的分区集合 {分区号: 集合}，包括上次重新分区中断后留下的分区"""
+    names = collection_names(client)
+    collections = {}
+    for name in names:
+        if name == COLLECTION_NAME:
+            collections[0] = client.get_collection(name)
+        elif name.startswith(COLLECTION_NAME + "_p") and name[len(COLLECTION_NAME) + 2:].isdigit():
+            collections[int(name[len(COLLECTION_NAME) + 2:])] = client.get_collection(name)
+    return collections
+
+
+def recover(client):
+    """上次替换集合时在删除原集合之后中断的，把已经完整写入的临时集合改回原名"""
+    names = collection_names(client)
+    for temp_name in [name for name in names if name.endswith(TEMP_SUFFIX)]:
+        name = temp_name[:-len(TEMP_SUFFIX)]
+        if name in names:
+            continue
+        temp = client.get_collection(temp_name)
+        if MODEL_KEY in (temp.metadata or {}):
+            temp.modify(name=name)
+            logger.info(f"Recovered re-embedded collection {name} from an interrupted reindex")
+
+
+def reindex(client, backend: str, model: str, batch_size: int) -> int:
+    """用指定模型重新计算所有分区中块的向量并替换原集合，返回块数
+
+    所有分区都写完后才开始替换，分区0最后替换；替换中断时服务检查到各分区的模型不一致会拒绝启动，
+    重新运行时由 recover() 完成替换。
+    """
+    embeddings = CachedEmbeddings(
+        create_embeddings(backend, model, batch_size), server.EMBEDDING_CACHE_PATH
+    )
+    names = [partition_name(COLLECTION_NAME, i) for i in range(partition_count(client))]
+    total = 0
+    try:
+        built = [reembed_collection(client, name, embeddings, backend, model, batch_size) for name in names]
+    finally:
+        embeddings.close()
+    for name, count in reversed(list(zip(names, built))):
+        client.delete_collection(name)
+        client.get_collection(name + TEMP_SUFFIX).modify(name=name)
+        total += count
+    return total
+
+
+def reembed_collection(client, name: str, embeddings, backend: str, model: str, batch_size: int) -> int:
+    """用新模型重新计算一个集合中所有块的向量，写入临时集合，返回块数"""
+    temp_name = name + TEMP_SUFFIX
+    source = client.get_or_create_collection(name)
+    total = source.count()
+
+    if temp_name in collection_names(client):
+        client.delete_collection(temp_name)
+    # 保留距离函数、分区数等集合配置，去掉旧的模型记录
+    metadata = {
+        k: v for k, v in (source.metadata or {}).items()
+        if k not in (BACKEND_KEY, MODEL_KEY, DIMENSION_KEY)
+    }
+    target = client.create_collection(temp_name, metadata=metadata or None)
+
+    dimension = None
+    start = time.perf_counter()
+    for offset in range(0, total, batch_size):
+        page = source.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        vectors = embeddings.embed_documents(page["documents"])
+        dimension = dimension or len(vectors[0])
+        target.add(
+            ids=page["ids"],
+            embeddings=vectors,
+            documents=page["documents"],
+            metadatas=page["metadatas"],
+        )
+        done = min(offset + batch_size, total)
+        print(f"  {name}: {done}/{total} chunks ({done / (time.perf_counter() - start):.1f} chunks/s)", flush=True)
+
+    if target.count() != total:
+        client.delete_collection(temp_name)
+        raise RuntimeError(f"Re-embedded {target.count()} of {total} chunks in {name}, original collections kept")
+
+    # 先记录模型再替换：替换中断时 recover() 可以据此判断临时集合已经完整
+    target.modify(metadata={**metadata, **model_metadata(backend, model, dimension)})
+    return total
+
+
+def repartition(client, count: int, batch_size: int) -> int:
+    """按文档把块重新分配到 count 个分区，复制已有的向量，返回复制的块数
+
+    每个文档的块都放到它所在的分区；内容相同的块属于不同分区的文档时每个分区各一份。
+    先复制并记录新的分区数，再删除多余的块和多余的分区，每一步都可以重复执行。
+    """
+    registry = server.document_registry
+    collections = partition_collections(client)
+    if 0 not in collections:
+        return 0
+    base = collections[0]
+    if registry.count() == 0 and any(c.count() for c in collections.values()):
+        raise RuntimeError("No document records yet; start the server once so that existing documents are registered")
+
+    # 新的分区沿用分区0的距离函数和模型记录
+    metadata = {k: v for k, v in (base.metadata or {}).items() if k not in (PARTITIONS_KEY, CHUNK_METADATA_KEY)}
+    for index in range(1, count):
+        if index not in collections:
+            collections[index] = client.get_or_create_collection(
+                partition_name(COLLECTION_NAME, index), metadata=metadata or None
+            )
+
+    # 每个分区应该包含的块 {块ID: 该分区中的一个文档}
+    expected = {index: {} for index in range(count)}
+    for document in registry.list():
+        target = expected[partition_of(document["doc_id"], count)]
+        for chunk_id in registry.chunk_ids(document["doc_id"]):
+            target.setdefault(chunk_id, document["doc_id"])
+
+    copied = 0
+    for index, owners in expected.items():
+        target = collections[index]
+        ids = list(owners)
+        for offset in range(0, len(ids), batch_size):
+            batch = ids[offset:offset + batch_size]
+            missing = set(batch) - set(target.get(ids=batch, include=[])["ids"])
+            for source_index, source in collections.items():
+                if not missing or source_index == index:
+                    continue
+                page = source.get(ids=list(missing), include=["documents", "metadatas", "embeddings"])
+                if not page["ids"]:
+                    continue
+                target.upsert(
+                    ids=page["ids"],
+                    embeddings=page["embeddings"],
+                    documents=page["documents"],
+                    metadatas=[
+                        {**(m or {}), "doc_id": owners[chunk_id], "source_type": source_type_of(owners[chunk_id])}
+                        for chunk_id, m in zip(page["ids"], page["metadatas"])
+                    ],
+                )
+                copied += len(page["ids"])
+                missing -= set(page["ids"])
+            if missing:
+                logger.warning(f"{len(missing)} registered chunks not found in any partition")
+        print(f"  partition {index}: {len(ids)} chunks", flush=True)
+
+    # 所有块都已经在新的分区中，记录分区数后服务可以按新的分区启动
+    base.modify(metadata={**(base.metadata or {}), PARTITIONS_KEY: count})
+
+    for index, collection in list(collections.items()):
+        if index >= count:
+            client.delete_collection(collection.name)
+            continue
+        stale = [chunk_id for chunk_id in collection.get(include=[])["ids"] if chunk_id not in expected[index]]
+        for offset in range(0, len(stale), batch_size):
+            collection.delete(ids=stale[offset:offset + batch_size])
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, help="新的向量模型后端；不指定时只显示当前记录的模型")
+    parser.add_argument("--model", help="模型名称或本地模型目录，local 默认与 ENCODER_MODEL 相同")
+    parser.add_argument("--batch-size", type=int, default=server.EMBEDDING_BATCH_SIZE, help="每批计算向量的块数")
+    parser.add_argument("--force", action="store_true", help="模型与记录一致时也重新计算")
+    parser.add_argument("--partitions", type=int, help="按文档重新分配到指定数量的分区")
+    args = parser.parse_args()
+
+    client = open_client()
+    recover(client)
+    partitions = partition_count(client)
+    if COLLECTION_NAME in collection_names(client):
+        recorded = store_model(client.get_collection(COLLECTION_NAME))
+        count = sum(collection.count() for collection in partition_collections(client).values())
+    else:
+        recorded, count = None, 0
+    current = f"{recorded['backend']}:{recorded['model']}" if recorded else "(none)"
+    print(f"Vector store: {count} chunks in {partitions} partitions, embedding model {current}")
+    print(f"Configured:   {server.EMBEDDING_BACKEND}:{server.EMBEDDING_MODEL}, {server.VECTOR_PARTITIONS} partitions")
+    if args.partitions:
+        run_repartition(client, args.partitions, args.batch_size)
+    if not args.backend:
+        return
+
+    model = args.model or (server.ENCODER_MODEL if args.backend == "local" else "text-embedding-ada-002")
+    if recorded and (recorded["backend"], recorded["model"]) == (args.backend, model) and not args.force:
+        print("Vector store already uses this model, nothing to do")
+        return
+
+    # 导入进程持有导入锁；拿不到锁说明服务仍在运行，重新生成向量期间的写入会丢失
+    if not server.leader_lock.try_acquire():
+        print("The server is running; stop it before reindexing", file=sys.stderr)
+        sys.exit(1)
+    try:
+        print(f"Re-embedding with {args.backend}:{model} ...")
+        with usage_context(endpoint="reindex"):
+            total = reindex(client, args.backend, model, args.batch_size)
+        rewound = server.job_store.rewind_embeddings()
+        if rewound:
+            print(f"{rewound} unfinished ingestion jobs will recompute their embeddings")
+    finally:
+        server.leader_lock.release()
+
+    print(f"Re-embedded {total} chunks with {args.backend}:{model}")
+    if (args.backend, model) != (server.EMBEDDING_BACKEND, server.EMBEDDING_MODEL):
+        print(f"Set EMBEDDING_BACKEND={args.backend} EMBEDDING_MODEL={model} before starting the server")
+
+
+def run_repartition(client, count: int, batch_size: int):
+    if count < 1:
+        print("--partitions must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    if not server.leader_lock.try_acquire():
+        print("The server is running; stop it before repartitioning", file=sys.stderr)
+        sys.exit(1)
+    try:
+        print(f"Redistributing chunks into {count} partitions ...")
+        copied = repartition(client, count, batch_size)
+        # 已经写入旧分区、尚未登记的任务重新计算（向量由缓存提供）并写入新的分区
+        rewound = server.job_store.rewind_embeddings(("embed", "index"))
+        if rewound:
+            print(f"{rewound} unfinished ingestion jobs will be re-indexed")
+    finally:
+        server.leader_lock.release()
+    print(f"Copied {copied} chunks, vector store now has {count} partitions")
+    if count != server.VECTOR_PARTITIONS:
+        print(f"Set VECTOR_PARTITIONS={count} before starting the server")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+import numpy as np
+from logger_config import SAMPLED, setup_logger
+
+# 设置日志记录器
+logger = setup_logger('semantic_cache')
+
+
+def normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def estimate_size(embedding: np.ndarray, value: Any) -> int:
+    """估算一条缓存占用的字节数"""
+    size = embedding.nbytes
+    answer = getattr(value, "answer", "")
+    size += len(answer.encode("utf-8"))
+    for doc in getattr(value, "source_documents", None) or []:
+        size += len(doc.encode("utf-8"))
+    return size
+
+
+class SemanticCache:
+    """按查询向量余弦相似度命中的回答缓存
+
+    查询向量与已缓存查询的相似度超过阈值时直接返回已缓存的结果。
+    按 LRU 淘汰，同时限制条数、总字节数和存活时间；版本号变化时整体失效。
+    每条缓存记录回答引用的块ID，删除或替换文档时只淘汰引用了被删除块的回答（invalidate_chunks）。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_key = 0
+        self._bytes = 0
+        self._matrix = None  # 所有缓存查询向量组成的矩阵，条目变化后重新构建
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                logger.info("Index changed, clearing answer cache")
+            self._clear()
+            self.version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._matrix = None
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        self._matrix = None
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        deadline = time.monotonic() - self.ttl_seconds
+        for key in [k for k, e in self._entries.items() if e["created_at"] < deadline]:
+            self._remove(key)
+
+    def get(self, embedding, version=None) -> Optional[Any]:
+        with self._lock:
+            self._check_version(version)
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[k]["embedding"] for k in self._keys])
+
+            similarities = self._matrix @ normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info("Answer cache hit, similarity %.4f", similarities[best], extra=SAMPLED)
+            return self._entries[key]["value"]
+
+    def put(self, embedding, value: Any, version=None, chunk_ids: Iterable[str] = ()):
+        """chunk_ids 为回答引用的块，为空表示回答没有引用文档（如直接由 LLM 回答）"""
+        embedding = normalize(embedding)
+        size = estimate_size(embedding, value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_key] = {
+                "embedding": embedding,
+                "value": value,
+                "size": size,
+                "chunk_ids": frozenset(chunk_ids),
+                "created_at": time.monotonic(),
+            }
+            self._next_key += 1
+            self._bytes += size
+            self._matrix = None
+
+            # 按最近最少使用的顺序淘汰，直到满足条数和内存上限
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str], previous_version, version, include_unsourced: bool = False):
+        """索引从 previous_version 变为 version 时只淘汰受影响的回答
+
+        淘汰引用了 chunk_ids 中任一块的回答；include_unsourced 时（有新增内容）同时淘汰没有引用文档的回答，
+        它们可能可以由新内容回答。缓存停留在更早的版本时，说明还有其他未处理的变化，整体失效。
+        """
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            if self.version != previous_version:
+                self._check_version(version)
+                return
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry["chunk_ids"] & chunk_ids or (include_unsourced and not entry["chunk_ids"])
+            ]
+            for key in stale:
+                self._remove(key)
+            self.version = version
+            if stale:
+                logger.info(f"Evicted {len(stale)} cached answers affected by a document change")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
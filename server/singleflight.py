@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('singleflight')
+
+
+class SingleFlight:
+    """合并相同 key 的并发调用：同一时间只执行一次，所有调用方共享结果"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.shared = 0  # 被合并（未实际执行）的调用次数
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        # 某个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+
+
+class Debouncer:
+    """防抖执行：delay 秒内的多次触发只执行一次 func
+
+    执行期间的新触发会在本次结束后再执行一次，func 的多次执行之间不会重叠。
+    trigger() 返回的 Future 在覆盖本次触发的那次执行结束后完成。
+    """
+
+    def __init__(self, func: Callable[[], Awaitable[Any]], delay: float, name: str = "task"):
+        self.func = func
+        self.delay = delay
+        self.name = name
+        self._pending: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sleeping = False
+
+    def trigger(self) -> asyncio.Future:
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+        pending = self._pending
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return pending
+
+    async def _run(self):
+        while self._pending is not None:
+            self._sleeping = True
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self._sleeping = False
+            await self._execute()
+
+    async def _execute(self):
+        waiters, self._pending = self._pending, None
+        try:
+            await self.func()
+        except Exception as e:
+            logger.error(f"Debounced {self.name} failed: {str(e)}")
+        finally:
+            if not waiters.done():
+                waiters.set_result(None)
+
+    async def flush(self):
+        """立即执行尚未执行的触发，用于关闭前保存状态"""
+        if self._task and not self._task.done():
+            if self._sleeping:
+                # 还在等待防抖时间，取消等待后立即执行
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            else:
+                await self._task
+        if self._pending is not None:
+            await self._execute()
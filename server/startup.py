@@ -0,0 +1,59 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('startup')
+
+
+class StartupTracker:
+    """记录启动过程中各组件的导入与初始化耗时，以及服务的预热状态
+
+    状态依次为 starting -> warming -> ready，预热出错时为 failed。
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.state = "starting"
+        self.components: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self._started_at = started_at or time.perf_counter()
+        self.ready_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def record(self, name: str, seconds: float):
+        self.components[name] = round(seconds, 3)
+        logger.info(f"Startup component {name} took {seconds:.3f}s")
+
+    @contextmanager
+    def step(self, name: str):
+        """记录一个组件的耗时（包括其中延迟导入的模块）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_warming(self):
+        self.state = "warming"
+
+    def mark_ready(self):
+        self.state = "ready"
+        self.ready_seconds = round(time.perf_counter() - self._started_at, 3)
+        logger.info(f"Service ready {self.ready_seconds:.3f}s after start")
+
+    def mark_failed(self, error: Exception):
+        self.state = "failed"
+        self.error = str(error)
+        logger.error(f"Startup failed: {self.error}")
+
+    def report(self) -> dict:
+        return {
+            "state": self.state,
+            "ready_seconds": self.ready_seconds,
+            "components": dict(self.components),
+            "error": self.error,
+        }
@@ -0,0 +1,37 @@
+"""测试使用 benchmarks/fakes.py 中的本地替身，不访问网络、不下载模型
+
+用法：cd server && python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_chroma import Chroma  # noqa: E402
+from advanced_query import AdvancedQueryEngine  # noqa: E402
+from embedding_backends import register_encoder_model  # noqa: E402
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, FakeEncoder  # noqa: E402
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    """创建使用本地替身的查询引擎，向量数据库位于临时目录"""
+    engines = []
+
+    def make(llm_latency: float = 0.01, **kwargs) -> AdvancedQueryEngine:
+        vectordb = Chroma(
+            collection_name=f"test{len(engines)}",
+            persist_directory=str(tmp_path / "db"),
+            embedding_function=FakeEmbeddings(size=64),
+        )
+        kwargs.setdefault("keyword_debounce_seconds", 0)
+        engine = AdvancedQueryEngine(vectordb=vectordb, llm=FakeChatModel(latency=llm_latency), **kwargs)
+        register_encoder_model(engine.encoder_model, FakeEncoder(size=64))
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.partitions.close()
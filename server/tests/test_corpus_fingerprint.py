@@ -0,0 +1,39 @@
+"""语料指纹随块的加入和删除增量更新，与重新读取所有块ID计算的结果一致"""
+import asyncio
+
+from keyword_store import CorpusFingerprint, _legacy_fingerprint
+
+
+def test_incremental_fingerprint_matches_full(make_engine):
+    engine = make_engine()
+    engine.vectordb.add_texts(["alpha beta", "gamma delta"], ids=["c1", "c2"])
+    engine.rebuild_lexical_index()
+
+    async def ingest():
+        engine.vectordb.add_texts(["epsilon"], ids=["c3"])
+        # c1 已经在语料中，不会重复计入
+        await engine.index_chunks(["c3", "c1"], ["epsilon", "alpha beta"])
+        engine.vectordb.delete(ids=["c1"])
+        await engine.remove_chunks(["c1"])
+
+    asyncio.run(ingest())
+
+    full = CorpusFingerprint.of(engine.partitions)
+    assert engine.corpus_fingerprint().value == full.value
+    assert full.count == 2
+
+
+def test_fingerprint_accepts_legacy_format():
+    fingerprint = CorpusFingerprint(["b", "a"])
+    assert fingerprint.value == CorpusFingerprint(["a", "b"]).value
+    assert not fingerprint.matches(_legacy_fingerprint(["a", "b"]))
+
+    class Corpus:
+        def get(self, include):
+            return {"ids": ["b", "a"]}
+
+    loaded = CorpusFingerprint.of(Corpus())
+    assert loaded.matches(_legacy_fingerprint(["a", "b"]))
+    assert loaded.matches(fingerprint.value)
+    loaded.add(["c"])
+    assert not loaded.matches(_legacy_fingerprint(["a", "b"]))
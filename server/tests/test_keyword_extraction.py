@@ -0,0 +1,46 @@
+"""关键词提取：按块并发调用 LLM，并发数受 keyword_concurrency 限制，各块的关键词合并去重"""
+import asyncio
+
+from advanced_query import AdvancedQueryEngine
+from benchmarks.fakes import FakeChatModel
+
+CHUNKS = 10
+
+
+def make_text(chunks: int) -> str:
+    # 每段约 3000 字符，提取时每段单独成为一个块；各段共用 vector、retrieval 两个词
+    return "\n\n".join(f"topic{i} vector retrieval " * 120 for i in range(chunks))
+
+
+def extract(concurrency: int, text: str):
+    engine = AdvancedQueryEngine(vectordb=None, llm=FakeChatModel(latency=0.02), keyword_concurrency=concurrency)
+    progress = []
+    keywords = asyncio.run(engine.extract_keywords(text, lambda done, total: progress.append((done, total))))
+    return engine.llm, keywords, progress
+
+
+def test_one_call_per_chunk_with_bounded_concurrency():
+    llm, _, progress = extract(4, make_text(CHUNKS))
+
+    assert llm.calls == CHUNKS
+    assert llm.max_active == 4
+    assert len(progress) == CHUNKS
+    assert progress[-1] == (CHUNKS, CHUNKS)
+
+
+def test_concurrency_one_is_sequential():
+    llm, _, _ = extract(1, make_text(3))
+
+    assert llm.calls == 3
+    assert llm.max_active == 1
+
+
+def test_keywords_deduplicated_across_chunks():
+    _, keywords, _ = extract(4, make_text(CHUNKS))
+
+    assert len(keywords) == len(set(keywords))
+    assert keywords.count("vector") == 1
+    assert keywords.count("retrieval") == 1
+    assert {f"topic{i}" for i in range(CHUNKS)} <= set(keywords)
+    # 提示词中的说明不会被当作关键词
+    assert all("关键词" not in keyword for keyword in keywords)
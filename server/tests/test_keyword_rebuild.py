@@ -0,0 +1,50 @@
+"""关键词库全量重建与导入并发时的一致性"""
+import asyncio
+
+from executors import run_in_thread
+
+# 超过一个提取块（4000 字符），并发数为 1 时重建需要多次串行调用 LLM
+DOC_A = ["alpha apple avocado " * 200, "alpha almond " * 200]
+DOC_B = ["bravo banana blueberry"]
+
+
+def test_upload_during_rebuild_keeps_keywords(make_engine):
+    engine = make_engine(llm_latency=0.05, keyword_concurrency=1)
+
+    async def scenario():
+        await run_in_thread(engine.vectordb.add_texts, DOC_A, [{"doc_id": "a"}] * len(DOC_A))
+        rebuild = asyncio.create_task(engine.update_keywords_from_docs())
+        while not engine._rebuild_lock.locked():
+            await asyncio.sleep(0)
+
+        # 重建期间导入新文档：块写入向量数据库后进入关键词阶段，等待重建完成后再合并
+        await run_in_thread(engine.vectordb.add_texts, DOC_B, [{"doc_id": "b"}])
+        await engine.add_document_keywords("b", DOC_B)
+        assert rebuild.done()
+
+    asyncio.run(scenario())
+
+    sources = engine.keyword_sources
+    assert "a" in sources["alpha"]
+    assert sources["bravo"] == {"b"}
+    assert sources["banana"] == {"b"}
+    assert len(engine.keywords) == len(sources)
+    assert len(engine.keyword_index.embeddings) == len(engine.keywords)
+
+
+def test_replace_during_rebuild_keeps_new_content(make_engine):
+    engine = make_engine(llm_latency=0.05, keyword_concurrency=1)
+
+    async def scenario():
+        await run_in_thread(engine.vectordb.add_texts, DOC_A, [{"doc_id": "a"}] * len(DOC_A))
+        rebuild = asyncio.create_task(engine.update_keywords_from_docs())
+        while not engine._rebuild_lock.locked():
+            await asyncio.sleep(0)
+        # 重新上传文档 a，新内容在重建之后替换旧关键词
+        await engine.replace_document_keywords("a", ["charlie cherry"])
+        assert rebuild.done()
+
+    asyncio.run(scenario())
+
+    assert engine.keyword_sources["charlie"] == {"a"}
+    assert "alpha" not in engine.keyword_sources
@@ -0,0 +1,79 @@
+"""查询的两条快速路径：相同的并发查询只执行一次，词法检索确定命中时不调用 LLM 和向量 API"""
+import asyncio
+
+from executors import run_in_thread
+from singleflight import SingleFlight
+
+CHUNKS = {
+    "c1": "alpha bravo charlie",
+    "c2": "delta echo foxtrot",
+    "c3": "golf hotel india",
+}
+
+
+def test_singleflight_runs_duplicate_calls_once():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert len(calls) == 1
+    assert flight.shared == 4
+
+
+def test_duplicate_concurrent_queries_call_engine_once(make_engine):
+    engine = make_engine(llm_latency=0.05)
+
+    async def scenario():
+        # 空白不同的同一个问题也会合并
+        queries = ["what is the capital of france", "what is  the capital of france "] * 3
+        return await asyncio.gather(*(engine.smart_query(query) for query in queries))
+
+    results = asyncio.run(scenario())
+
+    assert engine.llm.calls == 1
+    assert engine.inflight_queries.shared == 5
+    assert len({result.answer for result in results}) == 1
+
+
+async def index(engine):
+    ids, texts = list(CHUNKS), list(CHUNKS.values())
+    await run_in_thread(engine.vectordb.add_texts, texts, [{"doc_id": "a"}] * len(ids), ids=ids)
+    await engine.index_chunks(ids, texts)
+
+
+def test_lexical_hit_skips_llm_and_embeddings(make_engine):
+    engine = make_engine()
+
+    async def scenario():
+        await index(engine)
+        embed_calls = engine.vectordb.embeddings.calls
+        result = await engine.smart_query("charlie bravo alpha")
+        return result, engine.vectordb.embeddings.calls - embed_calls
+
+    result, embed_calls = asyncio.run(scenario())
+
+    assert result.source_type == "document"
+    assert result.answer == CHUNKS["c1"]
+    assert engine.llm.calls == 0
+    assert embed_calls == 0
+
+
+def test_without_lexical_fast_path_the_query_reaches_llm(make_engine):
+    engine = make_engine(lexical_fast_path_threshold=None)
+
+    async def scenario():
+        await index(engine)
+        return await engine.smart_query("charlie bravo alpha")
+
+    result = asyncio.run(scenario())
+
+    assert result.source_type == "llm"
+    assert engine.llm.calls == 1
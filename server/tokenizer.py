@@ -0,0 +1,102 @@
+import math
+import re
+import threading
+from typing import Optional
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('tokenizer')
+
+# 中日韩文字、英文单词与数字、其他单个字符（标点等）
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+_PIECE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]|[A-Za-z]+|\d+|\S")
+
+
+def _heuristic_cost(piece: str) -> float:
+    """估算一个片段的 token 数：中日韩文字每字约 1 个，英文单词约每 4 个字母 1 个，数字每 3 位 1 个"""
+    if _CJK.match(piece):
+        return 1.0
+    if piece.isalpha():
+        return max(1.0, len(piece) / 4)
+    if piece.isdigit():
+        return math.ceil(len(piece) / 3)
+    return 1.0
+
+
+class Tokenizer:
+    """本地计算 token 数
+
+    安装了 tiktoken 时使用模型对应的编码，精确计数；否则（或编码文件无法下载时）按字符类型估算。
+    backend 为 "tiktoken"、"heuristic" 或 "auto"（优先 tiktoken）。
+    """
+
+    def __init__(self, model: str = "gpt-3.5-turbo", backend: str = "auto"):
+        self.model = model
+        self.backend = backend
+        self._encoding = None
+        self._loaded = backend == "heuristic"
+        self._lock = threading.Lock()
+
+    def load(self) -> str:
+        """加载编码（tiktoken 首次使用时需要下载编码文件），返回实际使用的方式"""
+        with self._lock:
+            if not self._loaded:
+                try:
+                    import tiktoken
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    if self.backend == "tiktoken":
+                        raise
+                    logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+                self._loaded = True
+                logger.info(f"Tokenizer for {self.model}: {self.name}")
+        return self.name
+
+    @property
+    def name(self) -> str:
+        return "tiktoken" if self._encoding is not None else "heuristic"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        self.load()
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(sum(_heuristic_cost(m.group()) for m in _PIECE.finditer(text)))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截取文本开头不超过 max_tokens 个 token 的部分"""
+        if max_tokens <= 0:
+            return ""
+        self.load()
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+        used = 0.0
+        for match in _PIECE.finditer(text):
+            used += _heuristic_cost(match.group())
+            if used > max_tokens:
+                return text[:match.start()].rstrip()
+        return text
+
+
+_default: Optional[Tokenizer] = None
+
+
+def get_tokenizer() -> Tokenizer:
+    """进程内默认的分词器，由 configure_tokenizer() 设置"""
+    global _default
+    if _default is None:
+        _default = Tokenizer()
+    return _default
+
+
+def configure_tokenizer(model: str, backend: str = "auto") -> Tokenizer:
+    global _default
+    _default = Tokenizer(model, backend)
+    return _default
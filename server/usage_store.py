@@ -0,0 +1,246 @@
+import atexit
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('usage_store')
+
+# 每 1K token 的价格（美元）：(输入, 输出)；按模型名前缀匹配，最长的前缀优先
+# 可以通过 USAGE_PRICES 环境变量（JSON，如 {"gpt-4o": [0.0025, 0.01]}）补充或覆盖
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "text-embedding-ada-002": (0.0001, 0.0),
+    "text-embedding-3-small": (0.00002, 0.0),
+    "text-embedding-3-large": (0.00013, 0.0),
+}
+
+# 报表可以分组的维度
+DIMENSIONS = ("day", "endpoint", "source_type", "doc_id", "model", "kind", "purpose")
+
+# 当前请求或导入任务的归属信息（endpoint、doc_id），记录用量时写入每一条记录
+_usage_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("usage_context", default={})
+
+
+class BudgetExceeded(RuntimeError):
+    """本月用量已达到上限，拒绝新的导入"""
+
+
+def load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    for model, price in json.loads(os.getenv("USAGE_PRICES") or "{}").items():
+        prices[model] = (float(price[0]), float(price[1]) if len(price) > 1 else 0.0)
+    return prices
+
+
+def estimate_cost(prices: Dict[str, Tuple[float, float]], model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按模型价格估算费用；未知模型（如本地模型）按 0 计算"""
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return 0.0
+    input_price, output_price = prices[max(matches, key=len)]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+
+def month_start(now: Optional[float] = None) -> float:
+    """本地时间本月第一天零点的时间戳"""
+    today = datetime.fromtimestamp(now or time.time())
+    return today.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+class UsageStore:
+    """LLM 和向量 API 调用的本地用量记录，只追加不修改
+
+    每次调用记录一行：时间、类型（llm / embedding）、用途、模型、token 数、耗时、估算费用，
+    以及所属的接口、来源类型和文档。记录先放入内存缓冲区，由后台线程每隔 flush_interval 秒批量写入 SQLite，
+    调用方不等待磁盘写入；多个服务进程可以同时写入同一个文件。
+    gunicorn 预加载时在主进程中创建，fork 出的工作进程重新打开连接并启动自己的写入线程。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, monthly_budget: Optional[float] = None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.monthly_budget = monthly_budget or None
+        self.prices = load_prices()
+        self._buffer: List[tuple] = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._start()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                purpose TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                latency_ms REAL,
+                cost REAL NOT NULL,
+                endpoint TEXT,
+                source_type TEXT,
+                doc_id TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+        self._conn.commit()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        """打开数据库连接并启动写入线程"""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="usage-writer", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        """fork 出的子进程中没有父进程的写入线程，也不能复用父进程的连接和可能被持有的锁
+
+        缓冲区中已有的记录属于父进程，由父进程写入，子进程丢弃以免重复记录。
+        """
+        if self._stop.is_set():
+            return
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._start()
+
+    def record(
+        self,
+        kind: str,
+        purpose: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int = 0,
+        latency: Optional[float] = None,
+        source_type: Optional[str] = None,
+        doc_id: Optional[str] = None,
+    ) -> float:
+        """记录一次调用，返回估算费用；接口和文档未指定时取当前上下文中的值"""
+        context = _usage_context.get()
+        cost = estimate_cost(self.prices, model, prompt_tokens, completion_tokens)
+        row = (
+            time.time(), kind, purpose, model, prompt_tokens, completion_tokens,
+            round(latency * 1000, 1) if latency is not None else None, cost,
+            context.get("endpoint"), source_type, doc_id or context.get("doc_id"),
+        )
+        with self._buffer_lock:
+            self._buffer.append(row)
+        return cost
+
+    def flush(self):
+        """把缓冲区中的记录写入数据库"""
+        with self._write_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            try:
+                self._conn.executemany(f"INSERT INTO usage VALUES ({','.join('?' * 11)})", rows)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # 写入失败（如其他进程长时间锁住数据库）时放回缓冲区，下次再写
+                logger.error(f"Error writing {len(rows)} usage records: {str(e)}")
+                with self._buffer_lock:
+                    self._buffer[:0] = rows
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def spent(self, since: float) -> float:
+        """since 之后（包括其他进程记录）的估算费用合计"""
+        self.flush()
+        with self._write_lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(cost), 0) FROM usage WHERE ts >= ?", (since,)).fetchone()
+        return row[0]
+
+    def budget_status(self) -> Optional[dict]:
+        """本月的用量与上限，未设置上限时返回 None"""
+        if not self.monthly_budget:
+            return None
+        spent = self.spent(month_start())
+        return {"spent": round(spent, 4), "budget": self.monthly_budget, "exceeded": spent >= self.monthly_budget}
+
+    def check_budget(self):
+        """本月用量达到上限时抛出 BudgetExceeded"""
+        status = self.budget_status()
+        if status and status["exceeded"]:
+            raise BudgetExceeded(
+                f"本月用量 ${status['spent']:.2f} 已达到上限 ${status['budget']:.2f}，暂停导入新文档"
+            )
+
+    def report(self, dimension: str, since: float = 0.0) -> List[dict]:
+        """按维度分组汇总 since 之后的用量，按费用从高到低排列（按天分组时按日期排列）"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension} (expected one of {', '.join(DIMENSIONS)})")
+        key = "date(ts, 'unixepoch', 'localtime')" if dimension == "day" else f"COALESCE({dimension}, '-')"
+        order = "key" if dimension == "day" else "cost DESC"
+        self.flush()
+        with self._write_lock:
+            rows = self._conn.execute(f"""
+                SELECT {key} AS key, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens),
+                       SUM(cost) AS cost, AVG(latency_ms)
+                FROM usage WHERE ts >= ? GROUP BY key ORDER BY {order}
+            """, (since,)).fetchall()
+        return [
+            {
+                dimension: key, "calls": calls, "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens, "cost": cost, "avg_latency_ms": latency,
+            }
+            for key, calls, prompt_tokens, completion_tokens, cost, latency in rows
+        ]
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        with self._write_lock:
+            self._conn.close()
+
+
+_store: Optional[UsageStore] = None
+
+
+def get_usage_store() -> Optional[UsageStore]:
+    return _store
+
+
+def configure_usage_store(path: str, monthly_budget: Optional[float] = None) -> UsageStore:
+    """设置进程内记录用量的存储，之后的 record_usage() 都写入这里"""
+    global _store
+    _store = UsageStore(path, monthly_budget=monthly_budget)
+    # 进程退出时写入缓冲区中剩余的记录
+    atexit.register(_store.close)
+    return _store
+
+
+def record_usage(kind: str, purpose: str, model: str, prompt_tokens: int, completion_tokens: int = 0, **kwargs):
+    """记录一次 API 调用的用量；没有配置存储时（如基准测试）不记录"""
+    if _store is not None:
+        _store.record(kind, purpose, model, prompt_tokens, completion_tokens, **kwargs)
+
+
+@contextmanager
+def usage_context(**fields):
+    """在代码块内产生的用量记录上标注 endpoint、doc_id 等归属信息，嵌套时合并"""
+    token = _usage_context.set({**_usage_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from pydantic import BaseModel
+from logger_config import setup_logger
+
+# 设置日志记录器
+logger = setup_logger('vector_partitions')
+
+# 分区0（原来的集合）的元数据中记录分区数的键
+PARTITIONS_KEY = "vector_partitions"
+
+# 分区0的元数据中记录块元数据版本的键：2 表示所有块都带有 source_type
+CHUNK_METADATA_KEY = "chunk_metadata_version"
+CHUNK_METADATA_VERSION = 2
+
+# 检索时读取的块字段
+QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+
+
+class PartitionLayoutMismatch(RuntimeError):
+    """向量库的分区数与配置不一致，需要先用 reindex.py --partitions 重新分区"""
+
+
+def partition_name(base: str, index: int) -> str:
+    """分区对应的集合名：分区0就是原来的集合"""
+    return base if index == 0 else f"{base}_p{index}"
+
+
+def partition_of(doc_id: str, count: int) -> int:
+    """文档所在的分区：按文档ID的哈希分配，与进程和启动顺序无关"""
+    return zlib.crc32(doc_id.encode("utf-8")) % count if count > 1 else 0
+
+
+def source_type_of(filename: str) -> str:
+    """块元数据中的来源类型：文件扩展名，小写、不带点"""
+    return os.path.splitext(filename)[1].lower().lstrip(".")
+
+
+class QueryFilter(BaseModel):
+    """查询的检索范围：文档、来源类型和页码范围，未设置（或为空）的条件不限制
+
+    页码与 PDF 块元数据中的 page 相同，从 0 开始；没有页码的块（非 PDF 文档）不满足页码条件。
+    """
+    doc_ids: Optional[List[str]] = None
+    source_types: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return not self.doc_ids and not self.source_types and self.page_from is None and self.page_to is None
+
+    def where(self) -> Optional[dict]:
+        """来源类型和页码条件对应的 Chroma where 条件；文档范围由调用方按块ID限定"""
+        conditions = []
+        if self.source_types:
+            conditions.append({"source_type": {"$in": [t.lower().lstrip(".") for t in self.source_types]}})
+        if self.page_from is not None:
+            conditions.append({"page": {"$gte": self.page_from}})
+        if self.page_to is not None:
+            conditions.append({"page": {"$lte": self.page_to}})
+        return combine_where(conditions)
+
+    def key(self) -> str:
+        """用于合并相同的并发查询"""
+        return json.dumps(self.model_dump(exclude_none=True), sort_keys=True, ensure_ascii=False)
+
+
+def combine_where(conditions: List[dict]) -> Optional[dict]:
+    conditions = [c for c in conditions if c]
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class SearchScope(BaseModel):
+    """由 QueryFilter 解析出的检索范围：where 条件、允许的块ID（None 表示不限）和需要检索的分区（None 表示全部）"""
+    where: Optional[dict] = None
+    ids: Optional[List[str]] = None
+    partitions: Optional[List[int]] = None
+
+
+class VectorPartitions:
+    """把块分布在多个 Chroma 集合（分区）中，检索时并行查询各分区后按距离合并
+
+    文档按文档ID的哈希分配到分区，文档的所有块都写入它所在的分区；内容相同的块属于不同分区的文档时，
+    每个分区各存一份，同一分区内只存一份。限定了文档范围的查询只检索这些文档所在的分区。
+    分区0就是原来的集合，分区数为 1 时与不分区完全相同。
+    """
+
+    def __init__(self, vectordb, count: int = 1):
+        self.vectordb = vectordb
+        self.count = max(1, count)
+        self._collections: Dict[int, object] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def embedding_function(self):
+        return self.vectordb._embedding_function
+
+    def collection(self, index: int):
+        """分区对应的 Chroma 集合，首次使用时创建；新分区沿用分区0的距离函数和向量模型记录"""
+        collection = self._collections.get(index)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(index)
+                if collection is None:
+                    base = self.vectordb._collection
+                    if index == 0:
+                        collection = base
+                    else:
+                        metadata = {
+                            k: v for k, v in (base.metadata or {}).items()
+                            if k not in (PARTITIONS_KEY, CHUNK_METADATA_KEY)
+                        }
+                        collection = self.vectordb._client.get_or_create_collection(
+                            partition_name(base.name, index), metadata=metadata or None
+                        )
+                    self._collections[index] = collection
+        return collection
+
+    def similarity(self, distance: float) -> float:
+        """把检索返回的距离换算成相似度（越大越相关），向量为单位向量时等于余弦相似度"""
+        space = (self.collection(0).metadata or {}).get("hnsw:space", "l2")
+        # Chroma 的 l2 距离是欧氏距离的平方，单位向量之间为 2 - 2cos；cosine 和 ip 距离为 1 - 内积
+        return 1.0 - distance / 2 if space == "l2" else 1.0 - distance
+
+    def partition_of(self, doc_id: str) -> int:
+        return partition_of(doc_id, self.count)
+
+    def partitions_of(self, doc_ids: Iterable[str]) -> List[int]:
+        return sorted({self.partition_of(doc_id) for doc_id in doc_ids})
+
+    def ensure_layout(self):
+        """检查向量库的分区数与配置一致
+
+        尚未记录分区数的集合：非空的是不分区的旧向量库（1 个分区），空的记录为当前配置。
+        分区数不一致时抛出 PartitionLayoutMismatch，否则部分文档会在错误的分区中查找和写入。
+        """
+        base = self.collection(0)
+        metadata = base.metadata or {}
+        recorded = metadata.get(PARTITIONS_KEY)
+        if recorded is None:
+            recorded = 1 if base.count() > 0 else self.count
+            base.modify(metadata={**metadata, PARTITIONS_KEY: recorded})
+            logger.info(f"Recorded {recorded} vector partitions for collection {base.name}")
+        if recorded != self.count:
+            raise PartitionLayoutMismatch(
+                f"Vector store has {recorded} partitions, but VECTOR_PARTITIONS={self.count} is configured; "
+                f"run `python reindex.py --partitions {self.count}` to redistribute the chunks"
+            )
+
+    def count_chunks(self) -> int:
+        """各分区的块数之和，同时属于多个分区的块按份数计算"""
+        return sum(self.collection(i).count() for i in range(self.count))
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="partition")
+        return self._pool
+
+    def _map(self, func, indices: List[int]) -> list:
+        """对各分区执行 func(分区号)；多个分区时在分区线程池中并行执行，结果顺序与 indices 一致"""
+        if len(indices) == 1:
+            return [func(indices[0])]
+        return list(self._executor().map(func, indices))
+
+    def _indices(self, partitions: Optional[Iterable[int]]) -> List[int]:
+        return list(range(self.count)) if partitions is None else sorted(set(partitions))
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[dict] = None,
+        include: Iterable[str] = ("documents", "metadatas"),
+        partitions: Optional[Iterable[int]] = None,
+    ) -> dict:
+        """从各分区读取块并合并，同一个块只返回一次；返回格式与 Chroma 的 get 相同"""
+        include = list(include)
+        indices = self._indices(partitions)
+        results = self._map(lambda i: self.collection(i).get(ids=ids, where=where, include=include), indices)
+        if len(results) == 1:
+            return results[0]
+        merged = {"ids": [], **{key: [] for key in include}}
+        seen = set()
+        for result in results:
+            for j, chunk_id in enumerate(result["ids"]):
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                merged["ids"].append(chunk_id)
+                for key in include:
+                    merged[key].append(result[key][j])
+        return merged
+
+    def query(
+        self,
+        query_embeddings,
+        k: int,
+        where: Optional[dict] = None,
+        ids: Optional[List[str]] = None,
+        partitions: Optional[Iterable[int]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """在各分区中检索，按距离合并，返回每个查询最近的 k 个 (Document, 距离)
+
+        给出 ids 时只在这些块中检索，partitions 限定检索的分区。
+        """
+        embeddings = np.asarray(query_embeddings, dtype=np.float32).tolist()
+        if ids is not None and not ids:
+            return [[] for _ in embeddings]
+
+        def search(index: int) -> Optional[dict]:
+            collection = self.collection(index)
+            if ids is None:
+                return collection.query(query_embeddings=embeddings, n_results=k, where=where, include=QUERY_INCLUDE)
+            # Chroma 按 ids 检索时不允许出现分区中不存在的块，先取出分区中存在且满足条件的块
+            scope = collection.get(ids=ids, where=where, include=[])["ids"]
+            if not scope:
+                return None
+            return collection.query(
+                query_embeddings=embeddings, n_results=min(k, len(scope)), ids=scope, include=QUERY_INCLUDE
+            )
+
+        results = [result for result in self._map(search, self._indices(partitions)) if result is not None]
+        batches = []
+        for q in range(len(embeddings)):
+            candidates = [
+                candidate
+                for result in results
+                for candidate in zip(
+                    result["ids"][q], result["documents"][q], result["metadatas"][q], result["distances"][q]
+                )
+            ]
+            if len(results) > 1:
+                candidates.sort(key=lambda candidate: candidate[3])
+            seen = set()
+            batch = []
+            for chunk_id, content, metadata, distance in candidates:
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                batch.append((Document(page_content=content, metadata=metadata or {}), distance))
+                if len(batch) >= k:
+                    break
+            batches.append(batch)
+        return batches
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None